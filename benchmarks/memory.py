@@ -0,0 +1,27 @@
+import argparse
+import tracemalloc
+
+from notebook.cell import Cell
+
+def measure_cell(size):
+    """
+    Returns the number of bytes allocated to store a Cell with the given number of
+    characters, which are typed one at a time at the end of the cell.
+    """
+    text = "".join(chr(ord("a") + i % 26) for i in range(size))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    cell = Cell(id="alice:55101")
+    cell.append_text(text)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert cell.get_text() == text
+    return after - before
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the memory used per character in a Cell')
+    parser.add_argument('--size', type=int, default=2000, help='Number of characters in the cell')
+    args = parser.parse_args()
+
+    size = measure_cell(args.size)
+    print("{} characters: {} bytes, {:.1f} bytes per character".format(args.size, size, size / args.size))
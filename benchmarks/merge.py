@@ -0,0 +1,54 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pickle
+import time
+
+from notebook.notebook import DistributedNotebook
+
+def make_replicas(cells, size):
+    """
+    Returns two replicas of a notebook with the given number of cells, in which each
+    replica typed size characters into every cell since they last synced.
+    """
+    base = DistributedNotebook(id="alice")
+    for i in range(cells):
+        base.create_cell()
+    replicas = []
+    for name in ["alice", "bob"]:
+        # Merging sets the ID of the replica on the cells
+        replica = DistributedNotebook(id=name)
+        replica.merge(pickle.loads(pickle.dumps(base)))
+        for i in range(cells):
+            replica.edit_cell(i, [(0, name[0] * size, 0)])
+        replicas.append(pickle.dumps(replica))
+    return replicas
+
+def measure_merge(replicas, executor=None):
+    """
+    Returns the number of seconds taken to merge the second replica into the first.
+    The replicas are unpickled first, and the cells are decoded before the merge.
+    """
+    local, remote = [pickle.loads(data) for data in replicas]
+    local.get_cell_data()
+    remote.get_cell_data()
+    start = time.perf_counter()
+    local.merge(remote, executor=executor, threshold=0)
+    return time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare sequential and parallel merges of notebook cells')
+    parser.add_argument('--cells', type=int, default=16, help='Number of cells changed by both replicas')
+    parser.add_argument('--sizes', type=int, nargs="*", default=[10, 100, 1000, 5000],
+                        help='Numbers of characters typed into every cell by each replica')
+    parser.add_argument('--workers', type=int, default=4, help='Number of processes')
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as processes:
+        # Start the worker processes before measuring
+        list(processes.map(abs, range(args.workers)))
+        print("{:>10} {:>10} {:>12} {:>12}".format("ops", "size", "sequential", "processes"))
+        for size in args.sizes:
+            replicas = make_replicas(args.cells, size)
+            timings = [measure_merge(replicas, executor) for executor in (None, processes)]
+            print("{:>10} {:>10} {:>11.1f}ms {:>11.1f}ms".format(
+                2 * args.cells * size, size, *[timing * 1000 for timing in timings]))
@@ -1,11 +1,16 @@
+import os
 import sys
 import argparse
-from tkinter.ttk import Notebook
 
-from ui.editor import NotebookEditor
-from client.client import NotebookClient
+from client.client import DEFAULT_NOTEBOOK, NotebookClient
+from client.gossip import GossipScheduler
+from client.stats import format_stats
+from client.storage import NotebookStore
+from crdt.columnar import ColumnarTree
+from crdt.tree import ObjectTree
 
-def start_notebook(listen, peers, name):
+def create_client(listen, peers, name, merge_workers=0, data=None, notebook=DEFAULT_NOTEBOOK, cell_budget=None,
+                  local=False, columnar=False):
     host_parts = listen.split(":")
     if len(host_parts) == 1:
         hostname = "localhost"
@@ -13,16 +18,113 @@ def start_notebook(listen, peers, name):
     elif len(host_parts) == 2:
         hostname = host_parts[0]
         port = int(host_parts[1])
-    client = NotebookClient(port, peers, name=name, hostname=hostname)
+    merge_executor = None
+    if merge_workers > 0:
+        # Imported here since multiprocessing is only needed for parallel merges
+        from concurrent.futures import ProcessPoolExecutor
+        merge_executor = ProcessPoolExecutor(max_workers=merge_workers)
+    store = NotebookStore(data) if data is not None else None
+    registry = None
+    if local:
+        # Imported here since the shared memory transport is only available on POSIX
+        # systems
+        from client.local import LocalRegistry
+        registry = LocalRegistry()
+    spill_directory = None
+    if cell_budget is not None:
+        # The budget is given in megabytes, and evicted cells are kept with the data
+        cell_budget = int(cell_budget * 1024 * 1024)
+        if data is not None:
+            spill_directory = os.path.join(data, "cells")
+    return NotebookClient(port, peers, name=name, hostname=hostname, merge_executor=merge_executor, store=store,
+                          notebook_id=notebook, cell_budget=cell_budget, spill_directory=spill_directory,
+                          registry=registry, cell_storage=ColumnarTree if columnar else ObjectTree)
+
+def start_gossip(client, gossip):
+    """
+    Starts a background gossip scheduler if gossip is a (min_interval, max_interval)
+    tuple, and returns it.
+    """
+    if gossip is None:
+        return None
+    scheduler = GossipScheduler(client, min_interval=gossip[0], max_interval=gossip[1])
+    scheduler.start()
+    return scheduler
+
+def start_notebook(listen, peers, name, merge_workers=0, data=None, notebook=DEFAULT_NOTEBOOK, gossip=None,
+                   cell_budget=None, local=False, columnar=False):
+    # The UI is imported here so that headless daemons never import tkinter
+    from ui.editor import NotebookEditor
+
+    client = create_client(listen, peers, name, merge_workers=merge_workers, data=data, notebook=notebook,
+                           cell_budget=cell_budget, local=local, columnar=columnar)
     client.host()
     editor = NotebookEditor(client=client)
+    scheduler = start_gossip(client, gossip)
     editor.start()
+    if scheduler is not None:
+        scheduler.stop()
+    if client.store is not None:
+        client.save()
+
+def start_daemon(listen, peers, name, merge_workers=0, data=None, gossip=None, cell_budget=None, local=False,
+                 columnar=False):
+    """
+    Runs a headless client which only listens for sync requests, e.g. as an always-on
+    relay or backup peer. The daemon hosts every notebook which is synced with it. This
+    blocks until the process is interrupted.
+    """
+    client = create_client(listen, peers, name, merge_workers=merge_workers, data=data, cell_budget=cell_budget,
+                           local=local, columnar=columnar)
+    listener = client.host()
+    scheduler = start_gossip(client, gossip)
+    try:
+        while listener.is_alive():
+            listener.join(1)
+    except KeyboardInterrupt:
+        pass
+    if scheduler is not None:
+        scheduler.stop()
+    if client.store is not None:
+        client.save_all()
+
+def print_stats(address):
+    """
+    Prints the sync statistics of a running client on the same host, given as
+    hostname:port or port.
+    """
+    host_parts = address.split(":")
+    hostname = host_parts[0] if len(host_parts) == 2 else "localhost"
+    client = NotebookClient(0, ["client:{}:{}".format(hostname, host_parts[-1])], name="stats")
+    print(format_stats(client.query_stats("client")))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Collaborative Notebook Client')
     parser.add_argument('--listen', type=str, default='alice:55101', help='hostname:port to listen on for sync requests')
-    parser.add_argument('--peers', type=str, nargs="*", default='bob:55102 carol:55103', help='Remote peers to sync with')
+    parser.add_argument('--peers', type=str, nargs="*", default=['bob:55102', 'carol:55103'], help='Remote peers to sync with')
     parser.add_argument('--name', type=str, default='alice', help='Client name')
+    parser.add_argument('--merge-workers', type=int, default=0, help='Number of processes used to merge cells in parallel')
+    parser.add_argument('--headless', action='store_true', help='Run as a sync daemon without the UI')
+    parser.add_argument('--data', type=str, default=None, help='Directory to persist the notebooks in')
+    parser.add_argument('--notebook', type=str, default=DEFAULT_NOTEBOOK, help='ID of the notebook to edit')
+    parser.add_argument('--gossip', type=float, nargs=2, default=None, metavar=('MIN', 'MAX'),
+                        help='Sync with random peers in the background every MIN to MAX seconds')
+    parser.add_argument('--stats', type=str, default=None, metavar='HOSTNAME:PORT',
+                        help='Print the sync statistics of a running client and exit')
+    parser.add_argument('--cell-budget', type=float, default=None, metavar='MB',
+                        help='Memory budget for the decoded cells of each notebook, beyond which cells are evicted to disk')
+    parser.add_argument('--local', action='store_true',
+                        help='Exchange messages with peers on the same host through shared memory')
+    parser.add_argument('--columnar', action='store_true',
+                        help='Store the cells created by this client in columnar arrays, which use less memory')
 
     args = parser.parse_args()
-    start_notebook(args.listen, args.peers, args.name)
\ No newline at end of file
+    if args.stats is not None:
+        print_stats(args.stats)
+    elif args.headless:
+        start_daemon(args.listen, args.peers, args.name, merge_workers=args.merge_workers, data=args.data,
+                     gossip=args.gossip, cell_budget=args.cell_budget, local=args.local, columnar=args.columnar)
+    else:
+        start_notebook(args.listen, args.peers, args.name, merge_workers=args.merge_workers, data=args.data,
+                       notebook=args.notebook, gossip=args.gossip, cell_budget=args.cell_budget, local=args.local,
+                       columnar=args.columnar)
@@ -1,18 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import ipaddress
 import pickle
+import queue
+import selectors
 import socket
 import threading
+import time
 
+from client.connection import ConnectionPool
+from client.stats import SyncStats
+from crdt.tree import ObjectTree
+from notebook.cell import text_edits
 from notebook.notebook import DistributedNotebook
+from notebook.residency import CellResidency
 
 RECV_BUFFER = 1024
 
+# ID of the notebook which is used when no notebook ID is specified
+DEFAULT_NOTEBOOK = "default"
+
+# Number of threads which handle incoming connections
+DEFAULT_WORKERS = 8
+
+# Seconds after which an idle incoming connection is closed
+IDLE_TIMEOUT = 30
+
+# Seconds to wait for each socket operation when syncing with all the peers
+DEFAULT_SYNC_TIMEOUT = 10
+
+# Maximum number of peers which are synced with concurrently
+DEFAULT_SYNC_PARALLELISM = 4
+
+class SyncResult():
+    """
+    The result of syncing a notebook with a peer in NotebookClient.sync_all().
+    """
+    def __init__(self, peer):
+        self.peer = peer
+        # True if the response of the peer changed the notebook
+        self.changed = False
+        # The exception raised if the sync failed
+        self.error = None
+        # Seconds from the start of the sync until the response was merged
+        self.elapsed = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return "{}: {}".format(self.peer, "changed" if self.changed else "in sync")
+        return "{}: failed ({})".format(self.peer, str(self.error) or type(self.error).__name__)
+
+class HostedNotebook():
+    """
+    A notebook hosted by a NotebookClient together with the lock which protects it.
+    """
+    def __init__(self, notebook_id, notebook):
+        self.id = notebook_id
+        self.notebook = notebook
+        self.lock = threading.Lock()
+
+    @property
+    def version(self):
+        """
+        Changes whenever the notebook changes, so that other threads can tell cheaply
+        whether the notebook changed, see Sequence.revision.
+        """
+        return self.notebook.revision
+
 class NotebookClient():
     """
     NotebookClient handles syncing with remote peers to implement asynchronous
-    collaboration.
+    collaboration. A client can host any number of notebooks, which are identified by
+    a notebook ID and share the listener, the connections to the peers and the store.
+    Methods which take a notebook_id use the client's default notebook if it is None.
     """
 
-    def __init__(self, port, peers, name="alice", hostname="localhost"):
+    def __init__(self, port, peers, name="alice", hostname="localhost", merge_executor=None, store=None,
+                 notebook_id=DEFAULT_NOTEBOOK, workers=DEFAULT_WORKERS, cell_budget=None, spill_directory=None,
+                 registry=None, cell_storage=ObjectTree):
         self.port = int(port)
         self.peers = {}
         for peer in peers:
@@ -25,45 +94,192 @@ class NotebookClient():
                 raise ValueError("Invalid peer format: {}".format(peer))
         self.name = name
         self.hostname = hostname
-        self.notebook = DistributedNotebook(id=name+":"+str(port))
-        # The client listens and responds to sync messages on another thread.
-        # Therefore, notebook accesses are critical sections and must be protected by a
-        # lock to prevent concurrent access.
+        # The replica ID identifies the operations made by this client in every notebook
+        self.replica_id = name+":"+str(port)
+        self.notebook_id = notebook_id
+        # Optional NotebookStore used to persist the notebooks between restarts
+        self.store = store
+        # Optional memory budget in bytes for the decoded cells of each notebook, beyond
+        # which cells are evicted to files in the spill directory, see CellResidency
+        self.cell_budget = cell_budget
+        self.spill_directory = spill_directory
+        # The storage engine of the cells created by this client, e.g. ColumnarTree
+        self.cell_storage = cell_storage
+        # The client listens and responds to sync messages on other threads. Therefore,
+        # notebook accesses are critical sections and must be protected by the lock of
+        # the notebook. The client lock only protects the table of hosted notebooks.
+        self.notebooks = {}
         self.lock = threading.Lock()
+        self.open_notebook(notebook_id)
         self.editor = None
+        # Optional ProcessPoolExecutor used to merge the cells in parallel
+        self.merge_executor = merge_executor
+        # Optional LocalRegistry through which replicas on the same host find each other
+        # and exchange messages in shared memory, see SharedChannel
+        self.registry = registry
+        self.pool = ConnectionPool(registry=registry)
+        self.workers = workers
+        # Connections with an incoming message, which are handled by the workers
+        self.connections = queue.Queue()
+        # Connections returned by the workers, which the listener waits on again
+        self.returned = queue.Queue()
+        self.wakeup = None
+        # The listener and worker threads, which are stopped by close()
+        self.threads = []
+        self.closed = threading.Event()
+        # Timings of the sync phases and traffic counters, see client.stats
+        self.stats = SyncStats()
+
+    @property
+    def notebook(self):
+        """
+        The default notebook.
+        """
+        return self.notebooks[self.notebook_id].notebook
+
+    def open_notebook(self, notebook_id=None):
+        """
+        Returns the HostedNotebook with the given ID. Notebooks which are not hosted yet
+        are loaded from the store, or created if they have not been stored.
+        """
+        if notebook_id is None:
+            notebook_id = self.notebook_id
+        with self.lock:
+            hosted = self.notebooks.get(notebook_id)
+            if hosted is None:
+                notebook = None
+                if self.store is not None:
+                    notebook = self.store.load(notebook_id)
+                if notebook is None:
+                    notebook = DistributedNotebook(id=self.replica_id)
+                notebook.cell_storage = self.cell_storage
+                if self.cell_budget is not None:
+                    notebook.set_residency(CellResidency(self.cell_budget, self.spill_directory))
+                hosted = HostedNotebook(notebook_id, notebook)
+                self.notebooks[notebook_id] = hosted
+            return hosted
+
+    def get_version(self, notebook_id=None):
+        """
+        Returns the version of a notebook, which changes whenever the notebook changes.
+        """
+        return self.open_notebook(notebook_id).version
+
+    def get_notebook_ids(self):
+        """
+        Returns the IDs of the hosted notebooks.
+        """
+        with self.lock:
+            return list(self.notebooks.keys())
 
     def attach_editor(self, editor):
         """
-        Attaches a NotebookEditor to the client to enable editor updates from listen().
+        Attaches a NotebookEditor to the client to enable editor updates when the
+        default notebook is changed by a sync. Note that the editor is notified from
+        the thread which ran the sync.
         """
         self.editor = editor
 
+    @contextmanager
+    def locked(self, hosted):
+        """
+        Acquires the lock of a hosted notebook, recording how long it took to acquire.
+        """
+        start = time.perf_counter()
+        with hosted.lock:
+            self.stats.record("lock_wait", time.perf_counter() - start)
+            yield
+
     def get_peers(self):
         """
         Returns the list of peer names.
         """
         return list(self.peers.keys())
-    
+
     def host(self):
         """
-        Starts a listener thread to receive sync messages from remote peers.
+        Binds the listening socket and starts the threads which receive sync messages
+        from remote peers. Returns the thread which accepts the connections.
         """
-        listen = threading.Thread(target=self.listen, args=(self.port,))
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind((self.hostname, self.port))
+        server.listen()
+        # The port is only known after binding if port 0 was requested
+        self.port = server.getsockname()[1]
+        print("Listening on port {}".format(self.port))
+        # The workers wake up the listener through this socket pair when they return a
+        # connection
+        self.wakeup = socket.socketpair()
+        local = None
+        if self.registry is not None:
+            # Imported here since the shared memory transport is only available on
+            # POSIX systems
+            from client.local import bind_local
+            local = bind_local(self.registry, self.port)
+        for _ in range(self.workers):
+            worker = threading.Thread(target=self.work, daemon=True)
+            worker.start()
+            self.threads.append(worker)
+        listen = threading.Thread(target=self.listen, args=(server, local), daemon=True)
         listen.start()
+        self.threads.append(listen)
+        return listen
+
+    def close(self, timeout=5):
+        """
+        Stops the listener and worker threads started by host(), and closes the open
+        connections and the local socket. Requests which are being handled are
+        completed first.
+        """
+        self.closed.set()
+        for _ in range(self.workers):
+            self.connections.put(None)
+        if self.wakeup is not None:
+            self.wakeup[1].send(b"\0")
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+        # Connections which were not handled or not waited on again
+        for connections in (self.connections, self.returned):
+            while not connections.empty():
+                conn = connections.get()
+                if conn is not None:
+                    conn.close()
+        if self.wakeup is not None:
+            for sock in self.wakeup:
+                sock.close()
+            self.wakeup = None
+        self.pool.close()
 
     def send_bytes(self, sock, data):
         """
         Send data over a socket.
         """
+        if not isinstance(sock, socket.socket):
+            # A SharedChannel, see client.local
+            sock.send_bytes(data)
+            return
         size = len(data).to_bytes(4, byteorder='big')
-        sock.sendall(size)
-        sock.sendall(data)
+        # The size and the data are sent together, since sending them separately makes
+        # the peer wait for a delayed acknowledgement (Nagle's algorithm)
+        sock.sendall(size + data)
 
     def recv_bytes(self, sock):
         """
-        Receive data from a socket.
+        Receive data from a socket. Returns empty bytes if the connection was closed
+        before a message was received. The data received from a SharedChannel is a
+        memoryview of its segment, see SharedChannel.recv_bytes().
         """
-        size = sock.recv(4)
+        if not isinstance(sock, socket.socket):
+            return sock.recv_bytes()
+        size = b''
+        while len(size) < 4:
+            buffer = sock.recv(4 - len(size))
+            if not buffer:
+                if size:
+                    raise EOFError("Connection closed")
+                return b''
+            size += buffer
         size = int.from_bytes(size, byteorder='big')
         data = b''
         while len(data) < size:
@@ -73,69 +289,425 @@ class NotebookClient():
             data += buffer
         return data
 
-    def listen(self, port):
+    def listen(self, server, local=None):
         """
-        Listens for sync messages from remote peers.
+        Accepts connections from remote peers and waits for messages on the open
+        connections. A connection is handed to a worker thread when a message arrives
+        and the worker returns it once it has replied, so that idle connections kept
+        open by the peers' connection pools do not tie up the workers. Connections
+        which are idle for longer than IDLE_TIMEOUT are closed. Replicas on the same
+        host connect to the local Unix socket instead, if there is one.
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind((self.hostname, port))
-            s.listen()
-            print("Listening on port {}".format(port))
-            while True:
-                conn, addr = s.accept()
-                with conn:
-                    while True:
-                        data = self.recv_bytes(conn)
-                        if not data:
-                            break
-                        remote = pickle.loads(data)
+        selector = selectors.DefaultSelector()
+        selector.register(server, selectors.EVENT_READ)
+        if local is not None:
+            from client.local import SharedChannel, unbind_local
+            selector.register(local, selectors.EVENT_READ)
+        selector.register(self.wakeup[0], selectors.EVENT_READ)
+        # The time at which each open connection became idle
+        idle = {}
+        try:
+            while not self.closed.is_set():
+                now = time.monotonic()
+                for key, events in selector.select(timeout=1):
+                    sock = key.fileobj
+                    if sock is server:
+                        conn, addr = server.accept()
+                        selector.register(conn, selectors.EVENT_READ)
+                        idle[conn] = now
+                    elif sock is local:
+                        conn = SharedChannel(local.accept()[0])
+                        selector.register(conn, selectors.EVENT_READ)
+                        idle[conn] = now
+                    elif sock is self.wakeup[0]:
+                        sock.recv(RECV_BUFFER)
+                        while not self.returned.empty():
+                            conn = self.returned.get()
+                            selector.register(conn, selectors.EVENT_READ)
+                            idle[conn] = now
+                    else:
+                        selector.unregister(sock)
+                        del idle[sock]
+                        self.connections.put(sock)
 
-                        with self.lock:
-                            self.notebook.merge(remote)
-                            self.send_bytes(conn, pickle.dumps(self.notebook))
-                        self.editor.render()
+                for conn, since in list(idle.items()):
+                    if now - since > IDLE_TIMEOUT:
+                        selector.unregister(conn)
+                        del idle[conn]
+                        conn.close()
+        finally:
+            selector.close()
+            for conn in idle:
+                conn.close()
+            server.close()
+            if local is not None:
+                path = local.getsockname()
+                local.close()
+                unbind_local(self.registry, self.port, path)
 
-    def sync(self, peer):
+    def work(self):
         """
-        Sends a sync message to a remote peer.
+        Handles the messages received by the listener.
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect(self.peers[peer])
+        while True:
+            conn = self.connections.get()
+            if conn is None:
+                # Stopped by close()
+                return
+            try:
+                keep = self.handle_request(conn)
+            except (OSError, EOFError) as e:
+                print("Connection failed: {}".format(e))
+                keep = False
+            if keep:
+                self.returned.put(conn)
+                self.wakeup[1].send(b"\0")
+            else:
+                conn.close()
 
-            with self.lock:
-                self.send_bytes(s, pickle.dumps(self.notebook))
+    def handle_request(self, conn):
+        """
+        Responds to a message received on a connection. Returns False if the peer closed
+        the connection instead.
+        """
+        # A peer which stops sending in the middle of a message must not block the
+        # worker forever
+        conn.settimeout(IDLE_TIMEOUT)
+        stats = self.stats
+        with stats.timer("listen.receive"):
+            data = self.recv_bytes(conn)
+        if not data:
+            return False
+        received = len(data)
+        with stats.timer("listen.deserialize"):
+            try:
+                message = pickle.loads(data)
+            finally:
+                if isinstance(data, memoryview):
+                    # The peer reuses the segment once it receives the reply
+                    data.release()
+        if message.get("type") == "stats" and is_local(conn):
+            # Statistics are only reported to processes on the same host
+            reply = {"type": "stats", "stats": stats.snapshot()}
+        else:
+            reply = self.handle_message(message)
+        with stats.timer("listen.serialize"):
+            reply = pickle.dumps(reply)
+        with stats.timer("listen.send"):
+            self.send_bytes(conn, reply)
+        stats.count("listen.messages")
+        stats.count("listen.bytes_received", received + 4)
+        stats.count("listen.bytes_sent", len(reply) + 4)
+        return True
 
-            data = self.recv_bytes(s)
-            remote = pickle.loads(data)
-            
-            with self.lock:
-                self.notebook.merge(remote)
+    def handle_message(self, message):
+        """
+        Handles a message from a remote peer and returns the reply. Messages are dicts
+        with a "type" and the "notebook" ID they are routed to.
+        """
+        message_type = message.get("type")
+        if message_type == "sync":
+            # Full exchange: merge the remote notebook and reply with the result
+            notebook_id = message["notebook"]
+            if self.merge(notebook_id, message["data"]):
+                self.changed(notebook_id)
+            return {"type": "sync", "notebook": notebook_id, "data": self.snapshot(notebook_id)}
+        if message_type == "digest":
+            # First step of the digest handshake, see sync_peer()
+            notebook_id = message["notebook"]
+            hosted = self.open_notebook(notebook_id)
+            with self.locked(hosted):
+                digest = hosted.notebook.get_digest()
+                if digest == message["digest"]:
+                    return {"type": "in-sync", "notebook": notebook_id}
+                cells = hosted.notebook.nested_digests()
+                snapshot = hosted.notebook.snapshot(exclude=message["cells"])
+            return {"type": "sync", "notebook": notebook_id, "data": snapshot, "digest": digest, "cells": cells}
+        if message_type == "push":
+            # Second step of the digest handshake
+            notebook_id = message["notebook"]
+            if self.merge(notebook_id, message["data"]):
+                self.changed(notebook_id)
+            return {"type": "ok", "notebook": notebook_id}
+        return {"type": "error", "error": "Unknown message type: {}".format(message.get("type"))}
 
-    def create_cell(self, index=None):
+    def request(self, peer, message, timeout=None):
         """
-        Creates a new cell at the given index. If the index is not specified, the cell
-        is appended to the end of the notebook.
+        Sends a message to a remote peer and returns the reply. The timeout applies to
+        each socket operation.
         """
-        with self.lock:
-            self.notebook.create_cell(index)
+        with self.stats.timer("sync.serialize"):
+            data = pickle.dumps(message)
+        data = self.exchange(peer, data, timeout)
+        with self.stats.timer("sync.deserialize"):
+            reply = pickle.loads(data)
+        if reply["type"] == "error":
+            raise ValueError(reply["error"])
+        return reply
 
-    def update_cell(self, index, text):
+    def exchange(self, peer, data, timeout=None):
         """
-        Updates the text in a cell with new text.
+        Sends an encoded message to a remote peer and returns the encoded reply.
         """
-        with self.lock:
-            self.notebook.update_cell(index, text)
+        address = self.peers[peer]
+        stats = self.stats
+        while True:
+            with stats.timer("sync.connect"):
+                sock, reused = self.pool.acquire(address, timeout)
+            try:
+                with stats.timer("sync.send"):
+                    self.send_bytes(sock, data)
+                # Includes the time the peer takes to handle the message
+                with stats.timer("sync.receive"):
+                    reply = self.recv_bytes(sock)
+                if not reply:
+                    raise EOFError("Connection closed")
+                if isinstance(reply, memoryview):
+                    # The reply is decoded by the caller after the connection is
+                    # returned to the pool, so it is copied out of the segment first
+                    with reply as view:
+                        reply = bytes(view)
+            except socket.timeout:
+                sock.close()
+                raise
+            except (OSError, EOFError):
+                sock.close()
+                if reused:
+                    # The peer closed the pooled connection, so retry on another one
+                    continue
+                raise
+            self.pool.release(address, sock)
+            stats.count("sync.messages")
+            stats.count("sync.bytes_sent", len(data) + 4)
+            stats.count("sync.bytes_received", len(reply) + 4)
+            return reply
+
+    def sync(self, peer, notebook_id=None):
+        """
+        Syncs a notebook with a remote peer.
+        """
+        hosted = self.open_notebook(notebook_id)
+        if self.sync_peer(peer, hosted, self.handshake(hosted)):
+            self.changed(hosted.id)
+
+    def handshake(self, hosted):
+        """
+        Returns the encoded first message of the digest handshake for a notebook.
+        """
+        with self.locked(hosted):
+            digest = hosted.notebook.get_digest()
+            cells = hosted.notebook.nested_digests()
+        with self.stats.timer("sync.serialize"):
+            return pickle.dumps({"type": "digest", "notebook": hosted.id, "digest": digest, "cells": cells})
 
-    def remove_cell(self, index):
+    def sync_peer(self, peer, hosted, handshake, timeout=None):
+        """
+        Syncs a notebook with a remote peer using the digest handshake, and returns True
+        if the notebook was changed.
+
+        The handshake sends the digests of the notebook and its cells to the peer. If
+        the digests of the notebooks match, the notebooks are already in sync and the
+        peer replies without sending the notebook, so the sync takes a single round
+        trip. Otherwise the peer replies with its notebook, leaving out the cells with
+        matching digests, which is merged. The merged notebook is then pushed to the
+        peer, leaving out the cells the peer already has, unless the peer had every
+        operation of this notebook already.
+        """
+        stats = self.stats
+        stats.count("sync.syncs")
+        try:
+            with stats.timer("sync.total"):
+                data = self.exchange(peer, handshake, timeout)
+                with stats.timer("sync.deserialize"):
+                    reply = pickle.loads(data)
+                if reply["type"] == "error":
+                    raise ValueError(reply["error"])
+                if reply["type"] == "in-sync":
+                    stats.count("sync.in_sync")
+                    return False
+
+                changed = self.merge(hosted.id, reply["data"])
+                with self.locked(hosted):
+                    if hosted.notebook.get_digest() == reply["digest"]:
+                        return changed
+                    snapshot = hosted.notebook.snapshot(exclude=reply["cells"])
+                stats.count("sync.pushes")
+                self.request(peer, {"type": "push", "notebook": hosted.id, "data": snapshot}, timeout)
+                return changed
+        except (OSError, EOFError, ValueError):
+            stats.count("sync.failures")
+            raise
+
+    def sync_all(self, notebook_id=None, peers=None, timeout=DEFAULT_SYNC_TIMEOUT, parallelism=DEFAULT_SYNC_PARALLELISM):
+        """
+        Syncs a notebook with all the peers (or the given list of peers) concurrently,
+        contacting at most parallelism peers at a time. The responses are merged as
+        they arrive. Returns a dict of SyncResults by peer name, where the sync with a
+        peer failed if it did not respond within the timeout (in seconds, applied to
+        each socket operation) or could not be reached.
+        """
+        hosted = self.open_notebook(notebook_id)
+        if peers is None:
+            peers = self.get_peers()
+        results = {}
+        if not peers:
+            return results
+
+        # The first message of the handshake is encoded once and sent to every peer
+        handshake = self.handshake(hosted)
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=min(parallelism, len(peers))) as executor:
+            futures = {executor.submit(self.sync_peer, peer, hosted, handshake, timeout): peer for peer in peers}
+            for future in as_completed(futures):
+                peer = futures[future]
+                result = SyncResult(peer)
+                try:
+                    result.changed = future.result()
+                except (OSError, EOFError, ValueError) as e:
+                    result.error = e
+                result.elapsed = time.monotonic() - start
+                results[peer] = result
+
+        if any(result.changed for result in results.values()):
+            self.changed(hosted.id)
+        return results
+
+    def query_stats(self, peer, timeout=None):
+        """
+        Returns the statistics of a peer on the same host, see SyncStats.snapshot().
+        """
+        return self.request(peer, {"type": "stats"}, timeout)["stats"]
+
+    def merge(self, notebook_id, remote):
+        """
+        Merges a remote notebook into the hosted notebook with the given ID. Returns
+        True if the merge changed the notebook.
+        """
+        hosted = self.open_notebook(notebook_id)
+        with self.locked(hosted), self.stats.timer("merge"):
+            revision = hosted.notebook.revision
+            hosted.notebook.merge(remote, executor=self.merge_executor)
+            return hosted.notebook.revision != revision
+
+    def changed(self, notebook_id=None):
+        """
+        Called after a merge changed a notebook to persist the notebook and refresh
+        the editor, if they are configured.
+        """
+        if notebook_id is None:
+            notebook_id = self.notebook_id
+        if self.store is not None:
+            self.save(notebook_id)
+        if self.editor is not None and notebook_id == self.notebook_id:
+            self.editor.changed()
+
+    def save(self, notebook_id=None):
+        """
+        Persists a notebook to the store.
+        """
+        hosted = self.open_notebook(notebook_id)
+        self.store.save(hosted.id, self.snapshot(hosted.id))
+
+    def save_all(self):
+        """
+        Persists all the hosted notebooks to the store.
+        """
+        for notebook_id in self.get_notebook_ids():
+            self.save(notebook_id)
+
+    def subscribe(self, callback, notebook_id=None):
+        """
+        Registers a callback which is called with a SequenceEvent whenever the notebook
+        or one of its cells changes. Note that callbacks are called while the lock is
+        held, possibly from a listener thread.
+        """
+        hosted = self.open_notebook(notebook_id)
+        with self.locked(hosted):
+            hosted.notebook.subscribe(callback)
+
+    def unsubscribe(self, callback, notebook_id=None):
+        """
+        Removes a callback registered with subscribe().
+        """
+        hosted = self.open_notebook(notebook_id)
+        with self.locked(hosted):
+            hosted.notebook.unsubscribe(callback)
+
+    @contextmanager
+    def transaction(self, notebook_id=None):
+        """
+        Yields a notebook for a batch of changes, such as a paste which spans several
+        cells. The changes are made in a single critical section, so a sync never sees
+        part of the batch, and the subscribed callbacks are notified once per changed
+        sequence when the block exits, see Sequence.transaction(). Note that syncs with
+        the peers wait until the block exits.
+        """
+        hosted = self.open_notebook(notebook_id)
+        with self.locked(hosted), hosted.notebook.transaction():
+            yield hosted.notebook
+
+    def create_cell(self, index=None, notebook_id=None, text=""):
+        """
+        Creates a new cell with the given text at the given index. If the index is not
+        specified, the cell is appended to the end of the notebook.
+        """
+        hosted = self.open_notebook(notebook_id)
+        with self.locked(hosted):
+            hosted.notebook.create_cell(index, text)
+
+    def update_cell(self, index, text, notebook_id=None):
+        """
+        Updates the text in a cell with new text. The diff is computed without holding
+        the lock and the resulting edits are then applied in a single critical section.
+        """
+        hosted = self.open_notebook(notebook_id)
+        with self.locked(hosted):
+            base = hosted.notebook.get_cell(index).get_text()
+        edits = text_edits(base, text)
+
+        with self.locked(hosted):
+            current = hosted.notebook.get_cell(index).get_text()
+            if current != base:
+                # The cell was changed by a merge in the meantime, so diff again
+                edits = text_edits(current, text)
+            hosted.notebook.edit_cell(index, edits)
+
+    def edit_cell(self, index, edits, notebook_id=None):
+        """
+        Applies a list of (index, inserted_text, deleted_length) edits to a cell. The
+        edit indexes may also be tkinter-style "line.col" indexes.
+        """
+        hosted = self.open_notebook(notebook_id)
+        with self.locked(hosted):
+            hosted.notebook.edit_cell(index, edits)
+
+    def remove_cell(self, index, notebook_id=None):
         """
         Removes the cell at the given index.
         """
-        with self.lock:
-            self.notebook.remove_cell(index)
+        hosted = self.open_notebook(notebook_id)
+        with self.locked(hosted):
+            hosted.notebook.remove_cell(index)
 
-    def get_cell_data(self):
+    def snapshot(self, notebook_id=None, exclude=None):
         """
-        Returns all the cell data in the notebook.
+        Returns an immutable snapshot of a notebook which can be read without holding
+        the lock. See Sequence.snapshot() for exclude.
         """
-        with self.lock:
-            return self.notebook.get_cell_data()
\ No newline at end of file
+        hosted = self.open_notebook(notebook_id)
+        with self.locked(hosted):
+            return hosted.notebook.snapshot(exclude=exclude)
+
+    def get_cell_data(self, notebook_id=None):
+        """
+        Returns all the cell data in a notebook.
+        """
+        return self.snapshot(notebook_id).get_cell_data()
+
+def is_local(conn):
+    """
+    Returns True if the peer of a connection is on the same host.
+    """
+    if conn.family == getattr(socket, "AF_UNIX", None):
+        return True
+    return ipaddress.ip_address(conn.getpeername()[0]).is_loopback
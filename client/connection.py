@@ -0,0 +1,89 @@
+import ipaddress
+import socket
+import threading
+
+# Maximum number of idle connections kept open to each peer
+DEFAULT_MAX_IDLE = 4
+
+class ConnectionPool():
+    """
+    ConnectionPool keeps the connections to remote peers open between sync requests,
+    so that syncing many notebooks with the same peer does not open a new connection
+    for every request. The pool is shared by all the notebooks hosted by a client.
+    """
+
+    def __init__(self, max_idle=DEFAULT_MAX_IDLE, timeout=None, registry=None):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        # Optional LocalRegistry of the replicas on this host, which are connected to
+        # with a SharedChannel instead of a TCP socket
+        self.registry = registry
+        # Whether the host of each address is this host
+        self.local_hosts = {}
+        # Idle connections by peer address
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, address, timeout=None):
+        """
+        Returns a (socket, reused) tuple with a connection to the address, where reused
+        is True if the connection was taken from the pool. Note that a reused
+        connection may have been closed by the peer in the meantime. The timeout
+        overrides the default timeout of the pool until the connection is released.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        with self.lock:
+            idle = self.idle.get(address)
+            sock = idle.pop() if idle else None
+        if sock is not None:
+            sock.settimeout(timeout)
+            return sock, True
+        if self.registry is not None and self.is_local(address[0]):
+            # Imported here since the shared memory transport is only available on
+            # POSIX systems
+            from client.local import SharedChannel
+            path = self.registry.lookup(address[1])
+            if path is not None:
+                try:
+                    return SharedChannel.connect(path, timeout), False
+                except OSError:
+                    # The entry is stale, e.g. the replica was closed without exiting
+                    # its process, so the peer is reached over TCP instead
+                    self.registry.unregister(address[1], path)
+        return socket.create_connection(address, timeout=timeout), False
+
+    def is_local(self, hostname):
+        """
+        Returns True if a hostname resolves to a loopback address.
+        """
+        local = self.local_hosts.get(hostname)
+        if local is None:
+            try:
+                local = ipaddress.ip_address(socket.gethostbyname(hostname)).is_loopback
+            except (OSError, ValueError):
+                local = False
+            self.local_hosts[hostname] = local
+        return local
+
+    def release(self, address, sock):
+        """
+        Returns a connection to the pool once a request has completed.
+        """
+        sock.settimeout(self.timeout)
+        with self.lock:
+            idle = self.idle.setdefault(address, [])
+            if len(idle) < self.max_idle:
+                idle.append(sock)
+                return
+        sock.close()
+
+    def close(self):
+        """
+        Closes all the idle connections.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for sock in connections:
+                sock.close()
@@ -0,0 +1,118 @@
+import random
+import threading
+import time
+
+from client.client import DEFAULT_SYNC_TIMEOUT
+
+# Default bounds in seconds of the interval between gossip rounds of a notebook
+DEFAULT_MIN_INTERVAL = 1.0
+DEFAULT_MAX_INTERVAL = 30.0
+
+class GossipState():
+    """
+    The gossip state of a notebook hosted by the client.
+    """
+    def __init__(self, interval, now):
+        self.interval = interval
+        # The time of the last round, and the version of the notebook at that time
+        self.last = now
+        self.version = None
+
+class GossipScheduler():
+    """
+    GossipScheduler syncs the notebooks hosted by a NotebookClient in the background
+    (anti-entropy), so that replicas converge through small and frequent merges rather
+    than one large merge when a user syncs manually.
+
+    Each round of a notebook syncs it with a few randomly selected peers. The interval
+    between the rounds of a notebook adapts to its activity: it drops to min_interval
+    whenever the notebook changed (through a local edit or a merge), and otherwise
+    doubles up to max_interval. Rounds in which the notebook did not change are skipped
+    until the interval reaches max_interval, after which the notebook is still synced
+    every max_interval to pick up changes from peers which could not reach the client.
+    At most max_idle_rounds of these rounds run per tick, and the other unchanged
+    notebooks wait for the next ticks, so that a client which hosts many notebooks
+    does not sync all of them at once.
+    """
+
+    def __init__(self, client, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL, fanout=1,
+                 timeout=DEFAULT_SYNC_TIMEOUT, seed=None, max_idle_rounds=1):
+        if min_interval <= 0 or max_interval < min_interval:
+            raise ValueError("Invalid gossip intervals: {}, {}".format(min_interval, max_interval))
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.fanout = fanout
+        self.timeout = timeout
+        self.max_idle_rounds = max_idle_rounds
+        self.random = random.Random(seed)
+        self.states = {}
+        self.rounds = 0
+        self.skipped = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Starts the scheduler thread.
+        """
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the scheduler thread, waiting for the current round to complete.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        Checks which notebooks are due for a round every min_interval until stopped.
+        """
+        while not self.stopped.wait(self.min_interval):
+            self.tick(time.monotonic())
+
+    def tick(self, now):
+        """
+        Runs the gossip rounds of the notebooks which are due at the given time.
+        """
+        peers = self.client.get_peers()
+        if not peers:
+            return
+        idle_rounds = 0
+        for notebook_id in self.client.get_notebook_ids():
+            state = self.states.get(notebook_id)
+            if state is None:
+                state = self.states[notebook_id] = GossipState(self.min_interval, now - self.min_interval)
+            version = self.client.get_version(notebook_id)
+            if version != state.version:
+                state.interval = self.min_interval
+            if now < state.last + state.interval:
+                continue
+
+            if version == state.version:
+                if state.interval < self.max_interval:
+                    # Nothing changed since the last round, so back off
+                    state.last = now
+                    state.interval = min(state.interval * 2, self.max_interval)
+                    self.skipped += 1
+                    continue
+                if idle_rounds >= self.max_idle_rounds:
+                    # The notebook stays due and is synced in a later tick
+                    continue
+                idle_rounds += 1
+
+            state.last = now
+
+            # Changes merged during the round change the version, so that they are
+            # passed on to other peers in the next round
+            state.version = version
+            self.rounds += 1
+            selected = self.random.sample(peers, min(self.fanout, len(peers)))
+            self.client.sync_all(notebook_id, peers=selected, timeout=self.timeout)
@@ -0,0 +1,305 @@
+import atexit
+from contextlib import contextmanager
+import fcntl
+import json
+import mmap
+import os
+import socket
+import stat
+import struct
+import tempfile
+import uuid
+
+# Shared memory segments are files in a memory-backed file system where available
+SEGMENT_DIRECTORY = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+SEGMENT_PREFIX = "eirene-"
+
+# Minimum size of a segment in bytes. Segments grow in powers of two.
+MIN_SEGMENT_SIZE = 64 * 1024
+
+# The length of a message and the length of the name of the segment which holds it
+HEADER = struct.Struct("!IB")
+
+def runtime_directory():
+    """
+    Returns the directory which holds the registry and the Unix sockets of the current
+    user, and creates it if needed. Only the user can access the directory, so other
+    users can't register replicas in it.
+    """
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    if base:
+        path = os.path.join(base, "eirene")
+    else:
+        path = os.path.join(tempfile.gettempdir(), "eirene-{}".format(os.getuid()))
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError("{} must be a directory which only the current user can access".format(path))
+    return path
+
+def process_alive(pid):
+    """
+    Returns True if a process of the current user with the given ID is running.
+    """
+    try:
+        os.kill(pid, 0)
+    except (ProcessLookupError, PermissionError):
+        return False
+    return True
+
+def owned_socket(path):
+    """
+    Returns True if the path is a Unix socket owned by the current user.
+    """
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid()
+
+class LocalRegistry():
+    """
+    LocalRegistry is a file which lists the replicas on this host that accept local
+    connections, by the port which they listen on. Each entry has the path of the Unix
+    socket of the replica and the ID of its process. Entries of replicas which exited
+    without unregistering, and entries whose socket is missing or belongs to another
+    user, are ignored and dropped the next time the registry is written. The file is
+    locked with flock() while it is read or written.
+
+    By default the registry is kept in the runtime_directory() of the current user,
+    and the sockets of the replicas are created next to the registry.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(runtime_directory(), "replicas.json")
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+
+    @contextmanager
+    def locked(self):
+        """
+        Locks the registry and yields the dict of entries by port, which is written
+        back when the block exits.
+        """
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = self.read()
+                yield entries
+                fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read(self):
+        """
+        Returns the dict of live entries by port.
+        """
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return {port: entry for port, entry in entries.items()
+                if process_alive(entry["pid"]) and owned_socket(entry["socket"])}
+
+    def register(self, port, path):
+        """
+        Registers the Unix socket of the replica listening on the port.
+        """
+        with self.locked() as entries:
+            entries[str(port)] = {"socket": path, "pid": os.getpid()}
+
+    def unregister(self, port, path=None):
+        """
+        Removes the entry of the replica listening on the port. If a path is given, the
+        entry is only removed if it is still the entry of that socket.
+        """
+        with self.locked() as entries:
+            entry = entries.get(str(port))
+            if entry is not None and (path is None or entry["socket"] == path):
+                del entries[str(port)]
+
+    def lookup(self, port):
+        """
+        Returns the path of the Unix socket of the replica listening on the port, or
+        None if it is not registered.
+        """
+        entry = self.read().get(str(port))
+        return entry["socket"] if entry is not None else None
+
+def bind_local(registry, port):
+    """
+    Binds the Unix socket which accepts the local connections of the replica listening
+    on the port, and registers it. The socket is unregistered and removed when the
+    process exits.
+    """
+    path = os.path.join(registry.directory, "eirene-{}-{}.sock".format(os.getpid(), port))
+    remove_file(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    registry.register(port, path)
+    atexit.register(unbind_local, registry, port, path)
+    return server
+
+def unbind_local(registry, port, path):
+    """
+    Unregisters and removes the Unix socket of a replica. This is called again when
+    the process exits, by which time the registry may have been removed.
+    """
+    try:
+        registry.unregister(port, path)
+    except FileNotFoundError:
+        pass
+    remove_file(path)
+
+def remove_file(path):
+    """
+    Removes a file if it still exists.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class Segment():
+    """
+    A Segment is a file in shared memory which is mapped into the process. The file is
+    removed as soon as the peer has mapped it, or when the segment is closed, so that
+    no files are left behind by processes which exit without closing their channels.
+    """
+
+    def __init__(self, name, size=None):
+        if os.path.basename(name) != name or not name.startswith(SEGMENT_PREFIX):
+            raise ValueError("Invalid segment name: {}".format(name))
+        self.name = name
+        self.path = os.path.join(SEGMENT_DIRECTORY, name)
+        self.owner = size is not None
+        flags = os.O_RDWR | (os.O_CREAT | os.O_EXCL if self.owner else 0)
+        fd = os.open(self.path, flags, 0o600)
+        try:
+            if self.owner:
+                os.ftruncate(fd, size)
+            else:
+                size = os.fstat(fd).st_size
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        if not self.owner:
+            # Both processes keep the mapping after the file is removed
+            remove_file(self.path)
+        self.size = size
+
+    @classmethod
+    def create(cls, size):
+        """
+        Creates a segment with a unique name which can hold at least size bytes.
+        """
+        capacity = MIN_SEGMENT_SIZE
+        while capacity < size:
+            capacity *= 2
+        return cls("{}{}".format(SEGMENT_PREFIX, uuid.uuid4().hex), capacity)
+
+    def close(self):
+        self.map.close()
+        remove_file(self.path)
+
+class SharedChannel():
+    """
+    A SharedChannel is a connection to a replica on the same host, which is used in
+    place of a TCP socket. Messages are written to a shared memory segment owned by the
+    sender, and only a small header with the length of the message and the name of the
+    segment is sent over a Unix socket, which also wakes up the receiver. Since a
+    request is always answered before the next request is sent, the segments can be
+    reused for every message, and are only replaced when a larger message is sent.
+    """
+
+    family = socket.AF_UNIX
+
+    def __init__(self, sock):
+        self.sock = sock
+        # The segment this side writes its messages to, and the segment of the peer
+        self.outbox = None
+        self.inbox = None
+
+    @classmethod
+    def connect(cls, path, timeout=None):
+        """
+        Connects to the Unix socket of a replica.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            raise
+        return cls(sock)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def send_bytes(self, data):
+        """
+        Sends a message to the peer.
+        """
+        if self.outbox is None or self.outbox.size < len(data):
+            outbox = Segment.create(len(data))
+            if self.outbox is not None:
+                self.outbox.close()
+            self.outbox = outbox
+        self.outbox.map[:len(data)] = data
+        name = self.outbox.name.encode()
+        self.sock.sendall(HEADER.pack(len(data), len(name)) + name)
+
+    def recv_bytes(self):
+        """
+        Receives a message from the peer. Returns empty bytes if the connection was
+        closed before a message was received.
+
+        The message is returned as a memoryview of the segment rather than copied out of
+        it. The view is only valid until the next message is received, and must be
+        released before then, since the segment is reused or closed.
+        """
+        header = self.recv_exactly(HEADER.size)
+        if not header:
+            return b''
+        length, name_length = HEADER.unpack(header)
+        name = self.recv_exactly(name_length).decode("ascii", "replace")
+        if os.path.basename(name) != name or not name.startswith(SEGMENT_PREFIX):
+            raise EOFError("Invalid segment name: {}".format(name))
+        if self.inbox is None or self.inbox.name != name:
+            if self.inbox is not None:
+                self.inbox.close()
+            self.inbox = Segment(name)
+        if length > self.inbox.size:
+            raise EOFError("Message of {} bytes does not fit in its segment".format(length))
+        return memoryview(self.inbox.map)[:length]
+
+    def recv_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            buffer = self.sock.recv(size - len(data))
+            if not buffer:
+                if data:
+                    raise EOFError("Connection closed")
+                return b''
+            data += buffer
+        return data
+
+    def close(self):
+        self.sock.close()
+        for segment in (self.outbox, self.inbox):
+            if segment is not None:
+                segment.close()
+        self.outbox = self.inbox = None
@@ -0,0 +1,284 @@
+import logging
+import threading
+
+from crdt.sequence import compose_delta, transform_delta
+from notebook.cell import apply_text_edits, delta_edits, edits_delta, text_edits
+
+logger = logging.getLogger(__name__)
+
+class EditPipeline():
+    """
+    EditPipeline applies cell edits to a NotebookClient on a worker thread, so that
+    the edits do not block the UI. Edits which are submitted while the worker is busy
+    are coalesced, so that either the latest text or a single batch of position-based
+    edits is applied to each cell.
+
+    Edits are submitted by an editor in the positions of the text it shows, which
+    does not include the changes merged into the notebook since the editor last
+    rendered it. While the pipeline is started, it observes the notebook and rebases
+    the pending edits through each merged change, and rebases the merged changes
+    through the edits submitted after them, so that both the notebook and the editor
+    end up with the same text, see take_changes().
+    """
+
+    def __init__(self, client):
+        self.client = client
+        # The pending edits by cell index in the notebook
+        self.pending = {}
+        # The merged changes to each cell which the editor has not rendered yet, by
+        # cell index in the notebook, as deltas in the positions of the editor's text
+        self.remote = {}
+        # The changes to the list of cells which the editor has not rendered yet
+        self.structure = []
+        self.running = False
+        self.worker = None
+        # The condition protects the pending edits and wakes up the worker
+        self.cond = threading.Condition()
+        # Edits are applied while holding this lock so that edits to the same cell are
+        # never applied out of order by the worker and by flush()
+        self.apply_lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker thread and starts observing the notebook. Returns the texts
+        of the cells at that point, which the changes returned by take_changes() are
+        relative to.
+        """
+        with self.cond:
+            if self.running:
+                return None
+            self.running = True
+        with self.client.transaction() as notebook:
+            notebook.subscribe(self.receive)
+            texts = notebook.get_cell_data()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+        return texts
+
+    def stop(self):
+        """
+        Stops the worker thread and applies any remaining edits.
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+        self.client.unsubscribe(self.receive)
+        self.flush()
+
+    def client_index(self, index):
+        """
+        Returns the index in the notebook of the cell at the given index in the editor,
+        or None if the cell was removed by a change which the editor has not rendered.
+        """
+        with self.cond:
+            return shift_index(self.structure, index)
+
+    def submit(self, index, text):
+        """
+        Submits the new text of the cell at the given index. If the pipeline has not
+        been started the edit is only applied by flush().
+        """
+        with self.cond:
+            index = shift_index(self.structure, index)
+            if index is None:
+                return
+            self.pending[index] = text
+            # The text replaces the merged changes to the cell
+            self.remote.pop(index, None)
+            self.cond.notify()
+
+    def submit_edits(self, index, edits):
+        """
+        Submits a list of (index, inserted_text, deleted_length) edits to the cell at
+        the given index, which are appended to any pending edits for the cell.
+        """
+        with self.cond:
+            index = shift_index(self.structure, index)
+            if index is None:
+                return
+            pending = self.pending.get(index)
+            if isinstance(pending, str):
+                self.pending[index] = apply_text_edits(pending, edits)
+                self.cond.notify()
+                return
+            remote = self.remote.get(index)
+            if remote:
+                # The edits were made without the merged changes
+                delta = edits_delta(edits)
+                edits = delta_edits(transform_delta(delta, remote, first=True))
+                self.remote[index] = transform_delta(remote, delta, first=False)
+            if pending is None:
+                self.pending[index] = list(edits)
+            else:
+                pending.extend(edits)
+            self.cond.notify()
+
+    def receive(self, event):
+        """
+        Called with the events of the notebook, while its lock is held. Changes to the
+        list of cells move the pending edits and the merged changes with their cells,
+        and the pending edits to a cell are rebased through the changes merged into it.
+        """
+        with self.cond:
+            if not event.path:
+                self.pending = shift_keys(self.pending, event.delta)
+                self.remote = shift_keys(self.remote, event.delta)
+                self.structure = compose_delta(self.structure, event.delta)
+                return
+            if event.local or len(event.path) != 1:
+                # Local edits to cells are made through the pipeline
+                return
+            index = event.path[0]
+            pending = self.pending.get(index)
+            if isinstance(pending, str):
+                # The merged changes are replaced by the pending text
+                return
+            delta = event.delta
+            if pending:
+                edits = edits_delta(pending)
+                self.pending[index] = delta_edits(transform_delta(edits, delta, first=True))
+                delta = transform_delta(delta, edits, first=False)
+            self.remote[index] = compose_delta(self.remote.get(index, []), delta)
+
+    def flush(self):
+        """
+        Applies all pending edits in the calling thread. This should be called before
+        the cells are added, removed or read so that the indexes of the pending edits
+        remain valid.
+        """
+        diffs = self.diff()
+        with self.apply_lock, self.client.transaction() as notebook:
+            self.apply(notebook, diffs)
+
+    def take_changes(self):
+        """
+        Applies all pending edits and returns the changes which the editor has to
+        render to show the notebook, as a (cells, deltas) tuple. cells is a delta of
+        the list of cells, in which the inserted cells are given by their text. deltas
+        is a dict of the deltas of the characters of the changed cells by cell index,
+        after cells is applied.
+        """
+        diffs = self.diff()
+        with self.apply_lock, self.client.transaction() as notebook:
+            self.apply(notebook, diffs)
+            with self.cond:
+                structure, self.structure = self.structure, []
+                deltas, self.remote = self.remote, {}
+            cells = []
+            index = 0
+            for action, value in structure:
+                if action == "insert":
+                    # The text of an inserted cell already includes its changes
+                    cells.append((action, [cell.get_text() for cell in value]))
+                    for i in range(index, index + len(value)):
+                        deltas.pop(i, None)
+                    index += len(value)
+                else:
+                    cells.append((action, value))
+                    if action == "retain":
+                        index += value
+        return cells, deltas
+
+    def take(self):
+        """
+        Removes and returns the pending edits.
+        """
+        with self.cond:
+            pending = self.pending
+            self.pending = {}
+        return pending
+
+    def diff(self):
+        """
+        Computes the edits which turn the cells into their pending texts, as a dict of
+        (text, base, edits) tuples by cell index. Only the base texts are read while
+        the lock of the notebook is held, and the diffs are computed after it is
+        released, so that merges are not blocked by them.
+        """
+        with self.cond:
+            texts = {index: edit for index, edit in self.pending.items() if isinstance(edit, str)}
+        if not texts:
+            return {}
+        bases = {}
+        with self.client.transaction() as notebook:
+            for index in texts:
+                try:
+                    bases[index] = notebook.get_cell(index).get_text()
+                except IndexError:
+                    # The edit is dropped by apply()
+                    pass
+        return {index: (texts[index], base, text_edits(base, texts[index])) for index, base in bases.items()}
+
+    def apply(self, notebook, diffs):
+        """
+        Applies the pending edits to the notebook in a single transaction. The edits
+        are taken while the lock of the notebook is held, so that a merge cannot change
+        the cells between rebasing the edits and applying them. The pending texts are
+        applied with the edits returned by diff().
+        """
+        for index, edit in sorted(self.take().items()):
+            self.apply_edit(notebook, index, edit, diffs.get(index))
+
+    def apply_edit(self, notebook, index, edit, diff):
+        """
+        Applies an edit to a cell, unless the cell was removed in the meantime. If the
+        edit is a new text, the edits of the diff are applied, unless the text or the
+        cell changed since they were computed, in which case the cell is diffed again.
+        """
+        try:
+            if isinstance(edit, str):
+                current = notebook.get_cell(index).get_text()
+                if diff is not None and diff[0] == edit and diff[1] == current:
+                    edit = diff[2]
+                else:
+                    edit = text_edits(current, edit)
+            notebook.edit_cell(index, edit)
+        except IndexError:
+            # The cell was removed before the edit could be applied
+            logger.warning("Dropped edit to removed cell %d", index)
+
+    def run(self):
+        """
+        Waits for edits to be submitted and applies them.
+        """
+        while True:
+            with self.cond:
+                while self.running and not self.pending:
+                    self.cond.wait()
+                if not self.running:
+                    return
+
+            self.flush()
+
+def shift_index(delta, index):
+    """
+    Returns the index of an item after a delta is applied, or None if the delta
+    deleted the item.
+    """
+    position = 0
+    shifted = index
+    for action, value in delta:
+        if action == "insert":
+            shifted += len(value)
+            continue
+        if index < position + value:
+            return shifted if action == "retain" else None
+        position += value
+        if action == "delete":
+            shifted -= value
+    return shifted
+
+def shift_keys(items, delta):
+    """
+    Returns a copy of a dict by item index with the indexes after a delta is applied.
+    The entries of deleted items are dropped.
+    """
+    shifted = {}
+    for index, value in items.items():
+        index = shift_index(delta, index)
+        if index is not None:
+            shifted[index] = value
+    return shifted
@@ -0,0 +1,127 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the histogram buckets, doubling from 100 microseconds to
+# about 52 seconds. Slower values are counted in a final overflow bucket.
+BUCKETS = tuple(0.0001 * 2 ** k for k in range(20))
+
+class Histogram():
+    """
+    A Histogram counts durations in exponentially sized buckets, so that percentiles
+    can be estimated without storing every value.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        """
+        Adds a value to the histogram.
+        """
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """
+        Returns an upper bound of the p-th percentile, which is the upper bound of the
+        bucket containing it, or the maximum value if that is lower.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = p / 100 * self.count
+        total = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            total += count
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        """
+        Returns the histogram as a dict, with the buckets as cumulative
+        (upper_bound, count) pairs.
+        """
+        buckets = []
+        total = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "buckets": buckets,
+        }
+
+class SyncStats():
+    """
+    SyncStats collects cumulative timing histograms for the phases of syncs, and
+    counters such as the number of messages and bytes transferred. It is safe to use
+    from multiple threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.started = time.monotonic()
+
+    def record(self, phase, seconds):
+        """
+        Records the duration of a phase.
+        """
+        with self.lock:
+            histogram = self.histograms.get(phase)
+            if histogram is None:
+                histogram = self.histograms[phase] = Histogram()
+            histogram.record(seconds)
+
+    def count(self, counter, value=1):
+        """
+        Increments a counter.
+        """
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    @contextmanager
+    def timer(self, phase):
+        """
+        Records the duration of the body of a with statement as a phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start)
+
+    def snapshot(self):
+        """
+        Returns the current statistics as a dict which can be sent to another process.
+        """
+        with self.lock:
+            return {
+                "uptime": time.monotonic() - self.started,
+                "counters": dict(self.counters),
+                "phases": {phase: histogram.to_dict() for phase, histogram in self.histograms.items()},
+            }
+
+def format_stats(stats):
+    """
+    Formats a snapshot of SyncStats as a table.
+    """
+    lines = ["uptime: {:.1f}s".format(stats["uptime"])]
+    for counter, value in sorted(stats["counters"].items()):
+        lines.append("{:<24} {}".format(counter, value))
+    lines.append("{:<24} {:>8} {:>10} {:>10} {:>10} {:>10}".format("phase", "count", "mean ms", "p50 ms", "p99 ms", "max ms"))
+    for phase, histogram in sorted(stats["phases"].items()):
+        mean = histogram["sum"] / histogram["count"] if histogram["count"] else 0.0
+        lines.append("{:<24} {:>8} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+            phase, histogram["count"], mean * 1000, histogram["p50"] * 1000, histogram["p99"] * 1000, histogram["max"] * 1000))
+    return "\n".join(lines)
@@ -0,0 +1,46 @@
+import os
+import pickle
+import tempfile
+import urllib.parse
+
+class NotebookStore():
+    """
+    NotebookStore persists notebooks to files in a directory, so that a client can be
+    restarted without losing its state.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, notebook_id):
+        """
+        Returns the path of the file which stores the notebook with the given ID. The
+        ID is percent-encoded, so distinct IDs never share a file.
+        """
+        name = urllib.parse.quote(str(notebook_id), safe="")
+        return os.path.join(self.directory, name + ".notebook")
+
+    def load(self, notebook_id):
+        """
+        Returns the stored notebook with the given ID, or None if it has not been stored.
+        """
+        try:
+            with open(self.path(notebook_id), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, notebook_id, notebook):
+        """
+        Stores a notebook. The notebook is written to a temporary file which then
+        replaces the previous version, so a crash never leaves a partial file behind.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(notebook, f)
+            os.replace(tmp, self.path(notebook_id))
+        except BaseException:
+            os.remove(tmp)
+            raise
@@ -0,0 +1,453 @@
+from array import array
+from itertools import compress
+import sys
+
+from crdt.sequence import Object
+from crdt.tree import ObjectTree, first_index, remap_siblings, sibling_tables
+
+# Maximum number of items in a block before it is split in two
+BLOCK_SIZE = 512
+
+# Payload code for items which are not single characters
+NO_CODE = -1
+
+# Translates a column of tombstone flags into a column of visibility flags
+VISIBLE = bytes.maketrans(b"\x00\x01", b"\x01\x00")
+
+# Payload codes are stored as native 32-bit integers, which can be decoded directly
+TEXT_ENCODING = "utf-32-le" if sys.byteorder == "little" else "utf-32-be"
+
+class ColumnarTree():
+    """
+    A ColumnarTree is an alternative storage engine for a Sequence, which orders its
+    objects in the same way as an ObjectTree. Instead of storing an Object per item,
+    the items are stored in blocks of parallel arrays: the payload code (the code point
+    of single-character payloads), the node and clock of the operation, and a tombstone
+    flag. The block of each operation is kept in a table, so an operation is located by
+    scanning the node and clock columns of a single block, and the text of the
+    sequence is materialized from the arrays rather than the objects.
+    """
+
+    # The insertion points are found in the sibling tables in the same way
+    leftmost = ObjectTree.leftmost
+    rightmost = ObjectTree.rightmost
+    chain_end = ObjectTree.chain_end
+    add_sibling = ObjectTree.add_sibling
+
+    def __init__(self):
+        self.roots = []
+        # The operations inserted before and after each target, see ObjectTree
+        self.before = {}
+        self.after = {}
+        # The block of each operation, which is shared with snapshots like the sibling
+        # tables, and the (root, block_index) of each block, which is not
+        self.block_of = {}
+        self.block_index = {}
+        self.shared = False
+        # The targets whose sibling lists can be written in place, and the known ends
+        # of the chains followed by leftmost() and rightmost(), see ObjectTree
+        self.owned = set()
+        self.first = {}
+        self.last = {}
+        # Node names are stored in the columns as indexes into this table. The table is
+        # shared with snapshots until a node is added to it (copy-on-write).
+        self.node_names = []
+        self.node_indexes = {}
+        self.nodes_shared = False
+
+    def unshare(self):
+        """
+        Copies the tables which are shared with a snapshot.
+        """
+        self.before = dict(self.before)
+        self.after = dict(self.after)
+        self.block_of = dict(self.block_of)
+        self.shared = False
+        self.owned = set()
+
+    def node_index(self, node):
+        """
+        Returns the index of a node name in the node table, adding it if necessary.
+        """
+        index = self.node_indexes.get(node)
+        if index is None:
+            if self.nodes_shared:
+                self.node_names = list(self.node_names)
+                self.node_indexes = dict(self.node_indexes)
+                self.nodes_shared = False
+            index = len(self.node_names)
+            self.node_names.append(node)
+            self.node_indexes[node] = index
+        return index
+
+    def snapshot(self, remap=None):
+        """
+        Returns a copy of the tree which shares its blocks with this tree. A shared block
+        is copied the next time either tree writes to it (copy-on-write). If remap is
+        specified, the copy is instead rebuilt with the operations returned by
+        remap(op).
+        """
+        tree = ColumnarTree()
+        tree.node_names = self.node_names
+        tree.node_indexes = self.node_indexes
+        tree.nodes_shared = self.nodes_shared = True
+        if remap is None:
+            tree.before = self.before
+            tree.after = self.after
+            tree.block_of = self.block_of
+            tree.shared = self.shared = True
+            self.owned = set()
+        else:
+            tree.before = remap_siblings(self.before, remap)
+            tree.after = remap_siblings(self.after, remap)
+        for root in self.roots:
+            copy = ColumnarRoot(root.op if remap is None else remap(root.op))
+            for block in root.blocks:
+                if remap is None:
+                    block.shared = True
+                    copy.blocks.append(block)
+                else:
+                    block = block.copy()
+                    block.ops = [remap(op) for op in block.ops]
+                    for op in block.ops:
+                        tree.block_of[op] = block
+                    copy.blocks.append(block)
+                tree.block_index[block] = (copy, len(copy.blocks) - 1)
+            tree.roots.append(copy)
+        return tree
+
+    def writable(self, root, b):
+        """
+        Returns block b of the root for writing, copying it first if it is shared with a
+        snapshot.
+        """
+        block = root.blocks[b]
+        if block.shared:
+            del self.block_index[block]
+            block = block.copy()
+            root.blocks[b] = block
+            self.block_index[block] = (root, b)
+            block_of = self.writable_table()
+            for op in block.ops:
+                block_of[op] = block
+        return block
+
+    def writable_table(self):
+        """
+        Returns the block_of table for writing, copying the tables first if they are
+        shared with a snapshot.
+        """
+        if self.shared:
+            self.unshare()
+        return self.block_of
+
+    def insert(self, target, object, before=True):
+        """
+        Inserts a new object into the tree.
+        """
+        if target is None:
+            self.insert_root(object)
+        else:
+            self.insert_node(target, object, before)
+
+    def insert_root(self, object):
+        """
+        Inserts a new root into the tree.
+        """
+        op = object.operation
+        index = first_index(self.roots, lambda root: op < root.op)
+        root = ColumnarRoot(op)
+        root.blocks.append(Block())
+        self.block_index[root.blocks[0]] = (root, 0)
+        self.roots.insert(index, root)
+        self.write(root, 0, 0, object.operation)
+
+    def insert_node(self, target, object, before):
+        """
+        Inserts a new object into the tree before or after the target.
+        """
+        op = object.operation
+        if before:
+            siblings = self.before.get(target, ())
+            k = first_index(siblings, lambda sibling: op < sibling)
+            anchor = self.leftmost(siblings[k]) if k < len(siblings) else target
+            position = self.locate(anchor)
+            if position is None:
+                root = self.roots[-1]
+                self.write(root, len(root.blocks) - 1, len(root.blocks[-1]), op)
+                return
+            root, b, i = position
+        else:
+            siblings = self.after.get(target, ())
+            k = first_index(siblings, lambda sibling: sibling < op)
+            if k < len(siblings):
+                position = self.locate(self.leftmost(siblings[k]))
+            else:
+                position = self.locate(self.rightmost(target))
+                if position is not None:
+                    position = (position[0], position[1], position[2] + 1)
+            if position is None:
+                self.write(self.roots[0], 0, 0, op)
+                return
+            root, b, i = position
+        self.write(root, b, i, op)
+        self.add_sibling(before, target, k, op)
+
+    def write(self, root, b, i, op):
+        """
+        Writes an operation to position i of block b in the root, splitting the block
+        if it becomes too large.
+        """
+        block = self.writable(root, b)
+        block.insert(i, op, payload_code(op.payload), self.node_index(op.owner.node), op.owner.id)
+        block_of = self.writable_table()
+        block_of[op] = block
+        if len(block) > BLOCK_SIZE:
+            half = block.split()
+            root.blocks.insert(b + 1, half)
+            for later in range(b + 1, len(root.blocks)):
+                self.block_index[root.blocks[later]] = (root, later)
+            for moved in half.ops:
+                block_of[moved] = half
+
+    def blocks(self):
+        """
+        Yields (root, block_index, block) tuples in order.
+        """
+        for root in self.roots:
+            for b, block in enumerate(root.blocks):
+                yield root, b, block
+
+    def locate(self, op):
+        """
+        Returns the (root, block_index, index) of the item created by an operation, or
+        None if it is not in the tree.
+        """
+        block = self.block_of.get(op)
+        if block is None:
+            return None
+        root, b = self.block_index[block]
+        return root, b, block.find(self.node_indexes[op.owner.node], op.owner.id)
+
+    def position(self, op):
+        """
+        Returns the number of visible items before the item created by an operation,
+        or None if it is not in the tree.
+        """
+        located = self.locate(op)
+        if located is None:
+            return None
+        root, b, i = located
+        position = 0
+        for other, c, block in self.blocks():
+            if other is root and c == b:
+                return position + i - block.tombstone.count(1, 0, i)
+            position += len(block) - block.tombstone.count(1)
+
+    def is_visible(self, op):
+        """
+        Returns True if the item created by an operation is in the tree and is not
+        deleted.
+        """
+        located = self.locate(op)
+        return located is not None and not located[0].blocks[located[1]].tombstone[located[2]]
+
+    def visible_operations(self, position, count):
+        """
+        Returns the operations of up to count visible items from the given position.
+        """
+        ops = []
+        for root, b, block in self.blocks():
+            visible = len(block) - block.tombstone.count(1)
+            if position >= visible:
+                position -= visible
+                continue
+            for op in compress(block.ops, block.tombstone.translate(VISIBLE)):
+                if position > 0:
+                    position -= 1
+                    continue
+                ops.append(op)
+                if len(ops) == count:
+                    return ops
+        return ops
+
+    def last_visible(self):
+        """
+        Returns the operation of the last item which is not deleted, or None if all
+        the items are deleted.
+        """
+        for root in reversed(self.roots):
+            for block in reversed(root.blocks):
+                i = block.tombstone.rfind(0)
+                if i >= 0:
+                    return block.ops[i]
+        return None
+
+    def tombstone(self, target):
+        """
+        Marks the object created by the target operation as deleted. Returns the
+        deleted object, or None if the object was already deleted.
+        """
+        position = self.locate(target)
+        if position is None:
+            return None
+        root, b, i = position
+        if root.blocks[b].tombstone[i]:
+            return None
+        block = self.writable(root, b)
+        block.tombstone[i] = 1
+        block.text = None
+        removed = Object(block.ops[i])
+        removed.tombstone = True
+        return removed
+
+    def layout(self):
+        """
+        Returns the roots of the tree as a list of (root_operation, operations) tuples,
+        with the operations under each root in order.
+        """
+        return [(root.op, [op for block in root.blocks for op in block.ops]) for root in self.roots]
+
+    def load(self, layout, removed):
+        """
+        Fills an empty tree with the roots returned by layout(). The items of the
+        operations in removed are marked as deleted.
+        """
+        # Blocks are filled halfway, so that inserts do not split them right away
+        size = BLOCK_SIZE // 2
+        for root_op, ops in layout:
+            root = ColumnarRoot(root_op)
+            for start in range(0, len(ops), size):
+                block = Block()
+                for op in ops[start:start + size]:
+                    block.insert(len(block), op, payload_code(op.payload), self.node_index(op.owner.node), op.owner.id)
+                    if op in removed:
+                        block.tombstone[-1] = 1
+                    self.block_of[op] = block
+                self.block_index[block] = (root, len(root.blocks))
+                root.blocks.append(block)
+            self.roots.append(root)
+        self.before, self.after = sibling_tables(op for root_op, ops in layout for op in ops)
+
+    def get_text(self):
+        """
+        Returns the visible single-character payloads joined into a string. The text is
+        decoded directly from the payload codes of each block.
+        """
+        return "".join(block.get_text() for root, b, block in self.blocks())
+
+    def __iter__(self):
+        """
+        Iterates over the objects in the tree.
+        """
+        for root, b, block in self.blocks():
+            for op, tombstone in zip(block.ops, block.tombstone):
+                obj = Object(op)
+                obj.tombstone = bool(tombstone)
+                yield obj
+
+def payload_code(payload):
+    """
+    Returns the code of a payload in the payload column.
+    """
+    return ord(payload) if isinstance(payload, str) and len(payload) == 1 else NO_CODE
+
+class ColumnarRoot():
+    """
+    A root in a ColumnarTree, which contains the blocks of items under the root.
+    """
+    def __init__(self, op):
+        self.op = op
+        self.blocks = []
+
+class Block():
+    """
+    A Block stores a contiguous run of items in a ColumnarTree as parallel columns.
+    """
+    def __init__(self):
+        self.ops = []
+        self.code = array("i")
+        self.node = array("i")
+        self.clock = array("q")
+        self.tombstone = bytearray()
+        # True if the block is also referenced by a snapshot
+        self.shared = False
+        # The decoded text of the block, which is cleared when the block is modified
+        self.text = None
+
+    def copy(self):
+        """
+        Returns a copy of the block.
+        """
+        block = Block()
+        block.ops = list(self.ops)
+        block.code = array("i", self.code)
+        block.node = array("i", self.node)
+        block.clock = array("q", self.clock)
+        block.tombstone = bytearray(self.tombstone)
+        block.text = self.text
+        return block
+
+    def insert(self, i, op, code, node, clock):
+        """
+        Inserts an item at position i in the block.
+        """
+        self.ops.insert(i, op)
+        self.code.insert(i, code)
+        self.node.insert(i, node)
+        self.clock.insert(i, clock)
+        self.tombstone.insert(i, 0)
+        self.text = None
+
+    def split(self):
+        """
+        Moves the second half of the block into a new block and returns it.
+        """
+        half = len(self) // 2
+        block = Block()
+        block.ops = self.ops[half:]
+        block.code = self.code[half:]
+        block.node = self.node[half:]
+        block.clock = self.clock[half:]
+        block.tombstone = self.tombstone[half:]
+        del self.ops[half:]
+        del self.code[half:]
+        del self.node[half:]
+        del self.clock[half:]
+        del self.tombstone[half:]
+        self.text = None
+        return block
+
+    def get_text(self):
+        """
+        Returns the visible single-character payloads in the block joined into a
+        string, which is decoded from the payload codes in a single pass.
+        """
+        if self.text is None:
+            codes = self.code
+            if 1 in self.tombstone:
+                codes = array("i", compress(codes, self.tombstone.translate(VISIBLE)))
+            if NO_CODE in codes:
+                visible = self.tombstone.translate(VISIBLE)
+                self.text = "".join(str(op.payload) for op in compress(self.ops, visible))
+            else:
+                self.text = codes.tobytes().decode(TEXT_ENCODING, "surrogatepass")
+        return self.text
+
+    def find(self, node, clock):
+        """
+        Returns the index of the item created by the operation (node, clock), or None if
+        it is not in the block.
+        """
+        i = 0
+        while True:
+            try:
+                i = self.clock.index(clock, i)
+            except ValueError:
+                return None
+            if self.node[i] == node:
+                return i
+            i += 1
+
+    def __len__(self):
+        return len(self.ops)
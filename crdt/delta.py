@@ -0,0 +1,163 @@
+from crdt.gcounter import GCounter
+from crdt.gset import GSet
+from crdt.twopset import TwoPhaseSet
+
+class DeltaGSet(GSet):
+    """
+    DeltaGSet is a delta-state GSet. Adding an item returns a delta, which is a
+    DeltaGSet with only that item. Deltas are merged like any other GSet, so replicas
+    can exchange the deltas of recent changes instead of their whole state.
+    """
+
+    def add(self, item):
+        """
+        Adds an item to the set and returns the delta of the change.
+        """
+        super().add(item)
+        delta = self.empty()
+        delta.items.add(item)
+        return delta
+
+    def empty(self):
+        """
+        Returns an empty delta, which deltas can be joined into.
+        """
+        return DeltaGSet()
+
+class DeltaGCounter(GCounter):
+    """
+    DeltaGCounter is a delta-state GCounter. Adding to the counter returns a delta,
+    which is a DeltaGCounter with only the updated count of this replica.
+    """
+
+    def add(self, value):
+        """
+        Adds a non-negative value to the counter and returns the delta of the change.
+        """
+        super().add(value)
+        delta = self.empty()
+        delta.counts[self.id] = self.counts[self.id]
+        return delta
+
+    def empty(self):
+        """
+        Returns an empty delta, which deltas can be joined into.
+        """
+        delta = DeltaGCounter(self.id)
+        delta.counts = {}
+        return delta
+
+class DeltaTwoPhaseSet(TwoPhaseSet):
+    """
+    DeltaTwoPhaseSet is a delta-state TwoPhaseSet. Adding or removing an item returns
+    a delta, which is a DeltaTwoPhaseSet with only that item in its added or removed
+    set.
+    """
+
+    def add(self, item):
+        """
+        Adds an item to the set and returns the delta of the change.
+        """
+        delta = self.empty()
+        TwoPhaseSet.add(delta, item)
+        self.merge(delta)
+        return delta
+
+    def remove(self, item):
+        """
+        Removes an item from the set and returns the delta of the change.
+        """
+        delta = self.empty()
+        TwoPhaseSet.remove(delta, item)
+        self.merge(delta)
+        return delta
+
+    def empty(self):
+        """
+        Returns an empty delta, which deltas can be joined into.
+        """
+        return DeltaTwoPhaseSet()
+
+class DeltaBuffer():
+    """
+    DeltaBuffer keeps the deltas of a delta-state CRDT until every peer has received
+    them. Each delta is numbered in the order it was pushed. The deltas a peer has not
+    acknowledged yet are joined into a single delta to send, and the peer acknowledges
+    the number returned with it once the delta was merged, which allows the buffer to
+    drop the deltas that every peer has acknowledged.
+
+    A peer which is added to the buffer only receives the deltas pushed after it was
+    added, so it must be sent the full state first.
+    """
+
+    def __init__(self, peers=()):
+        # The buffered deltas, numbered from start
+        self.deltas = []
+        self.start = 0
+        # The number of the next delta each peer has not acknowledged
+        self.acked = {}
+        for peer in peers:
+            self.add_peer(peer)
+
+    def __len__(self):
+        return len(self.deltas)
+
+    @property
+    def end(self):
+        return self.start + len(self.deltas)
+
+    def add_peer(self, peer):
+        """
+        Starts buffering deltas for a peer.
+        """
+        self.acked.setdefault(peer, self.end)
+
+    def remove_peer(self, peer):
+        """
+        Stops buffering deltas for a peer.
+        """
+        del self.acked[peer]
+        self.compact()
+
+    def push(self, delta):
+        """
+        Buffers a delta returned by a mutator.
+        """
+        if not self.acked:
+            # Nobody needs the delta
+            self.start += 1
+            return
+        self.deltas.append(delta)
+
+    def collect(self, peer):
+        """
+        Returns a (number, delta) tuple with the deltas which the peer has not
+        acknowledged joined into one delta, or None if there are none. The number is
+        passed to ack() once the peer merged the delta.
+        """
+        pending = self.deltas[self.acked[peer] - self.start:]
+        if not pending:
+            return None
+        joined = pending[0].empty()
+        for delta in pending:
+            joined.merge(delta)
+        return self.end, joined
+
+    def ack(self, peer, number):
+        """
+        Records that a peer merged the deltas returned by collect() with the given
+        number, and drops the deltas which every peer has merged.
+        """
+        if number > self.end:
+            raise ValueError("Delta {} has not been pushed yet".format(number))
+        self.acked[peer] = max(self.acked[peer], number)
+        self.compact()
+
+    def compact(self):
+        """
+        Drops the deltas which every peer has acknowledged.
+        """
+        oldest = min(self.acked.values(), default=self.end)
+        if oldest > self.start:
+            del self.deltas[:oldest - self.start]
+            self.start = oldest
@@ -0,0 +1,136 @@
+def run_step(run, step, op):
+    """
+    Returns the step of a run if the operation continues the run, or False if it does
+    not. The step of a run with a single operation is determined by the operation
+    which continues it.
+    """
+    first = run[0]
+    last = run[-1]
+    if (op.owner.node != last.owner.node or op.owner.id != last.owner.id + 1 or op.action is not first.action
+            or op.target is None):
+        return False
+    target = op.target.owner
+    if len(run) == 1:
+        if target == last.owner:
+            return None
+        if first.target is None or target.node != first.target.owner.node:
+            return False
+        return target.id - first.target.owner.id
+    if step is None:
+        return None if target == last.owner else False
+    if target.node == first.target.owner.node and target.id == first.target.owner.id + step * len(run):
+        return step
+    return False
+
+def operation_runs(ops):
+    """
+    Returns the list of (run, step) tuples of the runs of the operations, where each
+    run is a list of operations, sorted by node and clock.
+    """
+    runs = []
+    for op in sorted(ops, key=lambda op: (op.owner.node, op.owner.id)):
+        if runs:
+            run, step = runs[-1]
+            step = run_step(run, step, op)
+            if step is not False:
+                run.append(op)
+                runs[-1] = (run, step)
+                continue
+        runs.append(([op], None))
+    return runs
+
+def encode_operations(ops):
+    """
+    Encodes a collection of operations as a list of run records, which is used when
+    a Sequence is pickled, i.e. in sync messages and stored notebooks.
+
+    Consecutive operations of a node usually have consecutive clocks and form runs:
+    typing inserts each character after the previous one, pasting inserts every
+    character before the same target, and deleting a range removes targets with
+    consecutive clocks. A run is encoded as a single record
+
+        (node, start, length, action, target, step, payload)
+
+    for the operations (node, start) to (node, start + length - 1), which all have the
+    same action. target is the (node, id) key of the target of the first operation, or
+    None. If step is None, each following operation targets the previous operation in
+    the run, and otherwise operation k targets (target node, target id + step * k).
+    payload is a string of the payloads if they are all single characters, None if
+    they are all None, and otherwise a list of the payloads, so typical text histories
+    are encoded in about the size of their text.
+    """
+    records = []
+    for run, step in operation_runs(ops):
+        first = run[0]
+        target = None
+        if first.target is not None:
+            target = (first.target.owner.node, first.target.owner.id)
+        payloads = [op.payload for op in run]
+        if all(isinstance(payload, str) and len(payload) == 1 for payload in payloads):
+            payload = "".join(payloads)
+        elif all(payload is None for payload in payloads):
+            payload = None
+        else:
+            payload = payloads
+        records.append((first.owner.node, first.owner.id, len(run), first.action.value, target, step, payload))
+    return records
+
+def expand_operations(records):
+    """
+    Lazily expands run records into (key, action, target_key, payload) tuples, where
+    the keys are (node, id) tuples.
+    """
+    # Imported here since the sequence module imports this module
+    from crdt.sequence import OperationType
+    for node, start, length, action, target, step, payload in records:
+        action = OperationType(action)
+        for k in range(length):
+            key = (node, start + k)
+            if k == 0:
+                op_target = target
+            elif step is None:
+                op_target = (node, start + k - 1)
+            else:
+                op_target = (target[0], target[1] + step * k)
+            yield key, action, op_target, None if payload is None else payload[k]
+
+def decode_operations(records):
+    """
+    Decodes run records into a dict of operations by (node, id) key.
+    """
+    from crdt.sequence import OpId, Operation
+    ops = {}
+    targets = []
+    for key, action, target, payload in expand_operations(records):
+        op = Operation(owner=OpId(*key), action=action, payload=payload)
+        ops[key] = op
+        if target is not None:
+            targets.append((op, target))
+    # Targets may be in later records, so they are resolved once all the operations
+    # have been created
+    for op, target in targets:
+        op.target = ops[target]
+    return ops
+
+def encode_order(ops):
+    """
+    Encodes a list of operations in order as a list of (node, start, length) runs of
+    consecutive operations.
+    """
+    runs = []
+    for op in ops:
+        node, id = op.owner.node, op.owner.id
+        if runs:
+            last_node, start, length = runs[-1]
+            if node == last_node and id == start + length:
+                runs[-1] = (node, start, length + 1)
+                continue
+        runs.append((node, id, 1))
+    return runs
+
+def decode_order(runs, ops):
+    """
+    Decodes a list of (node, start, length) runs into a list of operations, given a
+    dict of the operations by (node, id) key.
+    """
+    return [ops[(node, id)] for node, start, length in runs for id in range(start, start + length)]
@@ -4,6 +4,9 @@ class GSet():
     removed.
     """
     
+    # True while the items are shared with a snapshot, see snapshot()
+    shared = False
+
     def __init__(self):
         self.items = set()
 
@@ -11,17 +14,36 @@ class GSet():
         """
         Adds an item to the set.
         """
+        if self.shared:
+            self.items = set(self.items)
+            self.shared = False
         self.items.add(item)
 
     def merge(self, other):
         """
-        Merges another GSet with this one.
+        Merges another GSet (or a delta, see crdt.delta) into this one.
         """
         if not isinstance(other, GSet):
             raise ValueError("Incompatible CRDT for merge(), expected GSet")
-        self.items = self.items.union(other.items)
+        if self.shared:
+            self.items = self.items | other.get()
+            self.shared = False
+        else:
+            # Updated in place, since a merge usually only adds a few items
+            self.items |= other.get()
         return self
 
+    def snapshot(self):
+        """
+        Returns a copy of the set which shares its items with this set. The items are
+        copied the next time either set is modified (copy-on-write), so taking a
+        snapshot runs in constant time.
+        """
+        copy = GSet()
+        copy.items = self.items
+        copy.shared = self.shared = True
+        return copy
+
     def get(self):
         """
         Returns the current items in the set.
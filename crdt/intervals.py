@@ -0,0 +1,177 @@
+import bisect
+
+from crdt.gset import GSet
+from crdt.sequence import OpId
+
+class IntervalSet():
+    """
+    IntervalSet is a set of integers which is stored as a sorted list of disjoint
+    intervals, so that runs of consecutive integers take constant space. Membership is
+    checked with a binary search.
+    """
+
+    def __init__(self, values=()):
+        # The intervals are [starts[i], ends[i]), and intervals which touch are joined
+        self.starts = []
+        self.ends = []
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        """
+        Adds an integer to the set.
+        """
+        self.add_range(value, value + 1)
+
+    def add_range(self, start, end):
+        """
+        Adds the integers from start (inclusive) to end (exclusive) to the set.
+        """
+        if start >= end:
+            return
+        starts = self.starts
+        ends = self.ends
+        if not ends or start > ends[-1]:
+            # Fast paths for values beyond or right after the last interval
+            starts.append(start)
+            ends.append(end)
+            return
+        if start == ends[-1]:
+            ends[-1] = end
+            return
+        # Join the intervals from the first which ends at or after start to the last
+        # which starts at or before end
+        i = bisect.bisect_left(ends, start)
+        j = bisect.bisect_right(starts, end)
+        if i < j:
+            start = min(start, starts[i])
+            end = max(end, ends[j - 1])
+        starts[i:j] = [start]
+        ends[i:j] = [end]
+
+    def copy(self):
+        """
+        Returns a copy of the set.
+        """
+        copy = IntervalSet()
+        copy.starts = list(self.starts)
+        copy.ends = list(self.ends)
+        return copy
+
+    def update(self, other):
+        """
+        Adds all the integers of another IntervalSet to this one.
+        """
+        for start, end in zip(other.starts, other.ends):
+            self.add_range(start, end)
+        return self
+
+    def intervals(self):
+        """
+        Returns the list of (start, end) intervals, where end is exclusive.
+        """
+        return list(zip(self.starts, self.ends))
+
+    def __contains__(self, value):
+        i = bisect.bisect_right(self.starts, value) - 1
+        return i >= 0 and value < self.ends[i]
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            yield from range(start, end)
+
+    def __len__(self):
+        return sum(end - start for start, end in zip(self.starts, self.ends))
+
+    def __eq__(self, other):
+        if not isinstance(other, IntervalSet):
+            return False
+        return self.starts == other.starts and self.ends == other.ends
+
+    def __repr__(self):
+        return "IntervalSet({})".format(", ".join("[{}, {})".format(start, end) for start, end in self.intervals()))
+
+class IdSet(GSet):
+    """
+    IdSet is a GSet which stores OpIds as an IntervalSet of IDs per node. Since the
+    clock IDs of the operations made by a node are mostly consecutive, sets of OpIds
+    such as deleted IDs take space proportional to the number of runs rather than the
+    number of IDs. Other items are stored like in a GSet.
+
+    Membership checks are O(log n), while get() builds a new set of all the items and
+    should be avoided for large sets.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # IntervalSet of IDs by node
+        self.ids = {}
+
+    def add(self, item):
+        """
+        Adds an item to the set.
+        """
+        if self.shared:
+            self.unshare()
+        if isinstance(item, OpId):
+            intervals = self.ids.get(item.node)
+            if intervals is None:
+                intervals = self.ids[item.node] = IntervalSet()
+            intervals.add(item.id)
+        else:
+            self.items.add(item)
+
+    def merge(self, other):
+        """
+        Merges another GSet into this one.
+        """
+        if not isinstance(other, GSet):
+            raise ValueError("Incompatible CRDT for merge(), expected GSet")
+        if other is self:
+            return self
+        if isinstance(other, IdSet):
+            if self.shared:
+                self.unshare()
+            for node, intervals in other.ids.items():
+                if node not in self.ids:
+                    self.ids[node] = IntervalSet()
+                self.ids[node].update(intervals)
+            self.items |= other.items
+        else:
+            for item in other.get():
+                self.add(item)
+        return self
+
+    def snapshot(self):
+        """
+        Returns a copy of the set which shares its items and intervals with this set.
+        They are copied the next time either set is modified (copy-on-write).
+        """
+        copy = IdSet()
+        copy.items = self.items
+        copy.ids = self.ids
+        copy.shared = self.shared = True
+        return copy
+
+    def unshare(self):
+        """
+        Copies the items and intervals which are shared with a snapshot.
+        """
+        self.items = set(self.items)
+        self.ids = {node: intervals.copy() for node, intervals in self.ids.items()}
+        self.shared = False
+
+    def get(self):
+        """
+        Returns the current items in the set.
+        """
+        items = set(self.items)
+        for node, intervals in self.ids.items():
+            items.update(OpId(node, id) for id in intervals)
+        return items
+
+    def __contains__(self, item):
+        if isinstance(item, OpId):
+            intervals = self.ids.get(item.node)
+            return intervals is not None and item.id in intervals
+        return item in self.items
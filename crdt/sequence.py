@@ -1,22 +1,66 @@
+from collections import deque
+from contextlib import contextmanager
 from functools import cmp_to_key
+import hashlib
+import logging
+import sys
 import uuid
 from enum import Enum
 
+from crdt.encoding import decode_operations, decode_order, encode_operations, encode_order
 from crdt.gset import GSet
 from crdt.gcounter import GCounter
 from crdt.tree import ObjectTree
 
+# Minimum number of operations in the nested sequences of a merge for the nested
+# sequences to be merged in parallel, see benchmarks/merge.py
+PARALLEL_MERGE_THRESHOLD = 10000
+
+logger = logging.getLogger(__name__)
+
 class Sequence():
     """
     Sequence is a CRDT that represents an ordered set of objects and supports insertion
     and removal at arbitrary positions in the set.
     """
 
-    def __init__(self, id=uuid.uuid4()):
+    # Snapshots are read-only views of a Sequence and cannot be modified
+    frozen = False
+
+    # Events which are held until they can be delivered, see hold_events()
+    held = None
+
+    # Stubs are empty placeholders for nested sequences which were left out of a
+    # snapshot, see snapshot()
+    stub = False
+
+    # The operation of the last visible object, which appends are inserted after, or
+    # None if it has to be looked up in the storage engine again
+    tail = None
+
+    # A frozen copy of the sequence which snapshots reuse until the sequence changes,
+    # see copy()
+    cached_copy = None
+
+    # Incremented whenever operations are added to the sequence, or a merge changes
+    # one of its nested sequences, so that changes are detected without comparing or
+    # observing the sequence
+    revision = 0
+
+    def __init__(self, id=uuid.uuid4(), storage=ObjectTree):
         self.id = id
         self.operations = GSet()
         self.clock = GCounter(self.id)
-        self.sequence = ObjectTree()
+        # The storage engine which orders the objects, e.g. ObjectTree or ColumnarTree
+        self.sequence = storage()
+        self.listeners = []
+        # The XOR of the digests of all the operations, which is updated whenever an
+        # operation is added so that replicas can be compared cheaply
+        self.digest = 0
+        # The number of visible objects
+        self.length = 0
+        # True once an operation inserted a nested sequence
+        self.has_nested = False
 
     def compare_operations(self, a, b):
         """
@@ -33,45 +77,111 @@ class Sequence():
         insert operation at the end of the operation log.
         """
         
+        self.check_writable()
+
         # Tick the clock
         self.clock.add(1)
 
-        objects = self.get_objects()
-        if len(self.get()) == 0:
-            # Special case: there is no operation to reference
-            target = None
-            action = OperationType.INSERT_BEFORE
-        elif len(objects) == 0:
-            # Special case: no visible objects to reference
-            target = self.sequence[0].operation
+        target = self.get_tail()
+        if target is None:
+            # Special case: there is no visible object to reference, so the item is
+            # inserted as a new root, which is placed after the existing roots
             action = OperationType.INSERT_BEFORE
         else:
-            # Insert after the last object in the sequence
-            target = objects[-1].operation
+            # Insert after the last visible object in the sequence
             action = OperationType.INSERT_AFTER
 
         # Add the insert operation to the log and update the sequence
         owner = OpId(self.id, self.clock.get())
         op = Operation(owner=owner, action=action, target=target, payload=item)
-        self.operations.add(op)
+        self.add_operation(op)
         op.do(self.sequence)
+        self.tail = op
+        self.length += 1
+        self.emit([("retain", self.length - 1), ("insert", [item])])
+
+    def get_tail(self):
+        """
+        Returns the operation of the last visible object, or None if there are no
+        visible objects. The operation is cached, so appending runs in constant time.
+        """
+        if self.tail is None and self.length > 0:
+            self.tail = self.sequence.last_visible()
+        return self.tail
+
+    def get_length(self):
+        """
+        Returns the number of visible objects.
+        """
+        return self.length
+
+    def add_operation(self, op):
+        """
+        Adds a local operation to the operation log.
+        """
+        self.operations.add(op)
+        self.digest ^= operation_digest(op)
+        self.revision += 1
+        if isinstance(op.payload, Sequence):
+            self.has_nested = True
+            if self.listeners:
+                self.observe(op, True)
+        # The cached copy would keep the lists shared with it alive after they are
+        # copied for this write
+        self.cached_copy = None
+
+    def get_digest(self):
+        """
+        Returns a digest of the operations in the sequence. Two replicas with the same
+        digest contain the same operations (with high probability), regardless of the
+        order in which the operations were added.
+        """
+        return self.digest
 
     def append_many(self, items):
         """
-        Appends an iterable of items to the end of the sequence.
+        Appends an iterable of items to the end of the sequence. The clock is ticked
+        once for all the items, and the subscribed callbacks are notified once.
         """
-        for item in items:
-            self.append(item)
+        self.check_writable()
+        items = list(items)
+        if not items:
+            return
 
-    def object_at_position(self, position):
+        # Reserve a range of operation IDs for the items
+        start = self.reserve(len(items))
+        position = self.length
+        target = self.get_tail()
+        for i, item in enumerate(items):
+            # The first item is inserted as a new root if there is no visible object
+            action = OperationType.INSERT_BEFORE if target is None else OperationType.INSERT_AFTER
+            op = Operation(owner=OpId(self.id, start + i), action=action, target=target, payload=item)
+            self.add_operation(op)
+            op.do(self.sequence)
+            target = op
+        self.tail = target
+        self.length += len(items)
+        self.emit([("retain", position), ("insert", items)])
+
+    def reserve(self, count):
+        """
+        Ticks the clock for a batch of count operations and returns the first of their
+        consecutive IDs.
         """
-        Returns the object at the specified position. The given position is from the
-        perspective of the caller (e.g., does not count deleted objects).
+        start = self.clock.get() + 1
+        self.clock.add(count)
+        return start
+
+    def operation_at_position(self, position):
+        """
+        Returns the operation of the object at the specified position. The given
+        position is from the perspective of the caller (e.g., does not count deleted
+        objects). The object is found by the storage engine without listing the
+        objects.
         """
-        objects = self.get_objects()
-        if position < 0 or position >= len(objects):
-            raise IndexError("Position {} out of range of sequence with length {}".format(position, len(objects)))
-        return objects[position]
+        if position < 0 or position >= self.length:
+            raise IndexError("Position {} out of range of sequence with length {}".format(position, self.length))
+        return self.sequence.visible_operations(position, 1)[0]
 
     def insert(self, position, item):
         """
@@ -80,55 +190,91 @@ class Sequence():
         objects). This makes it easier for the caller to make insertions because the
         caller does not have to keep track of object IDs.
         """
+        self.check_writable()
+        target = self.operation_at_position(position)
+        self.insert_before(target, position, item)
+
+    def insert_many(self, position, items):
+        """
+        Inserts an iterable of objects at the specified position.
+        """
+        self.check_writable()
+        items = list(items)
+        if not items:
+            return
+
+        # Every item is inserted before the same object, so it only has to be found once
+        target = self.operation_at_position(position)
+        start = self.reserve(len(items))
+        for i, item in enumerate(items):
+            op = Operation(owner=OpId(self.id, start + i), action=OperationType.INSERT_BEFORE, target=target, payload=item)
+            self.add_operation(op)
+            op.do(self.sequence)
+        self.length += len(items)
+        self.emit([("retain", position), ("insert", items)])
 
+    def insert_before(self, target, position, item):
+        """
+        Inserts an item before the object created by the target operation, which must
+        be at the given position.
+        """
         # Tick the clock
         self.clock.add(1)
-
-        target = self.object_at_position(position).operation
         owner = OpId(self.id, self.clock.get())
 
         # Add the insert operation to the log and update the sequence
         op = Operation(owner=owner, action=OperationType.INSERT_BEFORE, target=target, payload=item)
-        self.operations.add(op)
+        self.add_operation(op)
         op.do(self.sequence)
-
-    def insert_many(self, position, items):
-        """
-        Inserts an iterable of objects at the specified position.
-        """
-        for item in items:
-            self.insert(position, item)
-            position += 1
+        self.length += 1
+        self.emit([("retain", position), ("insert", [item])])
 
     def remove(self, position):
         """
         Removes an item from the set at the specified position. This raises an
         IndexError if the position is out of bounds of the current sequence.
         """
-        # Tick the clock
-        self.clock.add(1)
-
-        target = self.object_at_position(position).operation
-        owner = OpId(self.id, self.clock.get())
-
-        # Add the remove operation to the log and update the sequence
-        op = Operation(owner=owner, action=OperationType.REMOVE, target=target)
-        self.operations.add(op)
-        op.do(self.sequence)
+        self.remove_many(position, 1)
 
     def remove_many(self, position, count):
         """
         Removes a number of items from the sequence at the specified position.
         """
-        for i in range(count):
-            self.remove(position)
+        self.check_writable()
+        if count <= 0:
+            return
+
+        if position < 0 or position + count > self.length:
+            raise IndexError("Range {}:{} out of range of sequence with length {}".format(position, position + count, self.length))
 
-    def merge(self, other):
+        start = self.reserve(count)
+        for i, target in enumerate(self.sequence.visible_operations(position, count)):
+            # Add the remove operation to the log and update the sequence
+            op = Operation(owner=OpId(self.id, start + i), action=OperationType.REMOVE, target=target)
+            self.add_operation(op)
+            op.do(self.sequence)
+            if target == self.tail:
+                self.tail = None
+        self.length -= count
+        self.emit([("retain", position), ("delete", count)])
+
+    def merge(self, other, executor=None, threshold=PARALLEL_MERGE_THRESHOLD):
         """
-        Merges another Sequence with this one.
+        Merges another Sequence with this one. If a ProcessPoolExecutor is specified,
+        nested sequences are merged in parallel when the nested sequences in the other
+        Sequence contain at least threshold operations in total, see merge_parallel().
         """
         if not isinstance(other, Sequence):
             raise ValueError("Incompatible CRDT for merge(), expected Sequence")
+        if executor is not None:
+            # Imported here since multiprocessing is only needed for parallel merges
+            from concurrent.futures import ProcessPoolExecutor
+            if not isinstance(executor, ProcessPoolExecutor):
+                raise ValueError("Parallel merges require a ProcessPoolExecutor")
+
+        # Merging modifies both sequences, so merge with a writable copy of a snapshot
+        if other.frozen:
+            other = other.copy()
 
         # Merge the two operation logs
         self.merge_operations(other)
@@ -136,19 +282,93 @@ class Sequence():
 
         # If we are merging two sequences of sequences, we need to recursively merge
         # each of the sub-sequences.
-        this_sequence = self.get()
-        other_sequence = other.get()
-        for i in range(len(this_sequence)):
-            if isinstance(this_sequence[i], Sequence) and isinstance(other_sequence[i], Sequence):
-                this_sequence[i].merge(other_sequence[i])
-                this_sequence[i].id = self.id
+        nested = []
+        pairs = []
+        for this, that in zip(self.get(), other.get()):
+            if isinstance(this, Sequence) and isinstance(that, Sequence) and not that.stub:
+                nested.append(this)
+                if this.needs_merge(that):
+                    pairs.append((this, that))
+        digests = [this.digest for this, that in pairs]
 
+        if executor is not None and sum(len(that.operations.get()) for this, that in pairs) >= threshold:
+            self.merge_parallel(pairs, executor)
+            for this, that in pairs:
+                self.nested_merged(this)
+        else:
+            for this, that in pairs:
+                this.merge(that)
+                self.nested_merged(this)
+
+        if any(this.digest != digest for (this, that), digest in zip(pairs, digests)):
+            self.revision += 1
+        for this in nested:
+            this.id = self.id
         return self
 
+    def nested_merged(self, nested):
+        """
+        Called after a nested sequence was merged by merge(). Parallel merges call it
+        once all the nested sequences are merged.
+        """
+        pass
+
+    def needs_merge(self, other):
+        """
+        Returns True if another replica of this nested sequence has to be merged into
+        it.
+        """
+        return True
+
+    def merge_parallel(self, pairs, executor):
+        """
+        Merges pairs of nested sequences in the worker processes of a
+        ProcessPoolExecutor. The merged sequences are returned from the workers and
+        replace the state of the local sequences in order, so the merge is
+        deterministic regardless of which merge finishes first.
+
+        Both sequences of every pair are pickled to the workers and the merged
+        sequences are pickled back, which this process does one pair at a time. The
+        merges themselves are CPU-bound, so threads would not run them in parallel.
+        Parallel merges only pay off with several cores and large nested sequences;
+        benchmarks/merge.py measures the threshold on a given machine.
+        """
+        futures = [executor.submit(merge_nested, this, that) for this, that in pairs]
+        for (this, that), future in zip(pairs, futures):
+            this.assign(future.result())
+
+    def assign(self, other):
+        """
+        Replaces the state of this sequence with the state of another sequence, such as
+        a merged copy of this sequence returned from another process.
+        """
+        self.check_writable()
+        visible = set(obj.operation for obj in self.sequence if not obj.tombstone)
+        inserted = other.operations.get().difference(self.operations.get())
+        if self.listeners:
+            # The nested sequences are replaced by the nested sequences of the other
+            # sequence, so the relays are moved to them
+            self.observe_nested(False)
+        self.operations = other.operations
+        self.clock = other.clock
+        self.sequence = other.sequence
+        self.digest = other.digest
+        self.length = other.length
+        self.has_nested = other.has_nested
+        self.tail = None
+        self.cached_copy = None
+        self.revision += 1
+
+        if self.listeners:
+            self.observe_nested(True)
+            removed = set(obj.operation for obj in self.sequence if obj.tombstone and obj.operation in visible)
+            self.emit(self.merge_delta(inserted, removed), local=False)
+
     def merge_operations(self, other):
         """
         Merge the operation log of another Sequence with this one.
         """
+        self.check_writable()
 
         # Sync the local clock with the remote clock
         self.clock = self.clock.merge(other.clock)
@@ -158,14 +378,302 @@ class Sequence():
         
         # Get a sorted view of the patches to apply
         patch_log = sorted(patch_ops, key=cmp_to_key(self.compare_operations))
+        if patch_log:
+            self.cached_copy = None
+            self.revision += 1
 
-        # Patch the sequence using the new operations
+        # Patch the sequence using the new operations, keeping track of the inserted
+        # and removed objects so that observers can be notified of the changes
+        inserted = set()
+        removed = set()
         for op in patch_log:
-            op.do(self.sequence)
+            self.digest ^= operation_digest(op)
+            if isinstance(op.payload, Sequence):
+                self.has_nested = True
+                if self.listeners and op.action is not OperationType.REMOVE:
+                    self.observe(op, True)
+            obj = op.do(self.sequence)
+            if obj is None:
+                continue
+            if op.action is OperationType.REMOVE:
+                removed.add(obj.operation)
+            else:
+                inserted.add(op)
+        self.length += len(inserted) - len(removed)
+        if inserted or self.tail in removed:
+            # Remote objects may have been inserted after the last visible object
+            self.tail = None
 
         # Merge the two operation logs
         self.operations = self.operations.merge(other.operations)
 
+        if self.listeners and (inserted or removed):
+            self.emit(self.merge_delta(inserted, removed), local=False)
+
+    def merge_delta(self, inserted, removed):
+        """
+        Computes the delta between the visible items before and after a merge, given
+        the operations which were inserted and the operations whose objects were
+        removed by the merge.
+        """
+        delta = []
+        for obj in self.sequence:
+            op = obj.operation
+            if op in inserted:
+                if not obj.tombstone:
+                    add_delta(delta, "insert", [op.payload])
+            elif op in removed:
+                add_delta(delta, "delete", 1)
+            elif not obj.tombstone:
+                add_delta(delta, "retain", 1)
+        return delta
+
+    def subscribe(self, callback):
+        """
+        Registers a callback which is called with a SequenceEvent whenever the visible
+        items in the sequence change, either from a local operation or from a merge.
+        Changes to nested sequences are also reported to the callback, with the path of
+        the nested sequence in the event.
+        """
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+            if len(self.listeners) == 1:
+                self.observe_nested(True)
+
+    def unsubscribe(self, callback):
+        """
+        Removes a callback registered with subscribe(). Once the last callback is
+        removed, the nested sequences are no longer observed.
+        """
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+            if not self.listeners:
+                self.observe_nested(False)
+
+    def observe_nested(self, observe):
+        """
+        Subscribes a NestedRelay to each nested sequence if observe is True, or
+        unsubscribes the relays otherwise. The nested sequences are only observed while
+        the sequence has listeners, so changes to them are not relayed otherwise.
+        """
+        if not self.has_nested:
+            return
+        for obj in self.sequence:
+            self.observe(obj.operation, observe)
+
+    def observe(self, op, observe):
+        """
+        Subscribes or unsubscribes the NestedRelay for the nested sequence inserted by
+        an operation, if its payload is a sequence.
+        """
+        if isinstance(op.payload, Sequence):
+            if observe:
+                op.payload.subscribe(NestedRelay(self, op))
+            else:
+                op.payload.unsubscribe(NestedRelay(self, op))
+
+    def emit(self, delta, local=True):
+        """
+        Notifies the subscribed callbacks of a change to the sequence.
+        """
+        if not self.listeners:
+            return
+
+        event = SequenceEvent(self, delta, local=local)
+        if event.delta:
+            self.notify(event)
+
+    def notify(self, event):
+        """
+        Calls the subscribed callbacks with the event.
+        """
+        if self.held is not None:
+            self.held.append(event)
+            return
+        for callback in list(self.listeners):
+            callback(event)
+
+    def hold_events(self):
+        """
+        Holds the events of the sequence until they are delivered by transaction().
+        """
+        if self.held is None:
+            self.held = []
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups the changes made in the block into one batch. The events of the batch
+        are held until the block exits, and consecutive events which change the same
+        sequence are then combined into a single event, so that observers are notified
+        once per batch rather than once per operation. Transactions may be nested, in
+        which case the events are delivered when the outermost transaction exits.
+        """
+        if self.held is not None:
+            yield self
+            return
+        self.hold_events()
+        try:
+            yield self
+        finally:
+            held, self.held = self.held, None
+            for event in coalesce_events(held):
+                self.notify(event)
+
+    def relay(self, event, op):
+        """
+        Forwards an event from the nested sequence inserted by an operation to the
+        callbacks subscribed to this sequence, prefixing the path with the position of
+        the nested sequence. The position is looked up in the storage engine.
+        """
+        if not self.sequence.is_visible(op):
+            # The nested sequence is no longer visible
+            return
+        path = (self.sequence.position(op),) + event.path
+        self.notify(SequenceEvent(event.sequence, event.delta, path=path, local=event.local, source=self))
+
+    def check_writable(self):
+        """
+        Raises a ValueError if the sequence is a snapshot.
+        """
+        if self.frozen:
+            raise ValueError("Cannot modify a frozen Sequence snapshot")
+
+    def snapshot(self, exclude=None):
+        """
+        Returns an immutable snapshot of the current state of the sequence. Taking a
+        snapshot is cheap because the snapshot shares the operation log and the
+        underlying tree with the sequence using copy-on-write, so callers can take a
+        snapshot while holding a lock and then read, render or serialize it after
+        releasing the lock while writers continue to modify the sequence. Nested
+        sequences which did not change since the last snapshot are not copied again,
+        so a snapshot of a notebook costs time in the number of cells rather than the
+        number of operations in the cells.
+
+        exclude is an optional dict of nested sequence digests by the key of the
+        operation which inserted them, see nested_digests(). Nested sequences with the
+        same digest are replaced by empty stubs, e.g. to leave out the cells which a
+        remote replica already has from a snapshot sent to it. Stubs are skipped when
+        merging.
+        """
+        return self.copy(frozen=True, exclude=exclude)
+
+    def nested_digests(self):
+        """
+        Returns a dict of the digests of the visible nested sequences by the key of
+        the operation which inserted them.
+        """
+        digests = {}
+        for obj in self.get_objects():
+            payload = obj.operation.payload
+            if isinstance(payload, Sequence):
+                digests[operation_key(obj.operation)] = payload.get_digest()
+        return digests
+
+    def copy(self, frozen=False, exclude=None):
+        """
+        Returns a copy of the sequence which is independent of future modifications.
+        Nested sequences are copied recursively, or replaced by stubs if their digests
+        are in exclude.
+        """
+        cached = self.__dict__.get("cached_copy")
+        if frozen and cached is not None and cached.digest == self.digest and cached.id == self.id:
+            # Frozen copies are immutable, so snapshots share the copy of a sequence
+            # without nested sequences until an operation changes its digest
+            return cached
+        copy = self.__class__.__new__(self.__class__)
+        copy.__dict__.update(self.__dict__)
+        copy.__dict__.pop("cached_copy", None)
+        # The clock keeps the ID it was created with, which differs from the ID of the
+        # sequence once a merged nested sequence is adopted by the local replica
+        copy.clock = GCounter(self.clock.id)
+        copy.clock.counts = dict(self.clock.counts)
+        if self.has_nested:
+            # Operations are immutable and can usually be shared. However, nested
+            # sequences are mutable, so the operations referencing them are rebuilt
+            # with copies of the nested sequences.
+            copy.operations = GSet()
+            remapped = {}
+            def remap(op):
+                if op is None:
+                    return None
+                if op not in remapped:
+                    payload = op.payload
+                    if isinstance(payload, Sequence):
+                        if exclude and exclude.get(operation_key(op)) == payload.get_digest():
+                            payload = payload.make_stub()
+                        else:
+                            payload = payload.copy(frozen=frozen)
+                    remapped[op] = Operation(owner=op.owner, action=op.action, target=remap(op.target), payload=payload)
+                return remapped[op]
+            for op in sorted(self.operations.get(), key=cmp_to_key(self.compare_operations)):
+                copy.operations.add(remap(op))
+            copy.sequence = self.sequence.snapshot(remap=remap)
+            copy.tail = remap(self.tail)
+        else:
+            copy.operations = self.operations.snapshot()
+            copy.sequence = self.sequence.snapshot()
+        copy.listeners = []
+        copy.__dict__.pop("held", None)
+        copy.frozen = frozen
+        if frozen and not self.has_nested:
+            self.cached_copy = copy
+        return copy
+
+    def make_stub(self):
+        """
+        Returns an empty stub which stands in for this sequence.
+        """
+        stub = self.__class__(id=self.id)
+        stub.stub = True
+        return stub
+
+    def __getstate__(self):
+        """
+        Snapshots are only frozen locally and callbacks are only meaningful locally,
+        so the frozen flag, the listeners and any held events are not pickled.
+
+        The operations are pickled as runs (see encode_operations()) together with the
+        order of the objects in the storage engine, from which the storage engine is
+        rebuilt without applying the operations again. Pickling the operations
+        themselves would also recurse through the chain of targets, which fails for
+        long sequences.
+        """
+        state = self.__dict__.copy()
+        state.pop("frozen", None)
+        state.pop("listeners", None)
+        state.pop("held", None)
+        state.pop("tail", None)
+        state.pop("cached_copy", None)
+        tree = state.pop("sequence")
+        state["log"] = encode_operations(state.pop("operations").get())
+        state["storage"] = tree.__class__
+        state["layout"] = [((root.owner.node, root.owner.id), encode_order(ops)) for root, ops in tree.layout()]
+        return state
+
+    def __setstate__(self, state):
+        log = state.pop("log", None)
+        if log is not None:
+            ops = decode_operations(log)
+            self.operations = GSet()
+            self.operations.items = set(ops.values())
+            removed = set(op.target for op in self.operations.items if op.action is OperationType.REMOVE)
+            self.sequence = state.pop("storage")()
+            self.sequence.load([(ops[root], decode_order(runs, ops)) for root, runs in state.pop("layout")], removed)
+        self.__dict__.update(state)
+        self.listeners = []
+        if "length" not in state:
+            # Sequences pickled before the length was tracked
+            self.length = len(self.get_objects())
+        if "digest" not in state:
+            # Sequences pickled before digests were introduced
+            self.digest = 0
+            for op in self.operations.get():
+                self.digest ^= operation_digest(op)
+        if "has_nested" not in state:
+            # Sequences pickled before nested sequences were tracked
+            self.has_nested = any(isinstance(op.payload, Sequence) for op in self.operations.get())
+
     def get_objects(self):
         """
         Returns the sorted list of objects that are not tombstones.
@@ -178,11 +686,224 @@ class Sequence():
         """
         return [obj.operation.payload for obj in self.sequence if not obj.tombstone]
 
+def add_delta(delta, action, value):
+    """
+    Appends a step to a delta, coalescing it with the previous step if they have the
+    same action.
+    """
+    if delta and delta[-1][0] == action:
+        delta[-1] = (action, delta[-1][1] + value)
+    else:
+        delta.append((action, value))
+
+def compose_delta(first, second):
+    """
+    Returns a delta with the effect of applying the first delta and then the second
+    delta. Items which are inserted by the first delta and deleted by the second delta
+    are left out.
+    """
+    result = []
+    first = list(first)
+    # The step of the first delta which is being consumed, and how much of it is left
+    i = 0
+    rest = None
+    for action, value in second:
+        if action == "insert":
+            add_delta(result, action, list(value))
+            continue
+        # Retains and deletes apply to the items after the first delta
+        count = value
+        while count > 0:
+            if i == len(first):
+                # The first delta implicitly retains the remaining items
+                add_delta(result, action, count)
+                break
+            step, remaining = first[i][0], rest if rest is not None else first[i][1]
+            if step == "delete":
+                add_delta(result, step, remaining)
+                i, rest = i + 1, None
+                continue
+            size = len(remaining) if step == "insert" else remaining
+            taken = min(size, count)
+            if step == "insert":
+                if action == "retain":
+                    add_delta(result, step, remaining[:taken])
+                rest = remaining[taken:]
+            else:
+                add_delta(result, action, taken)
+                rest = remaining - taken
+            if taken == size:
+                i, rest = i + 1, None
+            count -= taken
+    if i < len(first):
+        add_delta(result, first[i][0], rest if rest is not None else first[i][1])
+        for step, remaining in first[i + 1:]:
+            add_delta(result, step, remaining)
+    return result
+
+def transform_delta(delta, other, first=True):
+    """
+    Rebases a delta over another delta which was applied to the same items
+    concurrently, and returns a delta with the same effect which applies after the
+    other delta. Items inserted by both deltas at the same position are placed with
+    the items of this delta first if first is True. Transforming each delta over the
+    other with opposite values of first gives the same result in either order.
+    """
+    result = []
+    ours = deque([action, value] for action, value in delta)
+    theirs = deque([action, value] for action, value in other)
+    while ours:
+        action, value = ours[0]
+        if action == "insert" and (first or not theirs or theirs[0][0] != "insert"):
+            add_delta(result, action, value)
+            ours.popleft()
+            continue
+        if not theirs:
+            add_delta(result, action, value)
+            ours.popleft()
+            continue
+        other_action, other_value = theirs[0]
+        if other_action == "insert":
+            # The items inserted by the other delta are kept
+            add_delta(result, "retain", len(other_value))
+            theirs.popleft()
+            continue
+        # Items deleted by the other delta no longer need to be retained or deleted
+        count = min(value, other_value)
+        if other_action == "retain":
+            add_delta(result, action, count)
+        for steps in (ours, theirs):
+            if steps[0][1] == count:
+                steps.popleft()
+            else:
+                steps[0][1] -= count
+    if result and result[-1][0] == "retain":
+        result.pop()
+    return result
+
+def coalesce_events(events):
+    """
+    Combines consecutive events which change the same sequence at the same path into
+    single events, see Sequence.transaction().
+    """
+    combined = []
+    for event in events or []:
+        last = combined[-1] if combined else None
+        if (last is not None and last.sequence is event.sequence and last.path == event.path
+                and last.local == event.local and last.source is event.source):
+            combined[-1] = SequenceEvent(event.sequence, compose_delta(last.delta, event.delta), path=event.path,
+                                         local=event.local, source=event.source)
+        else:
+            combined.append(event)
+    return [event for event in combined if event.delta]
+
+class SequenceEvent():
+    """
+    A SequenceEvent describes a change to the visible items in a Sequence.
+
+    sequence: Sequence
+    The Sequence which was changed.
+
+    delta: list
+    The change as a list of (action, value) steps which are applied in order from the
+    start of the sequence. ("retain", n) skips over n unchanged items, ("insert", items)
+    inserts a list of items and ("delete", n) removes n items. Trailing retains are
+    omitted.
+
+    path: tuple
+    The positions of the nested sequences leading from the subscribed Sequence to the
+    changed Sequence, e.g. (2,) for a change to the third cell of a notebook. The path
+    is empty if the subscribed Sequence itself was changed.
+
+    local: bool
+    True if the change was made by a local operation, False if it was made by a merge.
+
+    source: Sequence
+    The Sequence which the callback was subscribed to.
+    """
+
+    def __init__(self, sequence, delta, path=(), local=True, source=None):
+        self.sequence = sequence
+        self.delta = []
+        for action, value in delta:
+            if value:
+                add_delta(self.delta, action, value)
+        if self.delta and self.delta[-1][0] == "retain":
+            self.delta.pop()
+        self.path = path
+        self.local = local
+        self.source = source if source is not None else sequence
+
+    def changes(self):
+        """
+        Yields the changes in the delta as (action, position, value) tuples, where the
+        position is the index of the change after the previous changes are applied.
+        """
+        position = 0
+        for action, value in self.delta:
+            if action == "retain":
+                position += value
+            elif action == "insert":
+                yield action, position, value
+                position += len(value)
+            else:
+                yield action, position, value
+
+    def __repr__(self):
+        """
+        Prints the SequenceEvent to stdout.
+        """
+        return "path: {}, delta: {}, local: {}".format(self.path, self.delta, self.local)
+
+class NestedRelay():
+    """
+    A callback subscribed to a nested sequence, which forwards its events to the
+    sequence that contains it, see Sequence.relay(). Relays for the same parent and
+    operation are equal, so they can be unsubscribed by creating a new relay.
+    """
+    def __init__(self, parent, op):
+        self.parent = parent
+        self.op = op
+
+    def __call__(self, event):
+        self.parent.relay(event, self.op)
+
+    def __eq__(self, other):
+        return isinstance(other, NestedRelay) and other.parent is self.parent and other.op == self.op
+
+def operation_key(op):
+    """
+    Returns the (node, id) tuple which identifies an operation.
+    """
+    return (op.owner.node, op.owner.id)
+
+def operation_digest(op):
+    """
+    Returns a 128-bit digest of an operation. Operations are identified by their OpId,
+    so the digest is a hash of the OpId. The digests of a set of operations are
+    combined with XOR, which is independent of the order of the operations and can
+    be updated incrementally.
+    """
+    key = "{}\x00{}".format(op.owner.node, op.owner.id).encode()
+    return int.from_bytes(hashlib.blake2b(key, digest_size=16).digest(), "big")
+
+def merge_nested(this, that):
+    """
+    Merges a pair of nested sequences and returns the result. This is submitted to the
+    executor for parallel merges, so it must be a module-level function which can be
+    pickled.
+    """
+    return this.merge(that)
+
 class Object():
     """
     An Object represents a single item in a Sequence.
     """
-    
+
+    # A Sequence contains an Object, an Operation and an OpId for every item, so these
+    # classes use slots instead of a per-instance __dict__ to reduce their size
+    __slots__ = ("operation", "tombstone")
+
     def __init__(self, operation):
         self.operation = operation
         self.tombstone = False
@@ -209,7 +930,13 @@ class OpId():
     across nodes, but (node, ID) pairs are.
     """
 
+    __slots__ = ("node", "id")
+
     def __init__(self, node, id):
+        # Node names are interned so that every OpId from the same node shares the same
+        # string, including OpIds which were unpickled from remote replicas
+        if isinstance(node, str):
+            node = sys.intern(node)
         self.node = node
         self.id = id
 
@@ -256,6 +983,12 @@ class OpId():
             return False
         return self.is_earlier(other)
 
+    def __hash__(self):
+        return hash((self.node, self.id))
+
+    def __reduce__(self):
+        return (OpId, (self.node, self.id))
+
     def __repr__(self):
         """
         Prints the OpId to stdout.
@@ -291,8 +1024,10 @@ class Operation():
     The payload of the Operation, which is the actual object to be inserted or removed.
     """
 
+    __slots__ = ("owner", "action", "target", "payload")
+
     def __init__(self, owner=None, action=None, target=None, payload=None):
-        if action not in OperationType:
+        if not isinstance(action, OperationType):
             raise ValueError("Invalid operation type")
         self.owner = owner
         self.action = action
@@ -301,24 +1036,26 @@ class Operation():
 
     def do(self, objects):
         """
-        Applies this Operation to an ordered list of objects.
+        Applies this Operation to an ordered list of objects. Returns the inserted or
+        removed object, or None if the operation did not change the visible objects.
         """
-        obj = Object(self)
-        if self.action == OperationType.INSERT_BEFORE:
+        # Enum members are singletons, so they can be compared by identity
+        action = self.action
+        if action is OperationType.INSERT_BEFORE:
+            obj = Object(self)
             objects.insert(self.target, obj, before=True)
-        elif self.action == OperationType.INSERT_AFTER:
+        elif action is OperationType.INSERT_AFTER:
+            obj = Object(self)
             objects.insert(self.target, obj, before=False)
-        elif self.action == OperationType.REMOVE:
-            for obj in objects:
-                if obj.operation == self.target:
-                    obj.tombstone = True
-                    break
+        elif action is OperationType.REMOVE:
+            obj = objects.tombstone(self.target)
         else:
             raise ValueError("Invalid operation type")
 
-        print("Applied operation: {}".format(self))
-
-        print("Resulting sequence: {}".format([obj.operation.payload for obj in objects if not obj.tombstone]))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Applied operation: %s", self)
+            logger.debug("Resulting sequence: %s", [obj.operation.payload for obj in objects if not obj.tombstone])
+        return obj
 
     def __eq__(self, other):
         if not isinstance(other, Operation):
@@ -331,7 +1068,10 @@ class Operation():
         return self.owner < other.owner
 
     def __hash__(self):
-        return hash(self.owner.get_hash())
+        return hash(self.owner)
+
+    def __reduce__(self):
+        return (Operation, (self.owner, self.action, self.target, self.payload))
 
     def __repr__(self):
         """
@@ -1,10 +1,125 @@
+# Maximum number of objects in a block of an ObjectTree before it is split in two
+BLOCK_SIZE = 256
+
 class ObjectTree():
     """
     An ObjectTree is an append-only data structure which stores a sequence of objects
     as a tree to optimize searching.
+
+    The order of the objects is defined by the tree of operations, where each insert
+    operation is a child of its target: an object comes after the objects inserted
+    before it and before the objects inserted after it. Operations inserted before the
+    same target are ordered by ascending OpId, and operations inserted after the same
+    target by descending OpId, each together with all of its descendants. This order
+    does not depend on the order in which the operations are applied, which is what
+    makes replicas converge.
+
+    The objects are kept in order in blocks of at most BLOCK_SIZE objects, and each
+    operation is mapped to its object and its block. Each block counts its visible
+    objects, so the position of an object and the object at a position are found by
+    skipping whole blocks, in O(n / BLOCK_SIZE + BLOCK_SIZE) time rather than by
+    scanning every object.
     """
+
     def __init__(self):
+        # The operations of the roots, in order
         self.roots = []
+        self.blocks = []
+        # The operations inserted before and after each target operation, as lists in
+        # the order in which they are placed
+        self.before = {}
+        self.after = {}
+        # The current object and the block of each operation
+        self.objects = {}
+        self.block_of = {}
+        # The index of each block in blocks, which is not shared with snapshots
+        self.block_index = {}
+        # True if the tables are also referenced by a snapshot
+        self.shared = False
+        # The (before, target) keys of the sibling lists which were copied since the
+        # tables were last shared, and can be written in place. The before and after
+        # lists of a target are copied separately.
+        self.owned = set()
+        # The known ends of the chains followed by leftmost() and rightmost()
+        self.first = {}
+        self.last = {}
+
+    def snapshot(self, remap=None):
+        """
+        Returns a copy of the tree which shares its blocks and tables with this tree. A
+        shared block or table is copied the next time either tree writes to it
+        (copy-on-write), so the copy is unaffected by later modifications. If remap is
+        specified, the copy is instead rebuilt with fresh objects for the operations
+        returned by remap(op).
+        """
+        tree = ObjectTree()
+        if remap is None:
+            tree.roots = list(self.roots)
+            tree.before = self.before
+            tree.after = self.after
+            tree.objects = self.objects
+            tree.block_of = self.block_of
+            tree.shared = self.shared = True
+            self.owned = set()
+            tree.block_index = dict(self.block_index)
+            for block in self.blocks:
+                block.shared = True
+                tree.blocks.append(block)
+            return tree
+
+        tree.roots = [remap(root) for root in self.roots]
+        tree.before = remap_siblings(self.before, remap)
+        tree.after = remap_siblings(self.after, remap)
+        for block in self.blocks:
+            copy = ObjectBlock()
+            for obj in block.nodes:
+                node = obj.__class__(remap(obj.operation))
+                node.tombstone = obj.tombstone
+                copy.nodes.append(node)
+                tree.objects[node.operation] = node
+                tree.block_of[node.operation] = copy
+            copy.visible = block.visible
+            tree.block_index[copy] = len(tree.blocks)
+            tree.blocks.append(copy)
+        return tree
+
+    def writable(self, block):
+        """
+        Returns a block for writing, copying it first if it is shared with a snapshot.
+        """
+        if not block.shared:
+            return block
+        copy = ObjectBlock()
+        copy.nodes = list(block.nodes)
+        copy.visible = block.visible
+        index = self.block_index.pop(block)
+        self.blocks[index] = copy
+        self.block_index[copy] = index
+        block_of = self.writable_table()[1]
+        for obj in copy.nodes:
+            block_of[obj.operation] = copy
+        return copy
+
+    def writable_table(self):
+        """
+        Returns the (objects, block_of) tables for writing, copying the tables first if
+        they are shared with a snapshot.
+        """
+        if self.shared:
+            self.unshare()
+        return self.objects, self.block_of
+
+    def unshare(self):
+        """
+        Copies the tables which are shared with a snapshot. The sibling lists are
+        copied one at a time when they are written, see add_sibling().
+        """
+        self.before = dict(self.before)
+        self.after = dict(self.after)
+        self.objects = dict(self.objects)
+        self.block_of = dict(self.block_of)
+        self.shared = False
+        self.owned = set()
 
     def insert(self, target, object, before=True):
         """
@@ -17,82 +132,365 @@ class ObjectTree():
 
     def insert_root(self, object):
         """
-        Inserts a new root into the tree.
+        Inserts a new root into the tree. The root and its descendants are placed
+        before the first root which it sorts before.
         """
-        index = len(self.roots)
-        for i, root in enumerate(self.roots):
-            if object.operation < root.obj.operation:
-                index = i
-                break
-        if index == len(self.roots):
-            self.roots.append(ObjectRoot(object))
+        op = object.operation
+        index = first_index(self.roots, lambda root: op < root)
+        position = None
+        if index < len(self.roots):
+            position = self.locate(self.leftmost(self.roots[index]))
+        self.roots.insert(index, op)
+        if position is None:
+            self.place_end(object)
         else:
-            self.roots.insert(index, ObjectRoot(object))
-
-    def find_insert(self, target, object, iter):
-        """
-        Find the insertion point for the object.
-        """
-        for root, i, obj in iter:
-            op = obj.operation
-            if op == target:
-                # We found the target.
-                return root, i
-            elif op.target == target and object.operation < op:
-                # Same target, so order the operations
-                return root, i
-        return None, -1
+            self.place(position[0], position[1], object)
 
     def insert_node(self, target, object, before):
         """
-        Inserts a new object into the tree before.
+        Inserts a new object into the tree before or after the target.
         """
+        op = object.operation
         if before:
-            enumerate_nodes = self.enumerate()
+            # The object is placed before the first sibling which it sorts before,
+            # including the descendants of the sibling, or else right before the target
+            siblings = self.before.get(target, ())
+            k = first_index(siblings, lambda sibling: op < sibling)
+            anchor = self.leftmost(siblings[k]) if k < len(siblings) else target
+            position = self.locate(anchor)
+            if position is None:
+                self.place_end(object)
+                return
         else:
-            enumerate_nodes = self.enumerate_reverse()
-
-        root, i = self.find_insert(target, object, enumerate_nodes)
-        if before:
-            if root is None:
-                self.roots[-1].nodes.append(object)
-            else:
-                root.nodes.insert(i, object)
-        else:
-            if root is None:
-                self.roots[0].nodes.insert(0, object)
+            # The object is placed before the first sibling which sorts before it,
+            # including the descendants of the sibling, or else after the descendants
+            # of the target
+            siblings = self.after.get(target, ())
+            k = first_index(siblings, lambda sibling: sibling < op)
+            if k < len(siblings):
+                position = self.locate(self.leftmost(siblings[k]))
             else:
-                root.nodes.insert(i + 1, object)
+                position = self.locate(self.rightmost(target))
+                if position is not None:
+                    position = (position[0], position[1] + 1)
+            if position is None:
+                self.place(self.blocks[0] if self.blocks else None, 0, object)
+                return
+        self.place(position[0], position[1], object)
+        self.add_sibling(before, target, k, op)
+
+    def add_sibling(self, before, target, k, op):
+        """
+        Inserts an operation at index k of the operations inserted before or after the
+        target. Each list is copied at most once after the tables were shared with a
+        snapshot, and is then written in place.
+        """
+        if self.shared:
+            self.unshare()
+        table = self.before if before else self.after
+        key = (before, target)
+        siblings = table.get(target)
+        if siblings is None:
+            table[target] = [op]
+            self.owned.add(key)
+            return
+        if key not in self.owned:
+            siblings = table[target] = list(siblings)
+            self.owned.add(key)
+        siblings.insert(k, op)
+        # The chain through the target now leads to the new operation, so the known
+        # chain ends may be wrong. Ends which are only extended stay valid, since
+        # leftmost() and rightmost() continue from them.
+        if before and k == 0:
+            self.first.clear()
+        elif not before and k == len(siblings) - 1:
+            self.last.clear()
+
+    def place(self, block, i, object):
+        """
+        Places an object at index i of a block, splitting the block if it becomes too
+        large.
+        """
+        objects, block_of = self.writable_table()
+        if block is None:
+            block = ObjectBlock()
+            self.block_index[block] = len(self.blocks)
+            self.blocks.append(block)
+        block = self.writable(block)
+        block.nodes.insert(i, object)
+        if not object.tombstone:
+            block.visible += 1
+        objects[object.operation] = object
+        block_of[object.operation] = block
+        if len(block.nodes) > BLOCK_SIZE:
+            half = block.split()
+            index = self.block_index[block] + 1
+            self.blocks.insert(index, half)
+            for later in range(index, len(self.blocks)):
+                self.block_index[self.blocks[later]] = later
+            for obj in half.nodes:
+                block_of[obj.operation] = half
+
+    def place_end(self, object):
+        """
+        Places an object after all the objects in the tree.
+        """
+        block = self.blocks[-1] if self.blocks else None
+        self.place(block, len(block.nodes) if block is not None else 0, object)
+
+    def chain_end(self, op, table, index, ends):
+        """
+        Follows the operations at the index of the sibling lists in the table from an
+        operation until an operation without siblings, and returns it. The end of the
+        chain is remembered for every operation on it.
+        """
+        end = ends.get(op, op)
+        if end not in table:
+            return end
+        path = [op]
+        while end in table:
+            path.append(end)
+            end = table[end][index]
+        for visited in path:
+            ends[visited] = end
+        return end
+
+    def leftmost(self, op):
+        """
+        Returns the first operation in the subtree of an operation.
+        """
+        return self.chain_end(op, self.before, 0, self.first)
+
+    def rightmost(self, op):
+        """
+        Returns the last operation in the subtree of an operation.
+        """
+        return self.chain_end(op, self.after, -1, self.last)
+
+    def locate(self, op):
+        """
+        Returns the (block, index) of the object created by an operation, or None if it
+        is not in the tree.
+        """
+        block = self.block_of.get(op)
+        if block is None:
+            return None
+        # Objects are compared by identity, so the index is found without comparing
+        # the operations
+        return block, block.nodes.index(self.objects[op])
+
+    def position(self, op):
+        """
+        Returns the number of visible objects before the object created by an
+        operation, or None if it is not in the tree.
+        """
+        located = self.locate(op)
+        if located is None:
+            return None
+        block, i = located
+        position = 0
+        for other in self.blocks:
+            if other is block:
+                break
+            position += other.visible
+        return position + sum(not obj.tombstone for obj in block.nodes[:i])
+
+    def is_visible(self, op):
+        """
+        Returns True if the object created by an operation is in the tree and is not
+        deleted.
+        """
+        obj = self.objects.get(op)
+        return obj is not None and not obj.tombstone
 
-    def enumerate(self):
+    def visible_operations(self, position, count):
         """
-        Enumerates the objects in the tree by depth-first traversal and yields a list
-        of (root, node_index, object) tuples.
+        Returns the operations of up to count visible objects from the given position.
         """
-        for root in self.roots:
-            for i, obj in enumerate(root.nodes):
-                yield root, i, obj
+        ops = []
+        for block in self.blocks:
+            if position >= block.visible:
+                position -= block.visible
+                continue
+            for obj in block.nodes:
+                if obj.tombstone:
+                    continue
+                if position > 0:
+                    position -= 1
+                    continue
+                ops.append(obj.operation)
+                if len(ops) == count:
+                    return ops
+        return ops
 
-    def enumerate_reverse(self):
+    def tombstone(self, target):
         """
-        Enumerates the objects in the tree by depth-first traversal and yields a list
-        of (root, node_index, object) tuples.
+        Marks the object created by the target operation as deleted. Objects may be
+        shared with snapshots, so the object is replaced rather than modified. Returns
+        the replacement object, or None if the object was already deleted.
         """
-        for root in reversed(self.roots):
-            for i, obj in reversed(list(enumerate(root.nodes))):
-                yield root, i, obj
+        obj = self.objects.get(target)
+        if obj is None or obj.tombstone:
+            return None
+        block, i = self.locate(target)
+        removed = obj.__class__(obj.operation)
+        removed.tombstone = True
+        block = self.writable(block)
+        block.nodes[i] = removed
+        block.visible -= 1
+        self.writable_table()[0][target] = removed
+        return removed
+
+    def last_visible(self):
+        """
+        Returns the operation of the last object which is not deleted, or None if all
+        the objects are deleted.
+        """
+        for block in reversed(self.blocks):
+            if block.visible:
+                for obj in reversed(block.nodes):
+                    if not obj.tombstone:
+                        return obj.operation
+        return None
 
     def __iter__(self):
         """
         Iterates over the objects in the tree.
         """
-        for root in self.roots:
-            yield from root.nodes
+        for block in self.blocks:
+            yield from block.nodes
+
+    def layout(self):
+        """
+        Returns the roots of the tree as a list of (root_operation, operations) tuples,
+        with the operations under each root in order.
+        """
+        starts = {self.leftmost(root): root for root in self.roots}
+        layout = []
+        for obj in self:
+            op = obj.operation
+            root = starts.pop(op, None)
+            if not layout:
+                # Objects placed before the first root without a target in the tree
+                # (see insert_node()) are kept with the first root
+                layout.append((self.roots[0], []))
+            if root is not None and root is not layout[-1][0]:
+                layout.append((root, []))
+            layout[-1][1].append(op)
+        return layout
+
+    def load(self, layout, removed):
+        """
+        Fills an empty tree with the roots returned by layout(). The objects of the
+        operations in removed are marked as deleted.
+        """
+        # Imported here since the sequence module imports this module
+        from crdt.sequence import Object
+        objects = []
+        for root_op, ops in layout:
+            self.roots.append(root_op)
+            for op in ops:
+                obj = Object(op)
+                obj.tombstone = op in removed
+                objects.append(obj)
+        self.fill(objects)
+        self.before, self.after = sibling_tables(obj.operation for obj in objects)
+
+    def fill(self, objects):
+        """
+        Fills an empty tree with a list of objects in order. Blocks are filled halfway,
+        so that inserts do not split them right away.
+        """
+        size = BLOCK_SIZE // 2
+        for start in range(0, len(objects), size):
+            block = ObjectBlock()
+            block.nodes = objects[start:start + size]
+            block.visible = sum(not obj.tombstone for obj in block.nodes)
+            self.block_index[block] = len(self.blocks)
+            self.blocks.append(block)
+            for obj in block.nodes:
+                self.objects[obj.operation] = obj
+                self.block_of[obj.operation] = block
+
+    def __setstate__(self, state):
+        # Trees were pickled with their state before sequences were pickled as runs,
+        # as ObjectRoots which hold the objects under each root
+        self.__init__()
+        roots = state["roots"]
+        self.roots = [root.obj.operation for root in roots]
+        objects = [obj for root in roots for obj in root.nodes]
+        self.fill(objects)
+        self.before, self.after = sibling_tables(obj.operation for obj in objects)
+
+def first_index(items, predicate):
+    """
+    Returns the index of the first item for which predicate(item) is True by binary
+    search, where the predicate is False for all the items before it and True for all
+    the items after it.
+    """
+    low = 0
+    high = len(items)
+    while low < high:
+        middle = (low + high) // 2
+        if predicate(items[middle]):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+def sibling_tables(ops):
+    """
+    Builds the tables of operations inserted before and after each target from the
+    operations of a tree, in order.
+    """
+    # Imported here since the sequence module imports this module
+    from crdt.sequence import OperationType
+    before = {}
+    after = {}
+    for op in ops:
+        if op.target is not None:
+            table = before if op.action is OperationType.INSERT_BEFORE else after
+            siblings = table.get(op.target)
+            if siblings is None:
+                table[op.target] = [op]
+            else:
+                siblings.append(op)
+    return before, after
+
+def remap_siblings(table, remap):
+    """
+    Returns a copy of a sibling table with the operations returned by remap(op).
+    """
+    return {remap(target): [remap(op) for op in siblings] for target, siblings in table.items()}
+
+class ObjectBlock():
+    """
+    A run of consecutive objects in an ObjectTree, together with the number of them
+    which are not deleted.
+    """
+    def __init__(self):
+        self.nodes = []
+        self.visible = 0
+        # True if the block is also referenced by a snapshot
+        self.shared = False
+
+    def split(self):
+        """
+        Moves the second half of the block into a new block and returns it.
+        """
+        half = len(self.nodes) // 2
+        block = ObjectBlock()
+        block.nodes = self.nodes[half:]
+        del self.nodes[half:]
+        block.visible = sum(not obj.tombstone for obj in block.nodes)
+        self.visible -= block.visible
+        return block
 
 class ObjectRoot():
     """
-    A root in an ObjectTree
+    A root in an ObjectTree as it was pickled before the objects were kept in blocks,
+    which is only used to unpickle such trees.
     """
     def __init__(self, obj):
         self.obj = obj
-        self.nodes = [obj]
\ No newline at end of file
+        self.nodes = [obj]
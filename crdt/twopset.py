@@ -1,26 +1,38 @@
 from crdt.gset import GSet
+from crdt.intervals import IdSet
+from crdt.sequence import OpId
 
 class TwoPhaseSet:
     """
     TwoPhaseSet implements a two-phase set CRDT, which includes an added set and a
-    removed set.
+    removed set. Removed OpIds are stored as intervals (see IdSet), and the items which
+    are added but not removed are kept up to date as they change so that get() does
+    not compute the difference of the two sets. The frozenset returned by get() is
+    cached until the live items change.
     """
 
     def __init__(self):
         self.added = GSet()
-        self.removed = GSet()
+        self.removed = IdSet()
+        self.live = set()
+        self.view = None
 
     def add(self, item):
         """
         Adds an item to the set.
         """
         self.added.add(item)
+        if item not in self.removed:
+            self.live.add(item)
+            self.view = None
 
     def remove(self, item):
         """
         Removes an item from the set.
         """
         self.removed.add(item)
+        self.live.discard(item)
+        self.view = None
 
     def merge(self, other):
         """
@@ -28,12 +40,32 @@ class TwoPhaseSet:
         """
         if not isinstance(other, TwoPhaseSet):
             raise ValueError("Incompatible CRDT for merge(), expected TwoPhaseSet")
+        if other is self:
+            return self
+        added = self.added.get()
+        new = [item for item in other.added.get() if item not in added]
         self.added = self.added.merge(other.added)
         self.removed = self.removed.merge(other.removed)
+        removed = self.removed
+        live = self.live
+        self.view = None
+        live.update(item for item in new if item not in removed)
+        # Items removed by the other set may still be live here. They are looked up
+        # one by one unless the other set removed more items than are live here.
+        other_removed = other.removed
+        count = len(other_removed.items) + sum(len(ids) for ids in other_removed.ids.values())
+        if count <= len(live):
+            live.difference_update(other_removed.items)
+            for node, ids in other_removed.ids.items():
+                live.difference_update(OpId(node, id) for id in ids)
+        elif count:
+            live.difference_update([item for item in live if item in removed])
         return self
 
     def get(self):
         """
         Returns the current items in the set.
         """
-        return self.added.get().difference(self.removed.get())
\ No newline at end of file
+        if self.view is None:
+            self.view = frozenset(self.live)
+        return self.view
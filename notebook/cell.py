@@ -1,12 +1,89 @@
 import difflib
 
-from crdt.sequence import Sequence
+from crdt.sequence import Sequence, compose_delta
+from notebook.container import CONTAINER_VERSION, load_cell, pack_cell, unpack_cell
+from notebook.rope import Rope
+
+def apply_text_edits(text, edits):
+    """
+    Applies a list of (index, inserted_text, deleted_length) edits to a string.
+    """
+    for index, inserted, deleted in edits:
+        text = text[:index] + inserted + text[index + deleted:]
+    return text
+
+def text_edits(old, new):
+    """
+    Returns the list of (index, inserted_text, deleted_length) edits which transform the
+    old text into the new text. Each index is relative to the text after the previous
+    edits have been applied.
+    """
+    # Most edits are small, so trim the common prefix and suffix before diffing
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and old[-suffix - 1] == new[-suffix - 1]:
+        suffix += 1
+    old = old[prefix:len(old) - suffix]
+    new = new[prefix:len(new) - suffix]
+
+    edits = []
+    offset = prefix
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes():
+        if tag != "equal":
+            edits.append((i1 + offset, new[j1:j2], i2 - i1))
+            offset += (j2 - j1) - (i2 - i1)
+    return edits
+
+def edits_delta(edits):
+    """
+    Returns the delta (see SequenceEvent) of a list of (index, inserted_text,
+    deleted_length) edits with integer indexes, with the characters of the inserted
+    texts as the inserted items.
+    """
+    delta = []
+    for index, text, deleted in edits:
+        edit = [(action, value) for action, value in (("retain", index), ("delete", deleted), ("insert", list(text))) if value]
+        delta = compose_delta(delta, edit)
+    return delta
+
+def delta_edits(delta):
+    """
+    Returns the list of (index, inserted_text, deleted_length) edits which apply a
+    delta of characters to a text.
+    """
+    edits = []
+    index = 0
+    for action, value in delta:
+        if action == "retain":
+            index += value
+        elif action == "insert":
+            edits.append((index, "".join(value), 0))
+            index += len(value)
+        else:
+            edits.append((index, "", value))
+    return edits
 
 class Cell(Sequence):
     """
     Cell represents the contents of a cell in a DistributedNotebook.
+
+    The text of the cell is also kept in a Rope once it is first needed, so that lines,
+    substrings and "line.col" indexes can be found without joining the whole text. The
+    rope is updated with the deltas of local edits, and rebuilt on demand after merges.
+    Ropes are immutable, so snapshots of the cell share the rope of the cell.
+
+    Cells are pickled as a header with their digest and a separate blob of their state,
+    and unpickled as packed cells which decode the blob on first use, see
+    unpack_cell().
     """
 
+    # The rope with the text of the cell, or None if it has to be rebuilt
+    rope = None
+
     def append_text(self, text):
         """
         Appends the given text to the end of the cell.
@@ -26,24 +103,156 @@ class Cell(Sequence):
         decomposes the diff into a set of operations which are sequentially applied to
         the cell.
         """
-        changes = difflib.ndiff(self.get_text(), text)
-        offset = 0
-        for i, s in enumerate(changes):
-            char_index = i + offset
-            if s[0] == '-':
-                self.remove(char_index)
-                # difflib positions are relative to the original text, so account for
-                # the removed character
-                offset -= 1
-            elif s[0] == '+':
-                if char_index >= len(self.get()):
-                    self.append(s[-1])
+        self.apply_edits(text_edits(self.get_text(), text))
+
+    def edit(self, index, text="", deleted=0):
+        """
+        Deletes the given number of characters at the index and then inserts the text at
+        the index. The index is either a character offset or a tkinter-style "line.col"
+        index. Unlike update(), the cell does not have to be diffed to find the edit.
+        """
+        index = self.offset(index)
+        self.remove_many(index, deleted)
+        if not text:
+            return
+        if index >= self.get_length():
+            self.append_text(text)
+        else:
+            self.insert_text(index, text)
+
+    def apply_edits(self, edits):
+        """
+        Applies a list of (index, inserted_text, deleted_length) edits to the cell, such
+        as the edits returned by text_edits(). Each index is relative to the text after
+        the previous edits have been applied. The edits are applied in a transaction,
+        so observers are notified of all the edits at once.
+        """
+        with self.transaction():
+            for index, text, deleted in edits:
+                self.edit(index, text, deleted)
+
+    def offset(self, index):
+        """
+        Converts a tkinter-style "line.col" index into a character offset, where lines
+        start at 1 and columns start at 0. Integer offsets are returned unchanged.
+        """
+        if isinstance(index, int):
+            return index
+
+        line, col = (int(part) for part in index.split("."))
+        rope = self.get_rope()
+        if line > rope.line_count():
+            raise IndexError("Line {} out of range of cell with {} lines".format(line, rope.line_count()))
+        return rope.offset(line, col)
+
+    def index(self, offset):
+        """
+        Converts a character offset into a tkinter-style "line.col" index.
+        """
+        line, col = self.get_rope().position(offset)
+        return "{}.{}".format(line, col)
+
+    def get_rope(self):
+        """
+        Returns the text in the cell as a Rope.
+        """
+        if self.rope is None:
+            self.rope = Rope(self.get_text())
+        return self.rope
+
+    def get_line_count(self):
+        """
+        Returns the number of lines in the cell.
+        """
+        return self.get_rope().line_count()
+
+    def get_line(self, line):
+        """
+        Returns the text of a line in the cell, without its newline.
+        """
+        return self.get_rope().get_line(line)
+
+    def get_substring(self, start, end):
+        """
+        Returns the text in the cell from start (inclusive) to end (exclusive).
+        """
+        return self.get_rope().substring(start, end)
+
+    def emit(self, delta, local=True):
+        """
+        Applies the delta of a local edit to the rope before notifying the callbacks.
+        """
+        if local and self.rope is not None:
+            rope = self.rope
+            position = 0
+            for action, value in delta:
+                if action == "retain":
+                    position += value
+                elif action == "insert":
+                    text = "".join(value)
+                    rope = rope.insert(position, text)
+                    position += len(text)
                 else:
-                    self.insert(char_index, s[-1])
+                    rope = rope.delete(position, value)
+            self.rope = rope
+        super().emit(delta, local)
+
+    def merge_operations(self, other):
+        count = len(self.operations.get())
+        super().merge_operations(other)
+        if len(self.operations.get()) != count:
+            # Rebuilding the rope once is cheaper than computing the delta of the merge
+            self.rope = None
+
+    def assign(self, other):
+        super().assign(other)
+        self.rope = None
+
+    def observe_nested(self, observe):
+        # Cells do not contain nested sequences, so packed cells are not decoded to
+        # observe their items
+        pass
+
+    def needs_merge(self, other):
+        # Cells do not contain nested sequences, so a cell with the same digest has the
+        # same operations, and a packed cell is not decoded just to be merged
+        return other.get_digest() != self.get_digest()
+
+    def copy(self, frozen=False, exclude=None):
+        if "packed" in self.__dict__:
+            # A packed cell has not been modified, so the copy can share its blob
+            copy = unpack_cell(CONTAINER_VERSION, self.id, self.digest, self.__dict__["packed"])
+            copy.frozen = frozen
+            return copy
+        return super().copy(frozen=frozen, exclude=exclude)
+
+    def __getattr__(self, name):
+        # Only called for attributes which are not set, which are the attributes of a
+        # packed cell before it is decoded
+        if "packed" in self.__dict__:
+            load_cell(self)
+            return getattr(self, name)
+        if name in self.__dict__:
+            # Decoded by another thread
+            return self.__dict__[name]
+        raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, name))
+
+    def __reduce_ex__(self, protocol):
+        if self.stub:
+            return super().__reduce_ex__(protocol)
+        return unpack_cell, (CONTAINER_VERSION, self.id, self.get_digest(), pack_cell(self))
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("rope", None)
+        return state
 
     def get_text(self):
         """
         Returns the text in the cell.
         """
+        # Columnar storage can decode the text without iterating over the objects
+        if hasattr(self.sequence, "get_text"):
+            return self.sequence.get_text()
         return ''.join(self.get())
             
@@ -0,0 +1,58 @@
+import pickle
+import threading
+
+# The version of the format of packed cells, which is stored in the header of each cell
+CONTAINER_VERSION = 1
+
+# Serializes unpacking, so that a cell is only unpacked once by concurrent readers
+UNPACK_LOCK = threading.RLock()
+
+def pack_cell(cell):
+    """
+    Returns the blob of a cell, which is the pickled state of the cell. A packed cell
+    which has not been used returns its blob without unpacking it.
+    """
+    blob = cell.__dict__.get("packed")
+    if blob is None:
+        return pickle.dumps(cell.__getstate__(), pickle.HIGHEST_PROTOCOL)
+    # The blob of an evicted cell is read from its file, see CellResidency
+    return bytes(blob)
+
+def unpack_cell(version, id, digest, blob):
+    """
+    Returns a packed cell for the header (version, id, digest) and blob of a cell,
+    which is how cells are pickled (see Cell.__reduce_ex__()).
+
+    Unpickling a notebook therefore only copies the blob of each cell. The blob is
+    decoded when the cell is first used, so merging a remote notebook decodes only
+    the cells whose digests differ from the local cells, and the other cells are
+    never decoded.
+    """
+    # Imported here since the cell module imports this module
+    from notebook.cell import Cell
+    if version != CONTAINER_VERSION:
+        raise ValueError("Unsupported cell container version {}".format(version))
+    cell = Cell.__new__(Cell)
+    cell.__dict__.update(id=id, digest=digest, listeners=[], packed=blob)
+    return cell
+
+def load_cell(cell):
+    """
+    Decodes the blob of a packed cell into the cell. Attributes which were set on the
+    packed cell, such as its ID or listeners, are kept. If the cell was evicted by a
+    CellResidency, the residency is notified that the cell is decoded again.
+    """
+    with UNPACK_LOCK:
+        blob = cell.__dict__.get("packed")
+        if blob is None:
+            return
+        decoded = cell.__class__.__new__(cell.__class__)
+        decoded.__setstate__(pickle.loads(bytes(blob)))
+        if decoded.digest != cell.__dict__["digest"]:
+            raise ValueError("Cell digest does not match its header")
+        for name, value in decoded.__dict__.items():
+            cell.__dict__.setdefault(name, value)
+        del cell.__dict__["packed"]
+        residency = cell.__dict__.pop("residency", None)
+    if residency is not None:
+        residency.faulted(cell, blob)
@@ -1,6 +1,8 @@
+import hashlib
 import uuid
 
-from crdt.sequence import Sequence
+from crdt.sequence import PARALLEL_MERGE_THRESHOLD, Sequence
+from crdt.tree import ObjectTree
 from notebook.cell import Cell
 
 class DistributedNotebook(Sequence):
@@ -9,22 +11,71 @@ class DistributedNotebook(Sequence):
     consists of CRDT data structures which enable consistent merges between replicas.
     """
 
-    def create_cell(self, index=None):
+    # Optional CellResidency which keeps the decoded cells within a memory budget
+    residency = None
+
+    # The storage engine of the cells created by this replica. Cells keep the storage
+    # engine of the replica which created them when they are merged.
+    cell_storage = ObjectTree
+
+    def __init__(self, id=uuid.uuid4(), storage=ObjectTree, cell_storage=ObjectTree):
+        super().__init__(id=id, storage=storage)
+        self.cell_storage = cell_storage
+
+    def set_residency(self, residency):
+        """
+        Sets the CellResidency which evicts the least recently used cells of the
+        notebook when they exceed its memory budget.
+        """
+        self.residency = residency
+        for cell in self.get():
+            residency.admit(cell)
+        residency.enforce()
+
+    def get_cell(self, index):
+        """
+        Returns the cell at the given index, marking it as used.
         """
-        Creates a new cell at the given index. If the index is not specified, the cell
-        is appended to the end of the notebook.
+        cell = self.operation_at_position(index).payload
+        if self.residency is not None:
+            self.residency.touch(cell)
+        return cell
+
+    def create_cell(self, index=None, text=""):
         """
-        cell = Cell(id=self.id)
+        Creates a new cell with the given text at the given index. If the index is not
+        specified, the cell is appended to the end of the notebook.
+        """
+        cell = Cell(id=self.id, storage=self.cell_storage)
+        # The text is added before the cell is inserted, so that observers are only
+        # notified of the new cell
+        cell.append_text(text)
         if index is None:
             self.append(cell)
         else:
             self.insert(index, cell)
+        if self.residency is not None:
+            self.residency.touch(cell)
 
     def update_cell(self, index, text):
         """
         Updates the text in a cell with new text.
         """
-        self.get()[index].update(text)
+        cell = self.get_cell(index)
+        cell.update(text)
+        self.revision += 1
+        if self.residency is not None:
+            self.residency.touch(cell)
+
+    def edit_cell(self, index, edits):
+        """
+        Applies a list of (index, inserted_text, deleted_length) edits to a cell.
+        """
+        cell = self.get_cell(index)
+        cell.apply_edits(edits)
+        self.revision += 1
+        if self.residency is not None:
+            self.residency.touch(cell)
 
     def remove_cell(self, index):
         """
@@ -32,8 +83,55 @@ class DistributedNotebook(Sequence):
         """
         self.remove(index)
 
+    def merge(self, other, executor=None, threshold=PARALLEL_MERGE_THRESHOLD):
+        super().merge(other, executor=executor, threshold=threshold)
+        if self.residency is not None:
+            # The merge may have added cells
+            for cell in self.get():
+                self.residency.admit(cell)
+            self.residency.enforce()
+        return self
+
+    def nested_merged(self, cell):
+        if self.residency is not None:
+            # Cells are evicted as they are merged, so that a merge which changes many
+            # cells does not decode all of them at once
+            self.residency.admit(cell)
+            self.residency.enforce()
+
+    def copy(self, frozen=False, exclude=None):
+        copy = super().copy(frozen=frozen, exclude=exclude)
+        # Copies do not share the residency, which tracks the cells of this notebook
+        copy.__dict__.pop("residency", None)
+        return copy
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("residency", None)
+        return state
+
+    def get_digest(self):
+        """
+        Returns a digest of the notebook, which combines the digest of the notebook's
+        own operations with the digests of the visible cells. Each cell digest is
+        hashed with the key of the cell, so that identical cells at different
+        positions do not cancel out.
+        """
+        digest = self.digest
+        for (node, id), cell_digest in self.nested_digests().items():
+            key = "{}\x00{}\x00{}".format(node, id, cell_digest).encode()
+            digest ^= int.from_bytes(hashlib.blake2b(key, digest_size=16).digest(), "big")
+        return digest
+
     def get_cell_data(self):
         """
         Returns all the cell data in the notebook.
         """
-        return [cell.get_text() for cell in self.get()]
\ No newline at end of file
+        if self.residency is None:
+            return [cell.get_text() for cell in self.get()]
+        # Evicted cells are decoded one at a time
+        data = []
+        for cell in self.get():
+            data.append(cell.get_text())
+            self.residency.enforce()
+        return data
\ No newline at end of file
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+
+from notebook.container import pack_cell
+
+# Estimated number of bytes used by each operation of a decoded cell, including its
+# object in the storage engine
+OPERATION_SIZE = 400
+
+def remove_file(path):
+    """
+    Removes a file if it still exists.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def estimate_size(cell):
+    """
+    Returns the estimated number of bytes used by a decoded cell.
+    """
+    return len(cell.operations.get()) * OPERATION_SIZE
+
+class SpilledBlob():
+    """
+    The blob of an evicted cell, which is stored in a file until the cell is decoded.
+    Snapshots of the evicted cell share the blob, so the file is removed once the blob
+    is no longer referenced.
+    """
+
+    def __init__(self, residency, blob):
+        # Keeps the directory of the residency alive while the file is needed
+        self.residency = residency
+        fd, self.path = tempfile.mkstemp(dir=residency.directory, suffix=".cell")
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        weakref.finalize(self, remove_file, self.path)
+
+    def __bytes__(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+class CellResidency():
+    """
+    CellResidency keeps the decoded cells of a DistributedNotebook within a memory
+    budget (in bytes). When the estimated size of the decoded cells exceeds the budget,
+    the least recently used cells are evicted: they are packed (see unpack_cell()) and
+    their blobs are written to files in the directory. An evicted cell is decoded
+    again transparently when it is next used, e.g. by an edit or a merge.
+
+    The residency is used by a single notebook, and must be used while holding the
+    lock of the notebook, since evicting a cell modifies it.
+    """
+
+    def __init__(self, budget, directory=None):
+        self.budget = budget
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="eirene-cells-")
+            weakref.finalize(self, shutil.rmtree, directory, True)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        # The estimated sizes of the decoded cells, from the least to the most
+        # recently used. Cells are hashed by identity.
+        self.resident = OrderedDict()
+        # The total of the sizes in resident, so that the budget is checked without
+        # estimating the size of every cell again
+        self.size = 0
+        # The (digest, blob) of the decoded cells which were evicted before, so that a
+        # cell which was not modified since it was decoded is not written again
+        self.spilled = {}
+        self.evictions = 0
+        self.faults = 0
+        # Cells are admitted when they are decoded, which may happen on another thread
+        self.lock = threading.Lock()
+
+    def track(self, cell):
+        """
+        Estimates the size of a decoded cell again and marks it as the most recently
+        used cell. Must be called while holding the lock.
+        """
+        size = estimate_size(cell)
+        self.size += size - self.resident.get(cell, 0)
+        self.resident[cell] = size
+        self.resident.move_to_end(cell)
+
+    def touch(self, cell):
+        """
+        Marks a cell as the most recently used cell, and evicts the least recently used
+        cells if the budget is exceeded. The size of the cell is estimated again, so
+        the cell should be touched after it is modified.
+        """
+        with self.lock:
+            if "packed" not in cell.__dict__:
+                self.track(cell)
+        self.enforce()
+
+    def admit(self, cell):
+        """
+        Starts tracking a decoded cell, or estimates the size of a tracked cell again
+        after it was merged. Packed cells are tracked once they are decoded.
+        """
+        with self.lock:
+            if "packed" in cell.__dict__:
+                cell.__dict__["residency"] = self
+            else:
+                self.track(cell)
+
+    def faulted(self, cell, blob):
+        """
+        Called when an evicted cell is decoded again from its blob.
+        """
+        with self.lock:
+            self.faults += 1
+            self.spilled[cell] = (cell.digest, blob)
+            self.track(cell)
+
+    def get_size(self):
+        """
+        Returns the estimated number of bytes used by the decoded cells.
+        """
+        return self.size
+
+    def enforce(self):
+        """
+        Evicts the least recently used cells until the decoded cells fit in the budget.
+        The most recently used cell is never evicted.
+        """
+        evicted = []
+        with self.lock:
+            while self.size > self.budget and len(self.resident) > 1:
+                cell, size = self.resident.popitem(last=False)
+                self.size -= size
+                evicted.append(cell)
+        for cell in evicted:
+            self.evict(cell)
+
+    def evict(self, cell):
+        """
+        Writes the blob of a cell to a file and releases its decoded state. The ID,
+        digest and listeners of the cell are kept. The file of a cell which was not
+        modified since it was last evicted is reused.
+        """
+        digest, blob = self.spilled.pop(cell, (None, None))
+        if digest != cell.digest:
+            blob = pack_cell(cell)
+        if not isinstance(blob, SpilledBlob):
+            # Cells which were unpickled are decoded from a blob in memory
+            blob = SpilledBlob(self, blob)
+        header = {name: cell.__dict__[name] for name in ("id", "digest", "listeners")}
+        cell.__dict__.clear()
+        cell.__dict__.update(header, packed=blob, residency=self)
+        self.evictions += 1
@@ -0,0 +1,262 @@
+# Maximum number of characters in a leaf of a rope
+CHUNK_SIZE = 256
+
+class Leaf():
+    """
+    A leaf of a Rope, which holds a chunk of the text.
+    """
+
+    __slots__ = ("text", "length", "newlines")
+
+    height = 0
+
+    def __init__(self, text):
+        self.text = text
+        self.length = len(text)
+        self.newlines = text.count("\n")
+
+class Branch():
+    """
+    An inner node of a Rope, which concatenates the text of its children and caches
+    the length, number of newlines and height of its subtree.
+    """
+
+    __slots__ = ("left", "right", "length", "newlines", "height")
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = left.length + right.length
+        self.newlines = left.newlines + right.newlines
+        self.height = max(left.height, right.height) + 1
+
+class Rope():
+    """
+    A Rope is an immutable string which is stored as a balanced tree of chunks, so that
+    it can be edited and indexed by offset or by line in O(log n) time without building
+    the whole string. Edits return a new Rope which shares the unchanged chunks with the
+    original.
+
+    Lines are numbered from 1 and columns from 0, like tkinter "line.col" indexes.
+    """
+
+    __slots__ = ("root",)
+
+    def __init__(self, text=""):
+        self.root = build(text)
+
+    @classmethod
+    def from_node(cls, root):
+        rope = cls.__new__(cls)
+        rope.root = root
+        return rope
+
+    def __len__(self):
+        return self.root.length if self.root is not None else 0
+
+    def __str__(self):
+        return self.substring(0, len(self))
+
+    def __eq__(self, other):
+        if isinstance(other, Rope):
+            other = str(other)
+        return str(self) == other
+
+    def insert(self, offset, text):
+        """
+        Returns a rope with the text inserted at the offset.
+        """
+        if not 0 <= offset <= len(self):
+            raise IndexError("Offset {} out of range of rope with length {}".format(offset, len(self)))
+        if not text:
+            return self
+        left, right = split(self.root, offset)
+        return Rope.from_node(join(join(left, build(text)), right))
+
+    def delete(self, offset, length):
+        """
+        Returns a rope with the given number of characters deleted at the offset.
+        """
+        if offset < 0 or length < 0 or offset + length > len(self):
+            raise IndexError("Range {}:{} out of range of rope with length {}".format(offset, offset + length, len(self)))
+        if length == 0:
+            return self
+        left, rest = split(self.root, offset)
+        removed, right = split(rest, length)
+        return Rope.from_node(join(left, right))
+
+    def substring(self, start, end):
+        """
+        Returns the text from start (inclusive) to end (exclusive).
+        """
+        start = max(start, 0)
+        end = min(end, len(self))
+        chunks = []
+        if start < end:
+            collect(self.root, start, end, chunks)
+        return "".join(chunks)
+
+    def line_count(self):
+        """
+        Returns the number of lines, which is one more than the number of newlines.
+        """
+        return (self.root.newlines if self.root is not None else 0) + 1
+
+    def line_start(self, line):
+        """
+        Returns the offset at which a line starts.
+        """
+        if line < 1 or line > self.line_count():
+            raise IndexError("Line {} out of range of rope with {} lines".format(line, self.line_count()))
+        if line == 1:
+            return 0
+        return find_newline(self.root, line - 1) + 1
+
+    def line_end(self, line):
+        """
+        Returns the offset of the end of a line, excluding its newline.
+        """
+        if line < self.line_count():
+            return self.line_start(line + 1) - 1
+        if line == self.line_count():
+            return len(self)
+        raise IndexError("Line {} out of range of rope with {} lines".format(line, self.line_count()))
+
+    def get_line(self, line):
+        """
+        Returns the text of a line, excluding its newline.
+        """
+        return self.substring(self.line_start(line), self.line_end(line))
+
+    def offset(self, line, column):
+        """
+        Converts a line and column into an offset. Columns past the end of the line are
+        clamped to the end of the line.
+        """
+        return min(self.line_start(line) + column, self.line_end(line))
+
+    def position(self, offset):
+        """
+        Converts an offset into a (line, column) tuple.
+        """
+        if not 0 <= offset <= len(self):
+            raise IndexError("Offset {} out of range of rope with length {}".format(offset, len(self)))
+        line = count_newlines(self.root, offset) + 1
+        return line, offset - self.line_start(line)
+
+def build(text):
+    """
+    Returns a balanced tree of leaves with the text, or None if the text is empty.
+    """
+    leaves = [Leaf(text[i:i + CHUNK_SIZE]) for i in range(0, len(text), CHUNK_SIZE)]
+    if not leaves:
+        return None
+    while len(leaves) > 1:
+        paired = [Branch(leaves[i], leaves[i + 1]) for i in range(0, len(leaves) - 1, 2)]
+        if len(leaves) % 2:
+            paired[-1] = Branch(paired[-1], leaves[-1])
+        leaves = paired
+    return leaves[0]
+
+def join(left, right):
+    """
+    Returns a balanced tree which concatenates two trees (AVL join). Adjacent leaves
+    are combined while they fit in a chunk, so that appending one character at a time
+    does not create a leaf per character.
+    """
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.height > right.height + 1:
+        return rebalance(left.left, join(left.right, right))
+    if right.height > left.height + 1:
+        return rebalance(join(left, right.left), right.right)
+    if isinstance(left, Leaf) and isinstance(right, Leaf) and left.length + right.length <= CHUNK_SIZE:
+        return Leaf(left.text + right.text)
+    if isinstance(right, Leaf) and isinstance(left, Branch) and isinstance(left.right, Leaf) and left.right.length + right.length <= CHUNK_SIZE:
+        return rebalance(left.left, Leaf(left.right.text + right.text))
+    if isinstance(left, Leaf) and isinstance(right, Branch) and isinstance(right.left, Leaf) and left.length + right.left.length <= CHUNK_SIZE:
+        return rebalance(Leaf(left.text + right.left.text), right.right)
+    return Branch(left, right)
+
+def rebalance(left, right):
+    """
+    Returns a balanced tree which concatenates two balanced trees whose heights differ
+    by at most two, using a single or double rotation.
+    """
+    if left.height > right.height + 1:
+        if left.left.height >= left.right.height:
+            return Branch(left.left, Branch(left.right, right))
+        return Branch(Branch(left.left, left.right.left), Branch(left.right.right, right))
+    if right.height > left.height + 1:
+        if right.right.height >= right.left.height:
+            return Branch(Branch(left, right.left), right.right)
+        return Branch(Branch(left, right.left.left), Branch(right.left.right, right.right))
+    return Branch(left, right)
+
+def split(node, offset):
+    """
+    Splits a tree at an offset into two balanced trees.
+    """
+    if node is None:
+        return None, None
+    if offset <= 0:
+        return None, node
+    if offset >= node.length:
+        return node, None
+    if isinstance(node, Leaf):
+        return Leaf(node.text[:offset]), Leaf(node.text[offset:])
+    if offset < node.left.length:
+        left, right = split(node.left, offset)
+        return left, join(right, node.right)
+    if offset > node.left.length:
+        left, right = split(node.right, offset - node.left.length)
+        return join(node.left, left), right
+    return node.left, node.right
+
+def collect(node, start, end, chunks):
+    """
+    Appends the chunks of text of a tree from start to end to a list.
+    """
+    if isinstance(node, Leaf):
+        chunks.append(node.text[start:end])
+        return
+    middle = node.left.length
+    if start < middle:
+        collect(node.left, start, min(end, middle), chunks)
+    if end > middle:
+        collect(node.right, max(start - middle, 0), end - middle, chunks)
+
+def find_newline(node, n):
+    """
+    Returns the offset of the n-th newline (counting from 1) in a tree.
+    """
+    offset = 0
+    while isinstance(node, Branch):
+        if n <= node.left.newlines:
+            node = node.left
+        else:
+            n -= node.left.newlines
+            offset += node.left.length
+            node = node.right
+    i = -1
+    for _ in range(n):
+        i = node.text.index("\n", i + 1)
+    return offset + i
+
+def count_newlines(node, offset):
+    """
+    Returns the number of newlines before an offset in a tree.
+    """
+    count = 0
+    while isinstance(node, Branch):
+        if offset <= node.left.length:
+            node = node.left
+        else:
+            count += node.left.newlines
+            offset -= node.left.length
+            node = node.right
+    if node is None:
+        return count
+    return count + node.text.count("\n", 0, offset)
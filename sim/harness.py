@@ -0,0 +1,339 @@
+import argparse
+import os
+import pickle
+import random
+import tempfile
+import time
+import tracemalloc
+
+from client.client import NotebookClient
+
+SEED = 42
+
+# Characters inserted by the simulated edits
+CHARSET = "abcdefghijklmnopqrstuvwxyz \n"
+
+def full_mesh(n, rng):
+    """
+    Every replica syncs with every other replica.
+    """
+    return [[j for j in range(n) if j != i] for i in range(n)]
+
+def ring(n, rng):
+    """
+    Every replica syncs with its two neighbors in a ring.
+    """
+    if n <= 2:
+        return full_mesh(n, rng)
+    return [sorted({(i - 1) % n, (i + 1) % n}) for i in range(n)]
+
+def star(n, rng):
+    """
+    Replica 0 is a hub which syncs with every other replica.
+    """
+    return [list(range(1, n))] + [[0] for i in range(1, n)]
+
+def random_graph(n, rng, degree=3):
+    """
+    Every replica syncs with a few random replicas, and with the next replica so that
+    the graph is connected.
+    """
+    neighbors = [set() for i in range(n)]
+    for i in range(n):
+        links = [(i + 1) % n] + rng.sample(range(n), min(degree, n))
+        for j in links:
+            if j != i:
+                neighbors[i].add(j)
+                neighbors[j].add(i)
+    return [sorted(links) for links in neighbors]
+
+TOPOLOGIES = {
+    "mesh": full_mesh,
+    "ring": ring,
+    "star": star,
+    "random": random_graph,
+}
+
+class Partition():
+    """
+    A network partition between the start (inclusive) and end (exclusive) steps of a
+    simulation, during which replicas in different groups cannot sync. Replicas which
+    are not in any group form a group of their own.
+    """
+    def __init__(self, start, end, groups):
+        self.start = start
+        self.end = end
+        self.groups = {}
+        for g, group in enumerate(groups):
+            for i in group:
+                self.groups[i] = g
+
+    def separates(self, step, a, b):
+        """
+        Returns True if replicas a and b cannot sync at the given step.
+        """
+        if step < self.start or step >= self.end:
+            return False
+        return self.groups.get(a, -1) != self.groups.get(b, -1)
+
+class SimulatedClient(NotebookClient):
+    """
+    A NotebookClient which records the traffic and merges of a Simulation. With the
+    "memory" transport, messages are passed to the handler of the peer client directly
+    instead of over a socket.
+    """
+    def __init__(self, simulation, index):
+        super().__init__(0, [], name="replica{}".format(index), workers=2, registry=simulation.registry)
+        self.simulation = simulation
+        self.index = index
+
+    def exchange(self, peer, data, timeout=None):
+        simulation = self.simulation
+        other = simulation.clients[int(peer[len("replica"):])]
+        if simulation.partitioned(self.index, other.index):
+            raise ConnectionRefusedError("Replicas {} and {} are partitioned".format(self.index, other.index))
+        if simulation.transport == "memory":
+            reply = pickle.dumps(other.handle_message(pickle.loads(data)))
+        else:
+            reply = super().exchange(peer, data, timeout)
+        simulation.bytes_sent += len(data) + len(reply)
+        simulation.messages += 2
+        return reply
+
+    def merge(self, notebook_id, remote):
+        start = time.perf_counter()
+        changed = super().merge(notebook_id, remote)
+        self.simulation.merge_latencies.append(time.perf_counter() - start)
+        return changed
+
+class SimulationReport():
+    """
+    The results of a Simulation.
+    """
+    def __init__(self):
+        self.converged = False
+        # Sync rounds and seconds from the last edit until the replicas converged
+        self.convergence_rounds = None
+        self.convergence_time = None
+        self.edits = 0
+        self.syncs = 0
+        self.failed_syncs = 0
+        self.messages = 0
+        self.bytes_sent = 0
+        # Merge latency percentiles in seconds, by percentile
+        self.merge_latency = {}
+        self.memory_per_replica = None
+
+    def __str__(self):
+        lines = [
+            "converged: {}".format(self.converged),
+            "convergence: {} rounds, {:.3f}s".format(self.convergence_rounds, self.convergence_time or 0),
+            "edits: {}, syncs: {} ({} failed)".format(self.edits, self.syncs, self.failed_syncs),
+            "transferred: {} bytes in {} messages".format(self.bytes_sent, self.messages),
+            "merge latency: {}".format(", ".join("p{} {:.2f}ms".format(p, latency * 1000) for p, latency in self.merge_latency.items())),
+            "memory per replica: {} bytes".format(self.memory_per_replica),
+        ]
+        return "\n".join(lines)
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile of a list of values, using the nearest rank.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = max(int(round(p / 100 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+class Simulation():
+    """
+    Simulation runs a number of notebook replicas which edit a shared notebook and sync
+    with each other, in order to measure how the replicas converge.
+
+    The simulation proceeds in steps. In every step, each replica makes an edit with
+    probability edit_rate and then syncs with a random neighbor in the topology with
+    probability sync_rate, unless a partition separates them. After the given number
+    of steps the replicas stop editing and keep syncing until they converge or
+    max_rounds further rounds have passed.
+
+    The replicas are NotebookClients, which either exchange messages in memory
+    (transport="memory"), over loopback sockets (transport="loopback") or in shared
+    memory (transport="shared", see SharedChannel).
+    """
+
+    def __init__(self, replicas=4, steps=50, edit_rate=0.5, sync_rate=0.3, topology="mesh", partitions=(),
+                 transport="memory", max_rounds=100, seed=SEED):
+        if topology not in TOPOLOGIES:
+            raise ValueError("Unknown topology: {}".format(topology))
+        if transport not in ("memory", "loopback", "shared"):
+            raise ValueError("Unknown transport: {}".format(transport))
+        self.steps = steps
+        self.edit_rate = edit_rate
+        self.sync_rate = sync_rate
+        self.partitions = list(partitions)
+        self.transport = transport
+        self.max_rounds = max_rounds
+        self.random = random.Random(seed)
+        self.step = 0
+        self.bytes_sent = 0
+        self.messages = 0
+        self.merge_latencies = []
+        # Replicas using the shared transport find each other through a registry which
+        # is private to the simulation
+        self.registry = None
+        if transport == "shared":
+            # Imported here since the shared transport is only available on POSIX systems
+            from client.local import LocalRegistry
+            self.directory = tempfile.TemporaryDirectory()
+            self.registry = LocalRegistry(os.path.join(self.directory.name, "replicas.json"))
+
+        self.clients = [SimulatedClient(self, i) for i in range(replicas)]
+        self.neighbors = TOPOLOGIES[topology](replicas, self.random)
+        for client in self.clients:
+            if transport != "memory":
+                client.host()
+        for client, neighbors in zip(self.clients, self.neighbors):
+            client.peers = {self.clients[j].name: (self.clients[j].hostname, self.clients[j].port) for j in neighbors}
+
+    def partitioned(self, a, b):
+        """
+        Returns True if replicas a and b cannot sync in the current step.
+        """
+        return any(partition.separates(self.step, a, b) for partition in self.partitions)
+
+    def edit(self, client):
+        """
+        Makes a random edit to the notebook of a client.
+        """
+        rng = self.random
+        cells = client.get_cell_data()
+        action = rng.random()
+        if not cells or action < 0.05:
+            client.create_cell(rng.randint(0, len(cells) - 1) if cells else None)
+        elif action < 0.08 and len(cells) > 1:
+            client.remove_cell(rng.randrange(len(cells)))
+        else:
+            index = rng.randrange(len(cells))
+            text = cells[index]
+            if text and action < 0.3:
+                offset = rng.randrange(len(text))
+                client.edit_cell(index, [(offset, "", min(rng.randint(1, 5), len(text) - offset))])
+            else:
+                offset = rng.randint(0, len(text))
+                inserted = "".join(rng.choice(CHARSET) for _ in range(rng.randint(1, 10)))
+                client.edit_cell(index, [(offset, inserted, 0)])
+
+    def sync(self, client, report):
+        """
+        Syncs a client with a random neighbor.
+        """
+        peers = client.get_peers()
+        if not peers:
+            return
+        report.syncs += 1
+        try:
+            client.sync(self.random.choice(peers))
+        except (OSError, EOFError):
+            report.failed_syncs += 1
+
+    def converged(self):
+        """
+        Returns True if all the replicas have the same notebook, i.e. the same
+        operations and the same cells.
+        """
+        digests = set(client.notebook.get_digest() for client in self.clients)
+        if len(digests) > 1:
+            return False
+        cells = [client.get_cell_data() for client in self.clients]
+        return cells.count(cells[0]) == len(cells)
+
+    def run(self):
+        """
+        Runs the simulation and returns a SimulationReport. The replicas are closed
+        once the simulation is done.
+        """
+        try:
+            return self.simulate()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stops the listeners of the replicas and removes the registry.
+        """
+        for client in self.clients:
+            client.close()
+        if self.registry is not None:
+            self.directory.cleanup()
+
+    def simulate(self):
+        report = SimulationReport()
+        for self.step in range(self.steps):
+            for client in self.clients:
+                if self.random.random() < self.edit_rate:
+                    self.edit(client)
+                    report.edits += 1
+            for client in self.clients:
+                if self.random.random() < self.sync_rate:
+                    self.sync(client, report)
+
+        # Keep syncing without edits until the replicas converge
+        start = time.perf_counter()
+        rounds = 0
+        while not self.converged() and rounds < self.max_rounds:
+            self.step += 1
+            rounds += 1
+            for client in self.clients:
+                self.sync(client, report)
+        report.converged = self.converged()
+        if report.converged:
+            report.convergence_rounds = rounds
+            report.convergence_time = time.perf_counter() - start
+
+        report.messages = self.messages
+        report.bytes_sent = self.bytes_sent
+        report.merge_latency = {p: percentile(self.merge_latencies, p) for p in (50, 90, 99)}
+        report.memory_per_replica = measure_replica(self.clients[0].notebook)
+        return report
+
+def measure_replica(notebook):
+    """
+    Returns the number of bytes allocated by a copy of a notebook replica.
+    """
+    data = pickle.dumps(notebook)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    replica = pickle.loads(data)
+    # Cells are decoded on first use, see unpack_cell()
+    replica.get_cell_data()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del replica
+    return after - before
+
+def parse_partition(value):
+    """
+    Parses a partition from a "START:END:GROUP/GROUP" string, where groups are comma
+    separated replica indexes, e.g. "10:30:0,1/2,3".
+    """
+    start, end, groups = value.split(":")
+    return Partition(int(start), int(end), [[int(i) for i in group.split(",")] for group in groups.split("/")])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulate notebook replicas editing and syncing a notebook')
+    parser.add_argument('--replicas', type=int, default=4, help='Number of replicas')
+    parser.add_argument('--steps', type=int, default=50, help='Number of steps in which the replicas edit')
+    parser.add_argument('--edit-rate', type=float, default=0.5, help='Probability that a replica edits in a step')
+    parser.add_argument('--sync-rate', type=float, default=0.3, help='Probability that a replica syncs in a step')
+    parser.add_argument('--topology', type=str, default='mesh', choices=sorted(TOPOLOGIES), help='Which replicas sync with each other')
+    parser.add_argument('--partition', type=parse_partition, action='append', default=[],
+                        help='Partition as START:END:GROUP/GROUP, e.g. 10:30:0,1/2,3')
+    parser.add_argument('--transport', type=str, default='memory', choices=['memory', 'loopback', 'shared'], help='How replicas exchange messages')
+    parser.add_argument('--seed', type=int, default=SEED, help='Random seed')
+    args = parser.parse_args()
+
+    simulation = Simulation(replicas=args.replicas, steps=args.steps, edit_rate=args.edit_rate,
+                            sync_rate=args.sync_rate, topology=args.topology, partitions=args.partition,
+                            transport=args.transport, seed=args.seed)
+    report = simulation.run()
+    print(report)
@@ -1,7 +1,7 @@
 import random
 import pytest
 
-from notebook.cell import Cell
+from notebook.cell import Cell, text_edits
 from tests.fixtures import generate
 
 SEED = 42
@@ -58,6 +58,67 @@ class TestCell():
             a.update(text)
             assert a.get_text() == text
 
+    @pytest.mark.parametrize(
+        "before,after,edits",
+        [
+            ("", "abc", [(0, "abc", 0)]),
+            ("abc", "", [(0, "", 3)]),
+            ("abc", "abxc", [(2, "x", 0)]),
+            ("hello world", "help world", [(3, "p", 2)]),
+            ("aXbYc", "abc", [(1, "", 1), (2, "", 1)]),
+        ]
+    )
+    def test_text_edits(self, before, after, edits):
+        """
+        Test computing and applying the edits between two texts.
+        """
+        assert text_edits(before, after) == edits
+        a = Cell()
+        a.append_text(before)
+        a.apply_edits(edits)
+        assert a.get_text() == after
+
+    def test_edit(self):
+        """
+        Test applying position-based edits to a cell.
+        """
+        a = Cell()
+        a.edit(0, "hello world")
+        a.edit(5, ",")
+        assert a.get_text() == "hello, world"
+        a.edit(7, "there", 5)
+        assert a.get_text() == "hello, there"
+        a.edit(0, deleted=7)
+        assert a.get_text() == "there"
+
+        a.edit("1.5", "\nsecond line")
+        assert a.get_text() == "there\nsecond line"
+        a.edit("2.0", "a ", 7)
+        assert a.get_text() == "there\na line"
+        a.edit("1.100", "!")
+        assert a.get_text() == "there!\na line"
+
+        with pytest.raises(IndexError):
+            a.edit("3.0", "x")
+
+    @pytest.mark.parametrize(
+        "text,index,offset",
+        [
+            ("", "1.0", 0),
+            ("abc", "1.2", 2),
+            ("abc", "1.5", 3),
+            ("ab\ncd\n", "2.1", 4),
+            ("ab\ncd\n", "3.0", 6),
+        ]
+    )
+    def test_offset(self, text, index, offset):
+        """
+        Test converting tkinter indexes to character offsets.
+        """
+        a = Cell()
+        a.append_text(text)
+        assert a.offset(index) == offset
+
     def test_associative(self):
         """
         Tests that the associative property holds -> A + (B + C) == (A + B) + C.
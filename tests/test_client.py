@@ -0,0 +1,155 @@
+import pickle
+import socket
+import time
+
+from client.client import NotebookClient
+
+class TestNotebookClient():
+    """
+    Tests for the NotebookClient class.
+    """
+
+    def test_multiple_notebooks(self):
+        """
+        Test that a client hosts multiple notebooks and routes syncs by notebook ID.
+        """
+        hub = NotebookClient(0, [], name="hub", workers=2)
+        hub.host()
+        alice = NotebookClient(0, ["hub:{}".format(hub.port)], name="alice")
+        bob = NotebookClient(0, ["hub:{}".format(hub.port)], name="bob", notebook_id="notes")
+
+        alice.create_cell()
+        alice.update_cell(0, "alice default")
+        alice.create_cell(notebook_id="notes")
+        alice.update_cell(0, "alice notes", notebook_id="notes")
+        bob.create_cell()
+        bob.update_cell(0, "bob notes")
+
+        alice.sync("hub")
+        alice.sync("hub", notebook_id="notes")
+        bob.sync("hub")
+        assert sorted(hub.get_notebook_ids()) == ["default", "notes"]
+        assert hub.get_cell_data() == ["alice default"]
+        assert sorted(hub.get_cell_data("notes")) == ["alice notes", "bob notes"]
+        assert bob.get_cell_data() == hub.get_cell_data("notes")
+
+        # The second sync reuses the pooled connection
+        alice.sync("hub", notebook_id="notes")
+        assert alice.get_cell_data("notes") == hub.get_cell_data("notes")
+        assert len(alice.pool.idle[alice.peers["hub"]]) == 1
+
+    def test_idle_connections(self):
+        """
+        Test that connections kept open by the peers' connection pools do not tie up
+        the workers of the listener.
+        """
+        hub = NotebookClient(0, [], name="hub", workers=1)
+        hub.host()
+        alice = NotebookClient(0, ["hub:{}".format(hub.port)], name="alice")
+        bob = NotebookClient(0, ["hub:{}".format(hub.port)], name="bob")
+        alice.create_cell()
+        alice.sync("hub")
+        assert len(alice.pool.idle[alice.peers["hub"]]) == 1
+
+        # Bob is served by the only worker while alice's connection is idle
+        start = time.monotonic()
+        bob.sync("hub")
+        assert time.monotonic() - start < 5
+        assert bob.get_cell_data() == [""]
+
+    def test_sync_all(self):
+        """
+        Test that sync_all syncs with every peer and reports failed and slow peers.
+        """
+        bob = NotebookClient(0, [], name="bob", workers=2)
+        bob.host()
+        carol = NotebookClient(0, [], name="carol", workers=2)
+        carol.host()
+        bob.create_cell()
+        bob.update_cell(0, "bob")
+        carol.create_cell()
+        carol.update_cell(0, "carol")
+
+        # A peer which accepts connections but never responds
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as slow:
+            slow.bind(("localhost", 0))
+            slow.listen()
+            peers = ["bob:{}".format(bob.port), "carol:{}".format(carol.port), "slow:{}".format(slow.getsockname()[1])]
+            alice = NotebookClient(0, peers, name="alice")
+            start = time.monotonic()
+            results = alice.sync_all(timeout=0.5, parallelism=3)
+            assert time.monotonic() - start < 5
+
+        assert sorted(results) == ["bob", "carol", "slow"]
+        assert results["bob"].ok and results["bob"].changed
+        assert results["carol"].ok and results["carol"].changed
+        assert not results["slow"].ok
+        assert isinstance(results["slow"].error, socket.timeout)
+        assert sorted(alice.get_cell_data()) == ["bob", "carol"]
+
+        # Syncing again makes both peers converge without changing alice
+        results = alice.sync_all(peers=["bob", "carol"])
+        assert not any(result.changed for result in results.values())
+        assert bob.get_cell_data() == carol.get_cell_data() == alice.get_cell_data()
+
+    def test_digest_handshake(self):
+        """
+        Test that syncing notebooks which are already in sync takes one round trip.
+        """
+        bob = NotebookClient(0, [], name="bob", workers=2)
+        bob.host()
+        alice = NotebookClient(0, ["bob:{}".format(bob.port)], name="alice")
+        alice.create_cell()
+        alice.update_cell(0, "first")
+        alice.create_cell()
+        alice.update_cell(1, "second")
+
+        messages = []
+        exchange = alice.exchange
+        def record(peer, data, timeout=None):
+            messages.append(pickle.loads(data)["type"])
+            return exchange(peer, data, timeout)
+        alice.exchange = record
+
+        # Bob has nothing, so alice's notebook is pushed after the handshake
+        alice.sync("bob")
+        assert messages == ["digest", "push"]
+        assert bob.get_cell_data() == ["first", "second"]
+
+        messages.clear()
+        alice.sync("bob")
+        assert messages == ["digest"]
+
+        # Only bob changed, so the reply to the handshake is enough
+        bob.update_cell(1, "second edited")
+        messages.clear()
+        alice.sync("bob")
+        assert messages == ["digest"]
+        assert alice.get_cell_data() == ["first", "second edited"]
+
+        alice.update_cell(0, "first edited")
+        bob.create_cell()
+        messages.clear()
+        alice.sync("bob")
+        assert messages == ["digest", "push"]
+        assert alice.get_cell_data() == bob.get_cell_data() == ["first edited", "second edited", ""]
+
+    def test_transaction(self):
+        """
+        Test that the changes in a transaction are applied in one critical section and
+        reported to the subscribers once.
+        """
+        client = NotebookClient(0, [], name="alice")
+        client.create_cell(text="hello")
+        events = []
+        client.subscribe(events.append)
+        version = client.get_version()
+        with client.transaction() as notebook:
+            notebook.create_cell(text="world")
+            notebook.edit_cell(0, [(5, "!", 0)])
+            notebook.edit_cell(0, [(5, ",", 0)])
+            # The lock of the notebook is held until the block exits
+            assert client.notebooks[client.notebook_id].lock.locked()
+        assert client.get_cell_data() == ["hello,!", "world"]
+        assert [event.path for event in events] == [(), (0,)]
+        assert client.get_version() != version
@@ -0,0 +1,150 @@
+import pickle
+import random
+import uuid
+import pytest
+
+from crdt import columnar
+from crdt.columnar import ColumnarTree
+from crdt.sequence import Sequence
+from crdt.tree import ObjectTree
+from notebook.cell import Cell
+from notebook.notebook import DistributedNotebook
+
+SEED = 42
+
+class TestColumnarTree():
+    """
+    Tests for the ColumnarTree storage engine, which must order objects exactly like
+    the default ObjectTree.
+    """
+
+    @pytest.fixture(autouse=True)
+    def small_blocks(self, monkeypatch):
+        # Use small blocks so that block splitting is exercised
+        monkeypatch.setattr(columnar, "BLOCK_SIZE", 8)
+
+    def random_edits(self, sequences, count=100):
+        """
+        Applies the same random operations to each of the sequences.
+        """
+        chars = "abcdefghijklmnopqrstuvwxyz\n"
+        for i in range(count):
+            size = len(sequences[0].get())
+            op = random.choice(["append", "insert", "remove"])
+            char = random.choice(chars)
+            if op == "append" or size == 0:
+                for seq in sequences:
+                    seq.append(char)
+            elif op == "insert":
+                index = random.randint(0, size - 1)
+                for seq in sequences:
+                    seq.insert(index, char)
+            else:
+                index = random.randint(0, size - 1)
+                for seq in sequences:
+                    seq.remove(index)
+
+    def test_single_cell(self):
+        """
+        Test that the cell operations work with columnar storage.
+        """
+        a = Cell(storage=ColumnarTree)
+        a.append_text("this is the first line")
+        a.append_text("\nthis is the second line")
+        assert a.get_text() == "this is the first line\nthis is the second line"
+
+        a.remove_many(0, 5)
+        a.insert_text(7, "edited ")
+        assert a.get_text() == "is the edited first line\nthis is the second line"
+
+        a.update("something else entirely \U0001F600")
+        assert a.get_text() == "something else entirely \U0001F600"
+
+    def test_matches_object_tree(self):
+        """
+        Test that columnar storage orders merged operations like the object tree.
+        """
+        random.seed(SEED)
+        for i in range(20):
+            ids = [uuid.uuid4() for j in range(3)]
+            trees = [Sequence(id=id) for id in ids]
+            columns = [Sequence(id=id, storage=ColumnarTree) for id in ids]
+            for tree, column in zip(trees, columns):
+                self.random_edits([tree, column])
+
+            trees[0].merge(trees[1]).merge(trees[2])
+            columns[0].merge(columns[1]).merge(columns[2])
+            assert columns[0].get() == trees[0].get()
+            assert "".join(columns[0].get()) == columns[0].sequence.get_text()
+
+            # Concurrent edits after the merge are also ordered the same way
+            self.random_edits([trees[0], columns[0]])
+            self.random_edits([trees[1], columns[1]])
+            assert columns[0].merge(columns[1]).get() == trees[0].merge(trees[1]).get()
+
+    def test_snapshot(self):
+        """
+        Test that snapshots of columnar storage are not affected by later edits.
+        """
+        a = Cell(id="alice", storage=ColumnarTree)
+        a.append_text("hello world")
+        snapshot = a.snapshot()
+        a.update("goodbye world")
+        assert snapshot.get_text() == "hello world"
+        assert a.get_text() == "goodbye world"
+
+        remote = pickle.loads(pickle.dumps(snapshot))
+        assert remote.get_text() == "hello world"
+
+    def test_block_index(self):
+        """
+        Test that the block and position of each operation are kept up to date when
+        blocks are split and copied after a snapshot.
+        """
+        random.seed(SEED)
+        a = Sequence(id="alice", storage=ColumnarTree)
+        self.random_edits([a], count=50)
+        snapshot = a.snapshot()
+        self.random_edits([a], count=50)
+        for seq in [a, snapshot]:
+            tree = seq.sequence
+            for root in tree.roots:
+                for b, block in enumerate(root.blocks):
+                    assert tree.block_index[block] == (root, b)
+                    for i, op in enumerate(block.ops):
+                        assert tree.block_of[op] is block
+                        assert tree.locate(op) == (root, b, i)
+
+    def test_snapshot_nodes(self):
+        """
+        Test that the node table of a snapshot does not change when operations from
+        new nodes are added to the tree.
+        """
+        a = Cell(id="alice", storage=ColumnarTree)
+        a.append_text("hello")
+        snapshot = a.snapshot()
+        b = Cell(id="bob", storage=ColumnarTree)
+        b.merge(a.snapshot())
+        b.append_text(" world")
+        a.merge(b)
+        assert a.sequence.node_names == ["alice", "bob"]
+        assert snapshot.sequence.node_names == ["alice"]
+        assert snapshot.get_text() == "hello"
+        assert a.get_text() == "hello world"
+
+    def test_notebook_cells(self):
+        """
+        Test that notebooks create their cells with the configured storage engine, and
+        that the cells merge with cells stored in object trees.
+        """
+        a = DistributedNotebook(id="alice", cell_storage=ColumnarTree)
+        a.create_cell(text="hello")
+        assert isinstance(a.get()[0].sequence, ColumnarTree)
+        b = DistributedNotebook(id="bob")
+        b.merge(pickle.loads(pickle.dumps(a)))
+        b.create_cell(text="world")
+        b.update_cell(0, "hello there")
+        a.merge(pickle.loads(pickle.dumps(b)))
+        assert isinstance(a.get()[1].sequence, ObjectTree)
+        assert a.get_cell_data() == b.get_cell_data() == ["hello there", "world"]
+        assert pickle.loads(pickle.dumps(a)).cell_storage is ColumnarTree
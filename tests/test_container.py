@@ -0,0 +1,94 @@
+import pickle
+
+import pytest
+
+from notebook.cell import Cell
+from notebook.container import CONTAINER_VERSION, unpack_cell
+from notebook.notebook import DistributedNotebook
+
+def is_packed(cell):
+    return "packed" in cell.__dict__
+
+def make_notebook(id, cells=5):
+    notebook = DistributedNotebook(id=id)
+    for i in range(cells):
+        notebook.create_cell()
+        notebook.update_cell(i, "cell {}\n".format(i) * 20)
+    return notebook
+
+class TestContainer():
+    """
+    Tests for packed cells.
+    """
+
+    def test_lazy_merge(self):
+        """
+        Test that merging a remote notebook only decodes the cells which changed.
+        """
+        alice = make_notebook("alice")
+        bob = pickle.loads(pickle.dumps(alice))
+        assert all(is_packed(cell) for cell in bob.get())
+        assert bob.get_digest() == alice.get_digest()
+
+        alice.update_cell(2, "changed")
+        remote = pickle.loads(pickle.dumps(alice))
+        bob.merge(remote)
+        assert [is_packed(cell) for cell in remote.get()] == [True, True, False, True, True]
+        assert [is_packed(cell) for cell in bob.get()] == [True, True, False, True, True]
+        assert bob.get_digest() == alice.get_digest()
+        assert bob.get_cell_data() == alice.get_cell_data()
+        assert not any(is_packed(cell) for cell in bob.get())
+
+    def test_adopted(self):
+        """
+        Test that packed cells adopt the ID of the local replica and keep converging.
+        """
+        alice = make_notebook("alice", cells=2)
+        bob = DistributedNotebook(id="bob")
+        bob.merge(pickle.loads(pickle.dumps(alice)))
+        assert [cell.id for cell in bob.get()] == ["bob", "bob"]
+        assert all(is_packed(cell) for cell in bob.get())
+
+        # The ID is kept when the cell is decoded and when it is pickled again
+        restored = pickle.loads(pickle.dumps(bob))
+        assert restored.get()[0].id == "bob"
+        bob.update_cell(0, "bob")
+        alice.update_cell(0, "alice")
+        bob.merge(pickle.loads(pickle.dumps(alice)))
+        alice.merge(pickle.loads(pickle.dumps(bob)))
+        assert alice.get_cell_data() == bob.get_cell_data()
+
+    def test_copy(self):
+        """
+        Test that snapshots of packed cells share the blob of the cell.
+        """
+        cell = pickle.loads(pickle.dumps(make_notebook("alice", cells=1))).get()[0]
+        snapshot = cell.snapshot()
+        assert is_packed(snapshot) and snapshot.frozen
+        assert snapshot.__dict__["packed"] is cell.__dict__["packed"]
+        with pytest.raises(ValueError):
+            snapshot.append_text("x")
+        cell.append_text("x")
+        assert snapshot.get_text() + "x" == cell.get_text()
+
+    def test_header(self):
+        """
+        Test that unknown versions and corrupt blobs are rejected.
+        """
+        cell = Cell(id="alice")
+        cell.append_text("hello")
+        function, (version, id, digest, blob) = cell.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+        assert function is unpack_cell and version == CONTAINER_VERSION
+        with pytest.raises(ValueError):
+            unpack_cell(version + 1, id, digest, blob)
+        with pytest.raises(ValueError):
+            unpack_cell(version, id, digest ^ 1, blob).get_text()
+
+    def test_stub(self):
+        """
+        Test that stubs are pickled as stubs.
+        """
+        notebook = make_notebook("alice", cells=2)
+        snapshot = notebook.snapshot(exclude=notebook.nested_digests())
+        restored = pickle.loads(pickle.dumps(snapshot))
+        assert all(cell.stub and not is_packed(cell) for cell in restored.get())
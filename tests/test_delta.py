@@ -0,0 +1,113 @@
+import random
+import uuid
+
+from crdt.delta import DeltaBuffer, DeltaGCounter, DeltaGSet, DeltaTwoPhaseSet
+
+SEED = 42
+
+class TestDeltaCRDTs():
+    """
+    Tests for the delta-state CRDTs.
+    """
+
+    def test_gset(self):
+        """
+        Test that merging the deltas of a DeltaGSet reproduces its state.
+        """
+        a = DeltaGSet()
+        b = DeltaGSet()
+        items = b.items
+        delta = a.add("x")
+        assert delta.get() == {"x"}
+        b.merge(delta)
+        b.merge(a.add("y"))
+        assert b.get() == a.get() == {"x", "y"}
+        # Deltas are merged in place
+        assert b.items is items
+
+    def test_gcounter(self):
+        """
+        Test that the deltas of a DeltaGCounter carry the latest count of the replica,
+        so they can be merged in any order and more than once.
+        """
+        random.seed(SEED)
+        a = DeltaGCounter(id=uuid.uuid4())
+        b = DeltaGCounter(id=uuid.uuid4())
+        deltas = [a.add(random.randint(0, 10)) for i in range(20)]
+        deltas.append(b.add(5))
+        assert deltas[0].counts == {a.id: deltas[0].get()}
+
+        c = DeltaGCounter(id=uuid.uuid4())
+        random.shuffle(deltas)
+        for delta in deltas + deltas[:5]:
+            c.merge(delta)
+        assert c.get() == a.get() + b.get()
+
+    def test_twophaseset(self):
+        """
+        Test that the deltas of a DeltaTwoPhaseSet carry additions and removals.
+        """
+        a = DeltaTwoPhaseSet()
+        b = DeltaTwoPhaseSet()
+        for delta in [a.add("x"), a.add("y"), a.remove("x")]:
+            b.merge(delta)
+        assert a.remove("y").get() == set()
+        assert b.get() == {"y"}
+        assert b.removed.get() == {"x"}
+
+class TestDeltaBuffer():
+    """
+    Tests for the DeltaBuffer class.
+    """
+
+    def test_peers(self):
+        """
+        Test that each peer receives the deltas it has not acknowledged, and that
+        deltas are dropped once every peer acknowledged them.
+        """
+        local = DeltaGSet()
+        buffer = DeltaBuffer(["bob", "carol"])
+        replicas = {"bob": DeltaGSet(), "carol": DeltaGSet()}
+        for item in "abc":
+            buffer.push(local.add(item))
+
+        number, delta = buffer.collect("bob")
+        replicas["bob"].merge(delta)
+        buffer.ack("bob", number)
+        assert buffer.collect("bob") is None
+        assert len(buffer) == 3
+
+        buffer.push(local.add("d"))
+        number, delta = buffer.collect("bob")
+        assert delta.get() == {"d"}
+        replicas["bob"].merge(delta)
+        buffer.ack("bob", number)
+
+        # A lost delta is sent again, joined with the newer ones
+        buffer.collect("carol")
+        buffer.push(local.add("e"))
+        number, delta = buffer.collect("carol")
+        replicas["carol"].merge(delta)
+        buffer.ack("carol", number)
+        assert len(buffer) == 1
+
+        number, delta = buffer.collect("bob")
+        replicas["bob"].merge(delta)
+        buffer.ack("bob", number)
+        assert len(buffer) == 0
+        assert replicas["bob"].get() == replicas["carol"].get() == local.get()
+
+    def test_add_peer(self):
+        """
+        Test that deltas are only buffered for the peers which need them.
+        """
+        local = DeltaGSet()
+        buffer = DeltaBuffer()
+        buffer.push(local.add("a"))
+        assert len(buffer) == 0
+
+        buffer.add_peer("bob")
+        buffer.push(local.add("b"))
+        assert buffer.collect("bob")[1].get() == {"b"}
+        buffer.remove_peer("bob")
+        assert len(buffer) == 0
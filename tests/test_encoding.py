@@ -0,0 +1,79 @@
+import pickle
+
+from crdt.columnar import ColumnarTree
+from crdt.encoding import decode_operations, encode_operations
+from notebook.cell import Cell
+from notebook.notebook import DistributedNotebook
+
+class TestEncoding():
+    """
+    Tests for the run encoding of operations.
+    """
+
+    def test_runs(self):
+        """
+        Test that typing, pasting and deleting are each encoded as a single run. The
+        first character is inserted as a root, so it is a run of its own.
+        """
+        cell = Cell(id="alice")
+        cell.append_text("hello world")
+        cell.insert_text(5, " there")
+        cell.remove_many(0, 3)
+        records = encode_operations(cell.operations.get())
+        assert [(start, length, step, payload) for node, start, length, action, target, step, payload in records] == [
+            (1, 1, None, "h"),
+            (2, 10, None, "ello world"),
+            (12, 6, 0, " there"),
+            (18, 3, 1, None),
+        ]
+
+        ops = decode_operations(records)
+        assert set(ops.values()) == cell.operations.get()
+        for op in cell.operations.get():
+            decoded = ops[(op.owner.node, op.owner.id)]
+            assert decoded.action is op.action and decoded.payload == op.payload
+            assert decoded.target == op.target
+
+    def test_pickle(self):
+        """
+        Test that long cells are pickled in about one byte per operation and are
+        restored with the same objects and order.
+        """
+        for storage in [None, ColumnarTree]:
+            cell = Cell(id="alice") if storage is None else Cell(id="alice", storage=storage)
+            for i in range(200):
+                cell.append_text("line {}\n".format(i))
+            cell.remove_many(100, 50)
+            other = Cell(id="bob")
+            other.merge(cell)
+            other.insert_text(10, "bob")
+            cell.merge(other)
+
+            data = pickle.dumps(cell)
+            assert len(data) < len(cell.operations.get()) + 500
+            restored = pickle.loads(data)
+            assert type(restored.sequence) is type(cell.sequence)
+            assert restored.get_text() == cell.get_text()
+            assert restored.get_digest() == cell.get_digest()
+            assert restored.sequence.before == cell.sequence.before
+            assert restored.sequence.after == cell.sequence.after
+
+            # The restored cell keeps converging with the other replica
+            restored.insert_text(5, "x")
+            other.append_text("y")
+            restored.merge(other)
+            other.merge(restored)
+            assert restored.get_text() == other.get_text()
+
+    def test_nested(self):
+        """
+        Test that notebooks are pickled with their cells.
+        """
+        notebook = DistributedNotebook(id="alice")
+        for i in range(3):
+            notebook.create_cell()
+            notebook.update_cell(i, "cell {}".format(i))
+        notebook.remove_cell(1)
+        restored = pickle.loads(pickle.dumps(notebook))
+        assert restored.get_cell_data() == ["cell 0", "cell 2"]
+        assert restored.get_digest() == notebook.get_digest()
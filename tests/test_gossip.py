@@ -0,0 +1,92 @@
+import time
+
+from client.client import NotebookClient
+from client.gossip import GossipScheduler
+
+SEED = 42
+
+class TestGossipScheduler():
+    """
+    Tests for the GossipScheduler class.
+    """
+
+    def test_adaptive_interval(self):
+        """
+        Test that rounds run when the notebook changed and back off while it is idle.
+        """
+        bob = NotebookClient(0, [], name="bob", workers=2)
+        bob.host()
+        alice = NotebookClient(0, ["bob:{}".format(bob.port)], name="alice")
+        scheduler = GossipScheduler(alice, min_interval=1, max_interval=4, seed=SEED)
+
+        alice.create_cell()
+        alice.update_cell(0, "hello")
+        scheduler.tick(0)
+        assert scheduler.rounds == 1
+        assert bob.get_cell_data() == ["hello"]
+
+        # Nothing changed, so the rounds are skipped with an increasing interval
+        for now in range(1, 7):
+            scheduler.tick(now)
+        assert scheduler.rounds == 1
+        assert scheduler.skipped == 2
+        assert scheduler.states["default"].interval == 4
+
+        # Once idle for the maximum interval, the notebook is synced anyway to pick
+        # up remote changes
+        bob.update_cell(0, "hello world")
+        scheduler.tick(7)
+        assert scheduler.rounds == 2
+        assert alice.get_cell_data() == ["hello world"]
+
+        # The merged change makes the notebook active again
+        scheduler.tick(8)
+        assert scheduler.rounds == 3
+        assert scheduler.states["default"].interval == 1
+
+    def test_background(self):
+        """
+        Test that replicas converge through background gossip.
+        """
+        clients = [NotebookClient(0, [], name=name, workers=2) for name in ["alice", "bob", "carol"]]
+        for client in clients:
+            client.host()
+        for client in clients:
+            client.peers = {other.name: ("localhost", other.port) for other in clients if other is not client}
+            client.create_cell()
+            client.update_cell(0, client.name)
+
+        schedulers = [GossipScheduler(client, min_interval=0.05, max_interval=0.2, seed=SEED) for client in clients]
+        for scheduler in schedulers:
+            scheduler.start()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            data = [client.get_cell_data() for client in clients]
+            if all(len(cells) == 3 for cells in data) and data.count(data[0]) == 3:
+                break
+            time.sleep(0.05)
+        for scheduler in schedulers:
+            scheduler.stop()
+        assert sorted(clients[0].get_cell_data()) == ["alice", "bob", "carol"]
+        assert clients[0].get_cell_data() == clients[1].get_cell_data() == clients[2].get_cell_data()
+
+    def test_idle_notebooks(self):
+        """
+        Test that unchanged notebooks are synced in different ticks, and that the
+        notebooks are not observed to track their changes.
+        """
+        bob = NotebookClient(0, [], name="bob", workers=2)
+        bob.host()
+        alice = NotebookClient(0, ["bob:{}".format(bob.port)], name="alice")
+        for notebook_id in ["a", "b", "c"]:
+            alice.create_cell(notebook_id=notebook_id)
+        assert not any(alice.open_notebook(notebook_id).notebook.listeners for notebook_id in ["a", "b", "c"])
+        scheduler = GossipScheduler(alice, min_interval=1, max_interval=1, seed=SEED)
+        scheduler.tick(0)
+        assert scheduler.rounds == 4
+
+        # Nothing changed, so only one notebook is synced per tick
+        for now in range(1, 4):
+            scheduler.tick(now)
+            assert scheduler.rounds == 4 + now
+        bob.close()
@@ -32,6 +32,21 @@ class TestGSet():
 
         assert a.merge(b).get() == {"a", "b", "c", 1}
 
+    def test_snapshot(self):
+        """
+        Test that snapshots share the items until either set is modified.
+        """
+        a = GSet()
+        a.add("a")
+        snapshot = a.snapshot()
+        assert snapshot.get() is a.get()
+        a.add("b")
+        other = GSet()
+        other.add("c")
+        snapshot.merge(other)
+        assert a.get() == {"a", "b"}
+        assert snapshot.get() == {"a", "c"}
+
     def test_associative(self):
         """
         Tests that the associative property holds -> A + (B + C) == (A + B) + C.
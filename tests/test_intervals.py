@@ -0,0 +1,102 @@
+import random
+
+from crdt.gset import GSet
+from crdt.intervals import IdSet, IntervalSet
+from crdt.sequence import OpId
+
+SEED = 42
+
+class TestIntervalSet():
+    """
+    Tests for the IntervalSet class.
+    """
+
+    def test_runs(self):
+        """
+        Test that runs of consecutive integers are joined into intervals.
+        """
+        values = IntervalSet()
+        for i in range(1, 100):
+            values.add(i)
+        values.add_range(200, 300)
+        assert values.intervals() == [(1, 100), (200, 300)]
+        assert len(values) == 199
+        assert 0 not in values and 1 in values and 99 in values and 100 not in values
+        assert 250 in values and 300 not in values
+
+        # Filling the gap joins the intervals
+        values.add_range(90, 210)
+        assert values.intervals() == [(1, 300)]
+
+    def test_random(self):
+        """
+        Test that an IntervalSet contains the same integers as a set when the integers
+        are added in random order.
+        """
+        random.seed(SEED)
+        for i in range(50):
+            expected = set()
+            values = IntervalSet()
+            for j in range(100):
+                start = random.randint(0, 200)
+                end = start + random.randint(0, 10)
+                expected.update(range(start, end))
+                values.add_range(start, end)
+            assert list(values) == sorted(expected)
+            assert all((value in values) == (value in expected) for value in range(-1, 220))
+            # The intervals are disjoint and do not touch
+            assert all(end < start for (_, end), (start, _) in zip(values.intervals(), values.intervals()[1:]))
+
+class TestIdSet():
+    """
+    Tests for the IdSet class.
+    """
+
+    def test_ids(self):
+        """
+        Test that OpIds are stored as intervals per node and other items as a set.
+        """
+        ids = IdSet()
+        for i in range(1, 1000):
+            ids.add(OpId("alice", i))
+        ids.add(OpId("bob", 5))
+        ids.add("other")
+        assert ids.ids["alice"].intervals() == [(1, 1000)]
+        assert OpId("alice", 500) in ids and OpId("bob", 5) in ids and "other" in ids
+        assert OpId("bob", 500) not in ids
+        assert len(ids.get()) == 1001
+
+    def test_merge(self):
+        """
+        Test that IdSets merge with each other and with GSets.
+        """
+        a = IdSet()
+        a.add(OpId("alice", 1))
+        b = IdSet()
+        b.add(OpId("alice", 2))
+        b.add(OpId("bob", 1))
+        c = GSet()
+        c.add(OpId("carol", 1))
+        a.merge(b).merge(c)
+        assert a.get() == {OpId("alice", 1), OpId("alice", 2), OpId("bob", 1), OpId("carol", 1)}
+        assert a.ids["alice"].intervals() == [(1, 3)]
+        assert c.merge(a).get() == a.get()
+
+    def test_snapshot(self):
+        """
+        Test that a snapshot keeps its intervals when either set is modified.
+        """
+        a = IdSet()
+        a.add(OpId("alice", 1))
+        a.add("other")
+        snapshot = a.snapshot()
+        a.add(OpId("alice", 2))
+        a.add(OpId("bob", 1))
+        assert snapshot.get() == {OpId("alice", 1), "other"}
+        assert OpId("alice", 2) not in snapshot
+
+        b = IdSet()
+        b.add(OpId("alice", 5))
+        snapshot.merge(b)
+        assert snapshot.get() == {OpId("alice", 1), OpId("alice", 5), "other"}
+        assert a.get() == {OpId("alice", 1), OpId("alice", 2), OpId("bob", 1), "other"}
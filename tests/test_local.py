@@ -0,0 +1,123 @@
+import os
+import socket
+import stat
+
+import pytest
+
+from client.client import NotebookClient
+from client.local import MIN_SEGMENT_SIZE, LocalRegistry, SharedChannel
+
+def bind_socket(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(path))
+    return sock
+
+class TestLocal():
+    """
+    Tests for the shared memory transport between replicas on the same host.
+    """
+
+    def test_registry(self, tmp_path):
+        """
+        Test that replicas are registered by port, and that the entries of processes
+        which exited or of missing sockets are ignored.
+        """
+        registry = LocalRegistry(str(tmp_path / "replicas.json"))
+        alice, bob, carol = [str(tmp_path / name) for name in ("alice.sock", "bob.sock", "carol.sock")]
+        sockets = [bind_socket(path) for path in (alice, bob, carol)]
+        assert registry.lookup(55101) is None
+        registry.register(55101, alice)
+        registry.register(55102, bob)
+        assert registry.lookup(55101) == alice
+        registry.unregister(55101)
+        assert registry.lookup(55101) is None
+        assert registry.lookup(55102) == bob
+        # Entries are only removed by the replica which registered them
+        registry.unregister(55102, carol)
+        assert registry.lookup(55102) == bob
+
+        with registry.locked() as entries:
+            # The ID of a process which does not exist
+            entries["55103"] = {"socket": carol, "pid": 2 ** 22 + 1}
+            entries["55104"] = {"socket": str(tmp_path / "missing.sock"), "pid": os.getpid()}
+        assert registry.lookup(55103) is None
+        assert registry.lookup(55104) is None
+        for sock in sockets:
+            sock.close()
+
+    def test_runtime_directory(self, tmp_path, monkeypatch):
+        """
+        Test that the default registry is kept in a directory which only the current
+        user can access.
+        """
+        monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+        registry = LocalRegistry()
+        assert registry.directory == str(tmp_path / "eirene")
+        assert stat.S_IMODE(os.stat(registry.directory).st_mode) == 0o700
+        os.chmod(registry.directory, 0o755)
+        with pytest.raises(PermissionError):
+            LocalRegistry()
+
+    def test_channel(self):
+        """
+        Test that messages of any size are exchanged in both directions, and that the
+        segments are removed when the channels are closed.
+        """
+        a, b = socket.socketpair(socket.AF_UNIX)
+        alice, bob = SharedChannel(a), SharedChannel(b)
+        for size in [0, 10, MIN_SEGMENT_SIZE + 1, 10]:
+            data = os.urandom(size)
+            alice.send_bytes(data)
+            with bob.recv_bytes() as received:
+                # Messages are not copied out of the segment
+                assert isinstance(received, memoryview)
+                assert received == data
+            bob.send_bytes(data[::-1])
+            assert alice.recv_bytes() == data[::-1]
+        assert alice.outbox.size == 2 * MIN_SEGMENT_SIZE
+        path = alice.outbox.path
+        alice.close()
+        assert bob.recv_bytes() == b''
+        bob.close()
+        assert not os.path.exists(path)
+
+    def test_sync(self, tmp_path):
+        """
+        Test that clients on the same host sync through shared memory.
+        """
+        registry = LocalRegistry(str(tmp_path / "replicas.json"))
+        bob = NotebookClient(0, [], name="bob", registry=registry)
+        bob.host()
+        alice = NotebookClient(0, ["bob:localhost:{}".format(bob.port)], name="alice", registry=registry)
+        alice.create_cell()
+        alice.update_cell(0, "hello")
+        alice.sync("bob")
+        assert bob.get_cell_data() == ["hello"]
+        bob.update_cell(0, "hello from bob")
+        alice.sync("bob")
+        assert alice.get_cell_data() == ["hello from bob"]
+        idle = alice.pool.idle[("localhost", bob.port)]
+        assert all(isinstance(conn, SharedChannel) for conn in idle)
+        assert alice.query_stats("bob")["counters"]["listen.messages"] > 0
+
+    def test_stale_entry(self, tmp_path):
+        """
+        Test that a peer whose registered socket does not accept connections is
+        reached over TCP, and that the stale entry is dropped.
+        """
+        registry = LocalRegistry(str(tmp_path / "replicas.json"))
+        bob = NotebookClient(0, [], name="bob")
+        bob.host()
+        # A socket which is not listening anymore, e.g. of a replica which was closed
+        # without exiting its process
+        path = str(tmp_path / "stale.sock")
+        bind_socket(path).close()
+        registry.register(bob.port, path)
+        alice = NotebookClient(0, ["bob:localhost:{}".format(bob.port)], name="alice", registry=registry)
+        alice.create_cell()
+        alice.update_cell(0, "hello")
+        alice.sync("bob")
+        assert bob.get_cell_data() == ["hello"]
+        assert registry.lookup(bob.port) is None
+        idle = alice.pool.idle[("localhost", bob.port)]
+        assert not any(isinstance(conn, SharedChannel) for conn in idle)
@@ -1,4 +1,7 @@
+import pickle
 import random
+import pytest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from notebook.cell import Cell
 from notebook.notebook import DistributedNotebook
@@ -56,6 +59,195 @@ class TestDistributedNotebook():
         book2.update_cell(0, "Bob edited")
         assert book1.merge(book2).get() == book2.merge(book1).get()
 
+    def test_edit_cell(self):
+        """
+        Test editing cells with position-based edits.
+        """
+        book = DistributedNotebook(id="alice")
+        book.create_cell()
+        book.edit_cell(0, [(0, "abc", 0), ("1.1", "x", 1)])
+        assert book.get_cell_data() == ["axc"]
+
+    def test_snapshot(self):
+        """
+        Test that notebook snapshots are not affected by edits to the cells.
+        """
+        book = DistributedNotebook(id="alice")
+        book.create_cell()
+        book.update_cell(0, "first cell")
+        book.create_cell()
+        book.update_cell(1, "second cell")
+        snapshot = book.snapshot()
+
+        book.update_cell(0, "edited cell")
+        book.remove_cell(1)
+        book.create_cell()
+        assert book.get_cell_data() == ["edited cell", ""]
+        assert snapshot.get_cell_data() == ["first cell", "second cell"]
+
+        other = DistributedNotebook(id="bob")
+        assert other.merge(snapshot).get_cell_data() == ["first cell", "second cell"]
+        assert snapshot.get_cell_data() == ["first cell", "second cell"]
+
+    def test_snapshot_unchanged_cells(self):
+        """
+        Test that snapshots share the copies of the cells which did not change.
+        """
+        book = DistributedNotebook(id="alice")
+        book.create_cell(text="first cell")
+        book.create_cell(text="second cell")
+        first = book.snapshot()
+        second = book.snapshot()
+        assert first.get()[0] is second.get()[0]
+
+        book.update_cell(1, "second cell edited")
+        third = book.snapshot()
+        assert third.get()[0] is first.get()[0]
+        assert third.get()[1] is not first.get()[1]
+        assert first.get_cell_data() == ["first cell", "second cell"]
+        assert third.get_cell_data() == ["first cell", "second cell edited"]
+
+    def test_copy_merged_cells(self):
+        """
+        Test that copies of cells merged from a remote notebook can be edited.
+        """
+        other = DistributedNotebook(id="bob")
+        other.create_cell()
+        other.update_cell(0, "bob")
+        book = DistributedNotebook(id="alice")
+        book.merge(pickle.loads(pickle.dumps(other)))
+        copy = book.copy()
+        copy.update_cell(0, "alice")
+        assert copy.get_cell_data() == ["alice"]
+        assert book.get_cell_data() == ["bob"]
+
+    def test_digest(self):
+        """
+        Test that notebook digests cover the cells, and that cells with matching
+        digests can be left out of snapshots.
+        """
+        book = DistributedNotebook(id="alice")
+        book.create_cell()
+        book.update_cell(0, "first cell")
+        book.create_cell()
+        book.update_cell(1, "second cell")
+        other = DistributedNotebook(id="bob")
+        other.merge(pickle.loads(pickle.dumps(book)))
+        assert other.get_digest() == book.get_digest()
+
+        other.update_cell(1, "second cell edited")
+        assert other.get_digest() != book.get_digest()
+        digests = book.nested_digests()
+        changed = [key for key, digest in other.nested_digests().items() if digests[key] != digest]
+        assert len(changed) == 1
+
+        # Only the edited cell is included in the snapshot
+        snapshot = other.snapshot(exclude=digests)
+        assert [cell.stub for cell in snapshot.get()] == [True, False]
+        assert snapshot.get_cell_data() == ["", "second cell edited"]
+        book.merge(pickle.loads(pickle.dumps(snapshot)))
+        assert book.get_cell_data() == ["first cell", "second cell edited"]
+        assert book.get_digest() == other.get_digest()
+
+    def test_subscribe(self):
+        """
+        Test that subscribers are notified of changes to the cells.
+        """
+        book = DistributedNotebook(id="alice")
+        book.create_cell()
+        events = []
+        book.subscribe(events.append)
+
+        book.create_cell()
+        book.update_cell(1, "ab")
+        book.update_cell(0, "x")
+        book.remove_cell(0)
+        assert [(event.path, event.delta) for event in events] == [
+            ((), [("retain", 1), ("insert", [book.get()[0]])]),
+            ((1,), [("insert", ["a", "b"])]),
+            ((0,), [("insert", ["x"])]),
+            ((), [("delete", 1)]),
+        ]
+
+        # Changes to cells merged from a remote notebook are also reported
+        other = DistributedNotebook(id="bob")
+        other.merge(pickle.loads(pickle.dumps(book)))
+        other.update_cell(0, "abc")
+        events.clear()
+        book.merge(other)
+        assert [(event.path, event.delta, event.local) for event in events] == [
+            ((0,), [("retain", 2), ("insert", ["c"])], False),
+        ]
+
+        # The cells are no longer observed once the last callback is removed
+        book.unsubscribe(events.append)
+        assert not any(cell.listeners for cell in book.get())
+        book.update_cell(0, "abcd")
+        book.subscribe(events.append)
+        book.update_cell(0, "abcde")
+        assert events[-1].path == (0,)
+
+    def test_transaction(self):
+        """
+        Test that the changes in a transaction are reported once per changed cell.
+        """
+        book = DistributedNotebook(id="alice")
+        book.create_cell(text="first")
+        events = []
+        book.subscribe(events.append)
+        with book.transaction():
+            book.create_cell(text="second")
+            book.edit_cell(0, [(0, "the ", 0), (9, "", 0)])
+            book.update_cell(0, "the first cell")
+            book.update_cell(1, "second cell")
+        assert [(event.path, event.delta) for event in events] == [
+            ((), [("retain", 1), ("insert", [book.get()[1]])]),
+            ((0,), [("insert", list("the ")), ("retain", 5), ("insert", list(" cell"))]),
+            ((1,), [("retain", 6), ("insert", list(" cell"))]),
+        ]
+        assert book.get_cell_data() == ["the first cell", "second cell"]
+
+    def test_parallel_merge(self):
+        """
+        Test that merging the cells in parallel gives the same result as a serial merge.
+        """
+        random.seed(SEED)
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            for i in range(5):
+                a = generate.random_notebook()
+                b = generate.random_notebook()
+                serial = pickle.loads(pickle.dumps(a)).merge(pickle.loads(pickle.dumps(b)))
+                serial = serial.merge(pickle.loads(pickle.dumps(serial)))
+
+                parallel = a.merge(b, executor=executor, threshold=0)
+                parallel = parallel.merge(pickle.loads(pickle.dumps(parallel)), executor=executor, threshold=0)
+                assert parallel.get_cell_data() == serial.get_cell_data()
+
+    def test_parallel_merge_events(self):
+        """
+        Test that the events from a parallel merge are delivered in cell order.
+        """
+        book = DistributedNotebook(id="alice")
+        for i in range(4):
+            book.create_cell()
+        other = pickle.loads(pickle.dumps(book))
+        other.id = "bob"
+        for i in reversed(range(4)):
+            other.get()[i].id = "bob"
+            other.update_cell(i, str(i))
+
+        events = []
+        book.subscribe(events.append)
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            book.merge(other, executor=executor, threshold=0)
+        assert [event.path for event in events] == [(0,), (1,), (2,), (3,)]
+        assert book.get_cell_data() == ["0", "1", "2", "3"]
+
+        # Threads do not merge CPU-bound cells in parallel
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            with pytest.raises(ValueError):
+                book.merge(other, executor=executor, threshold=0)
+
     def test_associative(self):
         """
         Tests that the associative property holds -> A + (B + C) == (A + B) + C.
@@ -0,0 +1,181 @@
+import pickle
+
+from client import pipeline as pipeline_module
+from client.client import NotebookClient
+from client.pipeline import EditPipeline
+from notebook.cell import apply_text_edits, delta_edits, text_edits
+
+class TestEditPipeline():
+    """
+    Tests for the EditPipeline class.
+    """
+
+    def test_flush(self):
+        """
+        Test that submitted edits are coalesced and applied by flush().
+        """
+        client = NotebookClient(55101, [], name="alice")
+        client.create_cell()
+        client.create_cell()
+        pipeline = EditPipeline(client)
+
+        pipeline.submit(0, "a")
+        pipeline.submit(0, "ab")
+        pipeline.submit(1, "xyz")
+        assert client.get_cell_data() == ["", ""]
+
+        pipeline.flush()
+        assert client.get_cell_data() == ["ab", "xyz"]
+        assert pipeline.pending == {}
+
+    def test_submit_edits(self):
+        """
+        Test that position-based edits are combined with pending edits.
+        """
+        client = NotebookClient(55101, [], name="alice")
+        client.create_cell()
+        client.create_cell()
+        pipeline = EditPipeline(client)
+
+        pipeline.submit_edits(0, [(0, "hello", 0)])
+        pipeline.submit_edits(0, [(5, " world", 0), (0, "", 1)])
+        pipeline.submit(1, "abc")
+        pipeline.submit_edits(1, [(1, "x", 1)])
+        assert pipeline.pending == {0: [(0, "hello", 0), (5, " world", 0), (0, "", 1)], 1: "axc"}
+
+        pipeline.flush()
+        assert client.get_cell_data() == ["ello world", "axc"]
+
+    def test_worker(self):
+        """
+        Test that the worker thread applies submitted edits in order.
+        """
+        client = NotebookClient(55101, [], name="alice")
+        client.create_cell()
+        pipeline = EditPipeline(client)
+        pipeline.start()
+
+        text = ""
+        for c in "hello world":
+            text += c
+            pipeline.submit(0, text)
+        pipeline.stop()
+        assert client.get_cell_data() == ["hello world"]
+
+    def test_diff_unlocked(self, monkeypatch):
+        """
+        Test that new texts are diffed without holding the lock of the notebook, and
+        diffed again only if a merge changed the cell in the meantime.
+        """
+        client = NotebookClient(55101, [], name="alice")
+        client.create_cell(text="hello world")
+        hosted = client.open_notebook(None)
+        pipeline = EditPipeline(client)
+        remote = self.remote_replica(client)
+        remote.edit_cell(0, [(0, "big ", 0)])
+
+        locked = []
+        def diff(old, new):
+            locked.append(hosted.lock.locked())
+            return text_edits(old, new)
+        monkeypatch.setattr(pipeline_module, "text_edits", diff)
+        pipeline.submit(0, "hello, world")
+        pipeline.flush()
+        assert locked == [False]
+        assert client.get_cell_data() == ["hello, world"]
+
+        # A merge arrives while the text is diffed
+        def merge(old, new):
+            if not locked:
+                client.merge(None, remote)
+            return diff(old, new)
+        locked.clear()
+        monkeypatch.setattr(pipeline_module, "text_edits", merge)
+        pipeline.submit(0, "hello, world!")
+        pipeline.flush()
+        assert locked == [False, True]
+        assert client.get_cell_data() == ["hello, world!"]
+
+    def test_removed_cell(self):
+        """
+        Test that edits to removed cells are dropped.
+        """
+        client = NotebookClient(55101, [], name="alice")
+        client.create_cell()
+        pipeline = EditPipeline(client)
+        pipeline.submit(1, "missing")
+        pipeline.flush()
+        assert client.get_cell_data() == [""]
+
+    def render(self, texts, changes):
+        """
+        Applies the changes returned by EditPipeline.take_changes() to a list of texts,
+        like an editor which shows the texts.
+        """
+        cells, deltas = changes
+        position = 0
+        for action, value in cells:
+            if action == "retain":
+                position += value
+            elif action == "insert":
+                texts[position:position] = value
+                position += len(value)
+            else:
+                del texts[position:position + value]
+        for index, delta in deltas.items():
+            texts[index] = apply_text_edits(texts[index], delta_edits(delta))
+        return texts
+
+    def remote_replica(self, client):
+        """
+        Returns a replica of the client's notebook which is edited by another user.
+        """
+        remote = pickle.loads(pickle.dumps(client.snapshot()))
+        remote.id = "bob"
+        for cell in remote.get():
+            cell.id = "bob"
+        return remote
+
+    def test_rebase(self):
+        """
+        Test that edits made before a merge is rendered are rebased through it.
+        """
+        client = NotebookClient(55101, [], name="alice")
+        client.create_cell(text="hello world")
+        pipeline = EditPipeline(client)
+        client.subscribe(pipeline.receive)
+        remote = self.remote_replica(client)
+        remote.edit_cell(0, [(0, "big ", 0)])
+
+        # The editor shows "hello world" until it renders the merge
+        pipeline.submit_edits(0, [(5, ",", 0)])
+        client.merge(None, remote)
+        pipeline.submit_edits(0, [(12, "!", 0)])
+        changes = pipeline.take_changes()
+        assert changes == ([], {0: [("insert", list("big "))]})
+        assert self.render(["hello, world!"], changes) == client.get_cell_data() == ["big hello, world!"]
+        assert pipeline.take_changes() == ([], {})
+
+    def test_rebase_cells(self):
+        """
+        Test that edits follow their cells when cells are merged before them.
+        """
+        client = NotebookClient(55101, [], name="alice")
+        client.create_cell(text="first")
+        pipeline = EditPipeline(client)
+        client.subscribe(pipeline.receive)
+        remote = self.remote_replica(client)
+        remote.create_cell(0, "new")
+        remote.remove_cell(1)
+        remote.create_cell(text="last")
+
+        client.merge(None, remote)
+        pipeline.submit_edits(0, [(5, "!", 0)])
+        assert pipeline.pending == {}
+        client.create_cell(1, text="second")
+        pipeline.submit_edits(0, [(0, "x", 0)])
+        remote.edit_cell(0, [(3, "er", 0)])
+        client.merge(None, remote)
+        texts = self.render(["first!"], pipeline.take_changes())
+        assert texts == client.get_cell_data() == ["newer", "second", "last"]
+
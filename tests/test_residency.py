@@ -0,0 +1,110 @@
+import gc
+import os
+import pickle
+
+from client.client import NotebookClient
+from notebook.notebook import DistributedNotebook
+from notebook.residency import OPERATION_SIZE, CellResidency, SpilledBlob
+
+def is_evicted(cell):
+    return isinstance(cell.__dict__.get("packed"), SpilledBlob)
+
+def make_notebook(residency, cells=10):
+    notebook = DistributedNotebook(id="alice")
+    notebook.set_residency(residency)
+    for i in range(cells):
+        notebook.create_cell()
+        notebook.update_cell(i, "cell {}\n".format(i) * 10)
+    return notebook
+
+class TestResidency():
+    """
+    Tests for the CellResidency class.
+    """
+
+    def test_eviction(self, tmp_path):
+        """
+        Test that the least recently used cells are evicted to disk and decoded again
+        when they are used.
+        """
+        residency = CellResidency(3 * 70 * OPERATION_SIZE, str(tmp_path))
+        notebook = make_notebook(residency)
+        cells = notebook.get()
+        assert [is_evicted(cell) for cell in cells] == [True] * 7 + [False] * 3
+        assert residency.get_size() <= residency.budget
+        assert len(os.listdir(tmp_path)) == 7
+
+        notebook.update_cell(0, "first")
+        assert residency.faults == 1
+        assert not is_evicted(cells[0]) and is_evicted(cells[7])
+        data = ["first"] + ["cell {}\n".format(i) * 10 for i in range(1, 10)]
+        # Snapshots decode copies of the evicted cells, which leaves the cells evicted
+        assert notebook.snapshot().get_cell_data() == data
+        assert is_evicted(cells[7])
+        evictions = residency.evictions
+        assert notebook.get_cell_data() == data
+        assert residency.get_size() <= residency.budget
+        assert residency.evictions > evictions
+
+        # The file of the first cell was replaced when the modified cell was evicted
+        # again, and the files of the other cells are reused
+        del cells
+        gc.collect()
+        assert len(os.listdir(tmp_path)) == 10
+
+    def test_merge(self, tmp_path):
+        """
+        Test that notebooks with evicted cells are merged and pickled.
+        """
+        residency = CellResidency(200 * OPERATION_SIZE, str(tmp_path))
+        notebook = make_notebook(residency, cells=5)
+        remote = pickle.loads(pickle.dumps(notebook))
+        remote.id = "bob"
+        remote.update_cell(1, "bob")
+        notebook.update_cell(4, "alice")
+        notebook.merge(pickle.loads(pickle.dumps(remote)))
+        remote.merge(pickle.loads(pickle.dumps(notebook)))
+        assert notebook.get_cell_data() == remote.get_cell_data()
+        assert notebook.get_digest() == remote.get_digest()
+        assert residency.get_size() <= residency.budget
+
+        # Cells which are decoded after unpickling are also evicted
+        restored = pickle.loads(pickle.dumps(notebook))
+        restored.set_residency(CellResidency(100 * OPERATION_SIZE, str(tmp_path)))
+        assert restored.get_cell_data() == notebook.get_cell_data()
+        assert sum(is_evicted(cell) for cell in restored.get()) == 4
+
+    def test_merge_peak(self, tmp_path):
+        """
+        Test that cells are evicted while a merge decodes them, so that merging a
+        notebook which changes every cell stays close to the budget.
+        """
+        class PeakResidency(CellResidency):
+            peak = 0
+
+            def track(self, cell):
+                super().track(cell)
+                self.peak = max(self.peak, self.size)
+
+        residency = PeakResidency(3 * 150 * OPERATION_SIZE, str(tmp_path))
+        notebook = make_notebook(residency)
+        remote = pickle.loads(pickle.dumps(notebook))
+        remote.id = "bob"
+        for i in range(10):
+            remote.update_cell(i, "bob {}".format(i))
+        residency.peak = 0
+        notebook.merge(pickle.loads(pickle.dumps(remote)))
+        assert notebook.get_cell_data() == remote.get_cell_data()
+        assert residency.get_size() <= residency.budget
+        assert residency.peak <= residency.budget + 2 * 150 * OPERATION_SIZE
+
+    def test_client(self, tmp_path):
+        """
+        Test that clients keep the cells of their notebooks within the budget.
+        """
+        client = NotebookClient(0, [], cell_budget=OPERATION_SIZE * 100, spill_directory=str(tmp_path))
+        for i in range(5):
+            client.create_cell()
+            client.update_cell(i, "x" * 60)
+        assert sum(is_evicted(cell) for cell in client.notebook.get()) == 4
+        assert client.get_cell_data() == ["x" * 60] * 5
@@ -0,0 +1,137 @@
+import pickle
+import random
+
+from notebook.cell import Cell
+from notebook.rope import CHUNK_SIZE, Rope
+
+SEED = 42
+
+def check_balanced(node):
+    """
+    Returns the height of a rope tree, checking that it is balanced.
+    """
+    if node is None or node.height == 0:
+        return 0
+    left = check_balanced(node.left)
+    right = check_balanced(node.right)
+    assert abs(left - right) <= 1
+    assert node.length == node.left.length + node.right.length
+    return max(left, right) + 1
+
+class TestRope():
+    """
+    Tests for the Rope class.
+    """
+
+    def test_edits(self):
+        """
+        Test that random inserts and deletes give the same text as editing a string,
+        and that the tree stays balanced.
+        """
+        random.seed(SEED)
+        text = ""
+        rope = Rope()
+        for i in range(2000):
+            if text and random.random() < 0.3:
+                start = random.randrange(len(text))
+                length = random.randint(0, min(len(text) - start, 50))
+                text = text[:start] + text[start + length:]
+                rope = rope.delete(start, length)
+            else:
+                start = random.randint(0, len(text))
+                inserted = "".join(random.choice("ab\n") for _ in range(random.randint(1, 20)))
+                text = text[:start] + inserted + text[start:]
+                rope = rope.insert(start, inserted)
+            assert len(rope) == len(text)
+        assert str(rope) == text
+        check_balanced(rope.root)
+
+        for i in range(100):
+            start = random.randint(0, len(text))
+            end = random.randint(start, len(text))
+            assert rope.substring(start, end) == text[start:end]
+
+    def test_lines(self):
+        """
+        Test converting between offsets and lines and columns.
+        """
+        random.seed(SEED)
+        lines = ["x" * random.randint(0, 2 * CHUNK_SIZE) for i in range(100)]
+        text = "\n".join(lines)
+        rope = Rope(text)
+        assert rope.line_count() == len(lines)
+        offset = 0
+        for i, line in enumerate(lines):
+            assert rope.line_start(i + 1) == offset
+            assert rope.get_line(i + 1) == line
+            assert rope.offset(i + 1, 5) == offset + min(5, len(line))
+            assert rope.position(offset + len(line)) == (i + 1, len(line))
+            offset += len(line) + 1
+
+        assert Rope().line_count() == 1
+        assert Rope().get_line(1) == ""
+        assert Rope("a\n").get_line(2) == ""
+
+    def test_persistent(self):
+        """
+        Test that edits leave the original rope unchanged.
+        """
+        rope = Rope("hello world")
+        edited = rope.insert(5, ",").delete(0, 1)
+        assert str(rope) == "hello world"
+        assert str(edited) == "ello, world"
+
+class TestCellRope():
+    """
+    Tests for the rope of a Cell.
+    """
+
+    def test_local_edits(self):
+        """
+        Test that the rope follows local edits without being rebuilt.
+        """
+        random.seed(SEED)
+        cell = Cell(id="alice")
+        cell.append_text("first line\nsecond line")
+        rope = cell.get_rope()
+        cell.edit("2.0", "the ")
+        cell.edit("1.0", "", 6)
+        cell.append_text("\nthird line")
+        assert cell.rope is not rope
+        assert str(cell.rope) == cell.get_text()
+        assert cell.get_line_count() == 3
+        assert cell.get_line(2) == "the second line"
+        assert cell.offset("3.2") == cell.get_text().index("third") + 2
+        assert cell.index(cell.offset("3.2")) == "3.2"
+        assert cell.get_substring(0, 4) == "line"
+
+        for i in range(200):
+            if random.random() < 0.3 and cell.get_length():
+                cell.remove_many(random.randrange(cell.get_length()), 1)
+            else:
+                cell.edit(random.randint(0, cell.get_length()), random.choice(["a", "b\n", "cd"]))
+        assert str(cell.rope) == cell.get_text()
+
+    def test_merge(self):
+        """
+        Test that the rope reflects merges, snapshots and pickling.
+        """
+        alice = Cell(id="alice")
+        alice.append_text("hello\nworld")
+        bob = Cell(id="bob")
+        bob.merge(alice)
+        assert bob.get_line(2) == "world"
+
+        alice.insert_text(5, " there")
+        bob.remove_many(0, 1)
+        bob.merge(alice)
+        assert bob.get_line(1) == "ello there"
+
+        snapshot = bob.snapshot()
+        bob.append_text("!")
+        assert snapshot.get_line(2) == "world"
+        assert bob.get_line(2) == "world!"
+
+        restored = pickle.loads(pickle.dumps(bob))
+        assert restored.rope is None
+        assert restored.get_line(2) == "world!"
@@ -1,8 +1,13 @@
+import pickle
 import random
+import sys
 import uuid
 import pytest
 
-from crdt.sequence import Sequence
+from crdt import tree
+from crdt.columnar import ColumnarTree
+from crdt.sequence import OpId, Operation, Sequence, SequenceEvent, transform_delta
+from crdt.tree import ObjectTree
 
 SEED = 42
 
@@ -134,6 +139,418 @@ class TestSequence():
         assert a.merge(b).get() == ["a", "b", "c", "d", "\n", "x", "\n", "\n", "y", "\n", "1", "\n", "\n", "2"]
         assert b.merge(a).get() == ["a", "b", "c", "d", "\n", "a", "\n", "\n", "b", "\n", "1", "\n", "\n", "2"]
 
+    def test_snapshot(self):
+        """
+        Test that snapshots are not affected by later modifications.
+        """
+        a = Sequence(id="alice")
+        a.append_many(["a", "b", "c"])
+        snapshot = a.snapshot()
+
+        a.remove(1)
+        a.insert(0, "x")
+        a.append("d")
+        assert a.get() == ["x", "a", "c", "d"]
+        assert snapshot.get() == ["a", "b", "c"]
+
+        with pytest.raises(ValueError):
+            snapshot.append("e")
+
+        with pytest.raises(ValueError):
+            snapshot.remove(0)
+
+        b = Sequence(id="bob")
+        b.append("y")
+        a.merge(b)
+        assert snapshot.get() == ["a", "b", "c"]
+
+        # Snapshots can be merged into other sequences
+        c = Sequence(id="carol")
+        assert c.merge(snapshot).get() == ["a", "b", "c"]
+        assert snapshot.get() == ["a", "b", "c"]
+
+    @pytest.mark.parametrize("storage", [ObjectTree, ColumnarTree])
+    def test_snapshot_writers(self, storage):
+        """
+        Test that a writer which continues after a snapshot does not change the
+        snapshot, and that a copy of the snapshot does not change the writer.
+        """
+        a = Sequence(id="alice", storage=storage)
+        a.append("a")
+        a.append("b")
+        snapshot = a.snapshot()
+        a.insert(0, "x")
+        a.remove(2)
+        a.append("c")
+        assert snapshot.get() == ["a", "b"]
+
+        b = Sequence(id="bob", storage=storage)
+        b.merge(a)
+        copy = snapshot.copy()
+        assert copy.merge(b).get() == a.get() == ["x", "a", "c"]
+        copy.append("d")
+        assert a.get() == ["x", "a", "c"]
+        assert snapshot.get() == ["a", "b"]
+
+        # Random writers converge with the replicas merged from their snapshots
+        random.seed(SEED)
+        for i in range(20):
+            a = self.random_sequence()
+            b = Sequence(id=uuid.uuid4(), storage=storage)
+            b.merge(a)
+            snapshot = b.snapshot()
+            expected = snapshot.get()
+            for j in range(20):
+                if b.get_length() == 0 or random.random() < 0.3:
+                    b.append("y")
+                elif random.random() < 0.7:
+                    b.insert(random.randrange(b.get_length()), "y")
+                else:
+                    b.remove(random.randrange(b.get_length()))
+            a.merge(snapshot)
+            copy = snapshot.copy()
+            copy.merge(pickle.loads(pickle.dumps(b)))
+            b.merge(pickle.loads(pickle.dumps(a)))
+            assert snapshot.get() == expected
+            assert copy.get() == b.get()
+
+    def test_snapshot_sibling_lists(self):
+        """
+        Test that writing both sibling lists of a target after a snapshot copies each
+        list, so the sibling tables of the snapshot are unchanged.
+        """
+        for storage in [ObjectTree, ColumnarTree]:
+            a = Sequence(id="alice", storage=storage)
+            a.append_many(["a", "b"])
+            snapshot = a.snapshot()
+            before = {target: list(siblings) for target, siblings in snapshot.sequence.before.items()}
+            after = {target: list(siblings) for target, siblings in snapshot.sequence.after.items()}
+
+            # Both the before list and the after list of the first item are written
+            a.insert(0, "x")
+            a.remove(2)
+            a.append("c")
+            assert snapshot.sequence.before == before
+            assert snapshot.sequence.after == after
+            assert a.get() == ["x", "a", "c"]
+
+    def test_concurrent_inserts(self):
+        """
+        Test that concurrent inserts at the same target are ordered by their OpIds,
+        regardless of the order in which they are merged.
+        """
+        random.seed(SEED)
+        base = Sequence(id="base")
+        base.append("x")
+        replicas = []
+        for i in range(20):
+            replica = Sequence(id="r{:02}".format(i))
+            replica.merge(base)
+            replica.insert(0, "b{:02}".format(i))
+            replica.append("a{:02}".format(i))
+            replicas.append(replica)
+
+        merged = []
+        for _ in range(3):
+            target = Sequence(id="target")
+            target.merge(base)
+            for replica in random.sample(replicas, len(replicas)):
+                target.merge(replica)
+            merged.append(target.get())
+        # Inserts before the same target are ascending and inserts after it descending
+        expected = ["b{:02}".format(i) for i in range(20)] + ["x"] + ["a{:02}".format(i) for i in reversed(range(20))]
+        assert merged == [expected] * 3
+
+    def test_append(self):
+        """
+        Test that appends go after the last visible object when the end of the sequence
+        is removed or changed by a merge.
+        """
+        for storage in [ObjectTree, ColumnarTree]:
+            a = Sequence(id="alice", storage=storage)
+            a.append_many("abc")
+            a.remove(2)
+            a.append("d")
+            assert a.get() == ["a", "b", "d"]
+            assert a.get_length() == 3
+
+            b = Sequence(id="bob", storage=storage)
+            b.merge(a)
+            b.append("e")
+            a.merge(b)
+            a.append("f")
+            assert a.get() == ["a", "b", "d", "e", "f"]
+
+            # With every object removed, the next append starts a new root
+            a.remove_many(0, 5)
+            assert a.get_tail() is None
+            a.append("g")
+            b.merge(a)
+            assert a.get() == b.get() == ["g"]
+            assert b.get_length() == 1
+
+    def test_convergence(self):
+        """
+        Test that many replicas which edit concurrently and merge in arbitrary orders
+        converge to the same sequence.
+        """
+        random.seed(SEED)
+        for trial in range(20):
+            replicas = [Sequence(id="replica{}".format(i)) for i in range(4)]
+            for step in range(60):
+                seq = random.choice(replicas)
+                size = len(seq.get())
+                action = random.random()
+                if size == 0 or action < 0.4:
+                    seq.append(random.choice("abc"))
+                elif action < 0.8:
+                    seq.insert(random.randrange(size), random.choice("xyz"))
+                else:
+                    seq.remove(random.randrange(size))
+                if random.random() < 0.3:
+                    a, b = random.sample(replicas, 2)
+                    a.merge(pickle.loads(pickle.dumps(b)))
+
+            for a in replicas:
+                for b in replicas:
+                    if a is not b:
+                        a.merge(pickle.loads(pickle.dumps(b)))
+            assert all(seq.get() == replicas[-1].get() for seq in replicas)
+
+    def test_block_index(self, monkeypatch):
+        """
+        Test that the index of each block of an ObjectTree is kept up to date when
+        blocks are split and copied after a snapshot.
+        """
+        monkeypatch.setattr(tree, "BLOCK_SIZE", 4)
+        a = Sequence(id="alice")
+        for char in "hello world":
+            a.append(char)
+        snapshot = a.snapshot()
+        for char in "goodbye":
+            a.insert(3, char)
+        for seq in [a, snapshot]:
+            assert len(seq.sequence.blocks) > 2
+            for i, block in enumerate(seq.sequence.blocks):
+                assert seq.sequence.block_index[block] == i
+        assert "".join(snapshot.get()) == "hello world"
+
+    def test_small_blocks(self, monkeypatch):
+        """
+        Test that the positions in an ObjectTree stay correct when its blocks are split
+        and shared with snapshots.
+        """
+        monkeypatch.setattr(tree, "BLOCK_SIZE", 4)
+        random.seed(SEED)
+        a = self.random_sequence()
+        b = self.random_sequence()
+        a.merge(b)
+        expected = a.get()
+        snapshot = a.snapshot()
+        a.insert(0, "x")
+        a.remove(len(a.get()) // 2)
+        assert snapshot.get() == expected
+        assert pickle.loads(pickle.dumps(a)).get() == a.get()
+        assert pickle.loads(pickle.dumps(snapshot)).get() == expected
+
+        objects = a.get_objects()
+        engine = a.sequence
+        assert [engine.position(obj.operation) for obj in objects] == list(range(len(objects)))
+        assert engine.visible_operations(3, 5) == [obj.operation for obj in objects[3:8]]
+        assert all(len(block.nodes) <= tree.BLOCK_SIZE for block in engine.blocks)
+
+    def test_digest(self):
+        """
+        Test that digests are equal for replicas with the same operations.
+        """
+        random.seed(SEED)
+        a = self.random_sequence()
+        b = self.random_sequence()
+        assert a.get_digest() != b.get_digest()
+
+        # The digest does not depend on the order in which operations were added
+        c = Sequence(id="carol")
+        c.merge(b)
+        c.merge(a)
+        a.merge(b)
+        assert a.get_digest() == b.get_digest() == c.get_digest()
+
+        a.append("x")
+        assert a.get_digest() != b.get_digest()
+        b.merge(a)
+        assert a.get_digest() == b.get_digest()
+        assert pickle.loads(pickle.dumps(a)).get_digest() == a.get_digest()
+        assert a.snapshot().get_digest() == a.get_digest()
+
+    def test_snapshot_pickle(self):
+        """
+        Test that pickled snapshots can be merged by a remote replica.
+        """
+        a = Sequence(id="alice")
+        a.append_many(["a", "b"])
+        remote = pickle.loads(pickle.dumps(a.snapshot()))
+        assert not remote.frozen
+
+        remote.append("c")
+        assert a.merge(remote).get() == ["a", "b", "c"]
+
+    def apply_event(self, items, event):
+        """
+        Applies the delta in a SequenceEvent to a list of items.
+        """
+        for action, position, value in event.changes():
+            if action == "insert":
+                items[position:position] = value
+            else:
+                del items[position:position + value]
+
+    def test_subscribe(self):
+        """
+        Test that subscribers are notified of local changes.
+        """
+        a = Sequence(id="alice")
+        events = []
+        a.subscribe(events.append)
+
+        a.append("a")
+        a.append("b")
+        a.insert(1, "c")
+        a.remove(0)
+        assert [event.delta for event in events] == [
+            [("insert", ["a"])],
+            [("retain", 1), ("insert", ["b"])],
+            [("retain", 1), ("insert", ["c"])],
+            [("delete", 1)],
+        ]
+        assert all(event.local for event in events)
+        assert all(event.sequence is a for event in events)
+
+        a.unsubscribe(events.append)
+        a.append("d")
+        assert len(events) == 4
+
+    def test_subscribe_merge(self):
+        """
+        Test that the events from merges can be applied to reproduce the sequence.
+        """
+        random.seed(SEED)
+        for i in range(20):
+            a = self.random_sequence()
+            b = self.random_sequence()
+            items = a.get()
+            events = []
+            a.subscribe(events.append)
+            a.merge(b)
+            for event in events:
+                assert not event.local
+                self.apply_event(items, event)
+            assert items == a.get()
+
+            # Merging again does not change anything
+            events.clear()
+            a.merge(b)
+            assert events == []
+
+    def test_batch_operations(self):
+        """
+        Test that bulk operations tick the clock once for consecutive operation IDs and
+        notify the subscribers once.
+        """
+        a = Sequence(id="alice")
+        events = []
+        a.subscribe(events.append)
+        a.append_many("abc")
+        a.insert_many(1, "xy")
+        a.remove_many(0, 3)
+        assert a.get() == ["b", "c"]
+        assert a.clock.get() == 8
+        assert sorted(op.owner.id for op in a.operations.get()) == list(range(1, 9))
+        assert [event.delta for event in events] == [
+            [("insert", ["a", "b", "c"])],
+            [("retain", 1), ("insert", ["x", "y"])],
+            [("delete", 3)],
+        ]
+
+    def test_transaction(self):
+        """
+        Test that the events of the changes in a transaction are combined into one
+        event, which can be applied to reproduce the sequence.
+        """
+        random.seed(SEED)
+        for i in range(20):
+            a = self.random_sequence()
+            items = a.get()
+            events = []
+            a.subscribe(events.append)
+            with a.transaction():
+                for j in range(20):
+                    position = random.randint(0, a.get_length())
+                    if random.random() < 0.5 and position < a.get_length():
+                        a.remove_many(position, random.randint(1, a.get_length() - position))
+                    elif position < a.get_length():
+                        a.insert_many(position, random.sample("abcdef", 2))
+                    else:
+                        a.append(random.choice("abcdef"))
+                    # Nested transactions are delivered by the outermost transaction
+                    with a.transaction():
+                        a.append("z")
+                assert events == []
+            assert len(events) <= 1
+            for event in events:
+                self.apply_event(items, event)
+            assert items == a.get()
+
+    def random_delta(self, length):
+        """
+        Returns a random delta for a sequence of the given length.
+        """
+        delta = []
+        position = 0
+        while position < length:
+            count = random.randint(1, length - position)
+            delta.append((random.choice(["retain", "delete"]), count))
+            position += count
+            if random.random() < 0.5:
+                delta.append(("insert", [random.choice("xyz") for i in range(random.randint(1, 3))]))
+        return delta
+
+    def test_transform_delta(self):
+        """
+        Test that two concurrent deltas rebased over each other give the same result in
+        either order.
+        """
+        random.seed(SEED)
+        for i in range(200):
+            items = list("abcdefgh")
+            a = self.random_delta(len(items))
+            b = self.random_delta(len(items))
+            left = list(items)
+            for delta in (a, transform_delta(b, a, first=False)):
+                self.apply_event(left, SequenceEvent(None, delta))
+            right = list(items)
+            for delta in (b, transform_delta(a, b, first=True)):
+                self.apply_event(right, SequenceEvent(None, delta))
+            assert left == right
+
+    def test_operations(self):
+        """
+        Test that operations are compact and can be pickled.
+        """
+        a = Sequence(id="alice")
+        a.append_many(["a", "b", "c"])
+        for op in a.operations.get():
+            assert not hasattr(op, "__dict__")
+            assert not hasattr(op.owner, "__dict__")
+
+        # Node names are interned when operations are unpickled
+        ops = pickle.loads(pickle.dumps(list(a.operations.get())))
+        assert ops[0].owner.node is ops[1].owner.node
+        assert ops[0].owner.node is sys.intern("alice")
+        assert set(ops) == a.operations.get()
+
+        with pytest.raises(ValueError):
+            Operation(owner=OpId("alice", 10), action="insert")
+
     def test_associative(self):
         """
         Tests that the associative property holds -> A + (B + C) == (A + B) + C.
@@ -0,0 +1,49 @@
+import threading
+
+from sim.harness import Partition, Simulation
+
+class TestSimulation():
+    """
+    Tests for the simulation harness.
+    """
+
+    def test_partition(self):
+        """
+        Test that replicas converge after a partition heals.
+        """
+        partition = Partition(5, 20, [[0, 1], [2, 3]])
+        simulation = Simulation(replicas=4, steps=30, topology="ring", partitions=[partition])
+        report = simulation.run()
+        assert report.converged
+        assert report.failed_syncs > 0
+        assert report.bytes_sent > 0
+        assert report.merge_latency[50] <= report.merge_latency[99]
+        assert report.memory_per_replica > 0
+
+    def test_loopback(self):
+        """
+        Test that replicas converge when syncing over loopback sockets.
+        """
+        active = threading.active_count()
+        simulation = Simulation(replicas=3, steps=10, topology="star", transport="loopback")
+        threads = [thread for client in simulation.clients for thread in client.threads]
+        report = simulation.run()
+        assert report.converged
+        assert report.messages > 0
+        # The listener and worker threads of the replicas are stopped
+        assert threads and not any(thread.is_alive() for thread in threads)
+        assert threading.active_count() <= active
+
+    def test_shared(self):
+        """
+        Test that replicas converge when syncing through shared memory.
+        """
+        active = threading.active_count()
+        simulation = Simulation(replicas=3, steps=10, topology="star", transport="shared")
+        threads = [thread for client in simulation.clients for thread in client.threads]
+        report = simulation.run()
+        assert report.converged
+        assert report.messages > 0
+        # The listener and worker threads of the replicas are stopped
+        assert threads and not any(thread.is_alive() for thread in threads)
+        assert threading.active_count() <= active
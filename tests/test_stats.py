@@ -0,0 +1,77 @@
+from client.client import NotebookClient
+from client.stats import BUCKETS, Histogram, SyncStats, format_stats
+
+class TestHistogram():
+    """
+    Tests for the Histogram class.
+    """
+
+    def test_percentile(self):
+        """
+        Test that percentiles are estimated by the upper bound of their bucket.
+        """
+        histogram = Histogram()
+        assert histogram.percentile(50) == 0.0
+        for _ in range(90):
+            histogram.record(0.00005)
+        for _ in range(10):
+            histogram.record(0.5)
+        assert histogram.count == 100
+        assert histogram.percentile(50) == BUCKETS[0]
+        assert histogram.percentile(99) == 0.5
+        assert histogram.max == 0.5
+
+        # Values beyond the last bucket are counted in the overflow bucket
+        histogram.record(1000)
+        buckets = histogram.to_dict()["buckets"]
+        assert len(buckets) == len(BUCKETS) + 1
+        assert buckets[0] == (BUCKETS[0], 90)
+        assert buckets[-1] == (float("inf"), 101)
+        assert histogram.percentile(100) == 1000
+
+class TestSyncStats():
+    """
+    Tests for the SyncStats class.
+    """
+
+    def test_timer(self):
+        """
+        Test that timed phases and counters are included in snapshots.
+        """
+        stats = SyncStats()
+        with stats.timer("merge"):
+            pass
+        stats.count("syncs")
+        stats.count("bytes", 10)
+        stats.count("bytes", 5)
+        snapshot = stats.snapshot()
+        assert snapshot["counters"] == {"syncs": 1, "bytes": 15}
+        assert snapshot["phases"]["merge"]["count"] == 1
+        assert "merge" in format_stats(snapshot)
+
+    def test_client_stats(self):
+        """
+        Test that a client records the phases of syncs and reports them to local
+        processes.
+        """
+        bob = NotebookClient(0, [], name="bob", workers=2)
+        bob.host()
+        alice = NotebookClient(0, ["bob:{}".format(bob.port)], name="alice")
+        alice.create_cell()
+        alice.update_cell(0, "hello")
+        alice.sync("bob")
+        alice.sync("bob")
+
+        counters = alice.stats.snapshot()["counters"]
+        assert counters["sync.syncs"] == 2
+        assert counters["sync.in_sync"] == 1
+        assert counters["sync.pushes"] == 1
+        assert counters["sync.messages"] == 3
+
+        stats = alice.query_stats("bob")
+        assert stats["counters"]["listen.messages"] == 3
+        for phase in ["listen.receive", "listen.deserialize", "listen.serialize", "listen.send", "merge", "lock_wait"]:
+            assert stats["phases"][phase]["count"] > 0
+        phases = alice.stats.snapshot()["phases"]
+        for phase in ["sync.serialize", "sync.send", "sync.receive", "sync.deserialize", "sync.total", "merge"]:
+            assert phases[phase]["count"] > 0
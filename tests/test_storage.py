@@ -0,0 +1,38 @@
+from client.client import NotebookClient
+from client.storage import NotebookStore
+
+class TestNotebookStore():
+    """
+    Tests for the NotebookStore class.
+    """
+
+    def test_save_load(self, tmp_path):
+        """
+        Test that notebooks can be saved and loaded.
+        """
+        store = NotebookStore(str(tmp_path))
+        assert store.load("default") is None
+
+        client = NotebookClient(55101, [], name="alice", store=store)
+        client.create_cell()
+        client.update_cell(0, "persisted")
+        client.save()
+        assert [p.name for p in tmp_path.iterdir()] == ["default.notebook"]
+
+        # A restarted client loads the persisted notebook
+        restarted = NotebookClient(55101, [], name="alice", store=store)
+        assert restarted.get_cell_data() == ["persisted"]
+
+    def test_distinct_paths(self, tmp_path):
+        """
+        Test that notebook IDs which differ only in special characters are stored in
+        separate files.
+        """
+        store = NotebookStore(str(tmp_path))
+        store.save("a:b", ["colon"])
+        store.save("a/b", ["slash"])
+        store.save("a_b", ["underscore"])
+        assert store.load("a:b") == ["colon"]
+        assert store.load("a/b") == ["slash"]
+        assert store.load("a_b") == ["underscore"]
+        assert len(list(tmp_path.iterdir())) == 3
@@ -1,5 +1,6 @@
 import random
 
+from crdt.sequence import OpId
 from crdt.twopset import TwoPhaseSet
 
 SEED = 42
@@ -74,4 +75,54 @@ class TestTwoPhaseSet():
             a = self.randomTwoPhaseSet()
             left = a.merge(a)
             right = a
-            assert left.get() == right.get()
\ No newline at end of file
+            assert left.get() == right.get()
+
+    def test_opids(self):
+        """
+        Test that removed OpIds are stored as intervals and the live items stay up to
+        date through merges.
+        """
+        a = TwoPhaseSet()
+        for i in range(100):
+            a.add(OpId("alice", i))
+        b = TwoPhaseSet()
+        b.merge(a)
+        for i in range(10, 90):
+            b.remove(OpId("alice", i))
+        assert b.removed.ids["alice"].intervals() == [(10, 90)]
+        assert len(b.get()) == 20
+
+        a.add(OpId("alice", 100))
+        a.merge(b)
+        assert a.get() == {OpId("alice", i) for i in list(range(10)) + list(range(90, 101))}
+        b.merge(a)
+        assert b.get() == a.get()
+
+    def test_get_copy(self):
+        """
+        Test that changing the returned items does not change the set.
+        """
+        a = TwoPhaseSet()
+        a.add("a")
+        items = a.get()
+        a.add("b")
+        assert items == {"a"}
+        assert a.get() == {"a", "b"}
+        assert not hasattr(items, "add")
+
+    def test_get_cached(self):
+        """
+        Test that get() returns the same items until the set changes.
+        """
+        a = TwoPhaseSet()
+        a.add("a")
+        items = a.get()
+        assert a.get() is items
+        a.remove("a")
+        assert a.get() == set()
+        b = TwoPhaseSet()
+        b.add("b")
+        items = a.get()
+        a.merge(b)
+        assert items == set()
+        assert a.get() == {"b"}
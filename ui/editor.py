@@ -1,23 +1,51 @@
+import queue
+import threading
+import time
 import tkinter as tk
 
+from client.pipeline import EditPipeline
+
+# Default window in milliseconds for coalescing keystrokes
+DEFAULT_EDIT_WINDOW = 100
+
+# Interval in milliseconds at which the UI thread runs the updates queued by other
+# threads
+POLL_INTERVAL = 50
+
 class NotebookEditor():
     """
     NotebookEditor defines the UI for a simple notebook editor using tkinter. It
     optionally takes a DistributedNotebook object as input to synchronize with.
     """
-    def __init__(self, client=None):
+    def __init__(self, client=None, edit_window=DEFAULT_EDIT_WINDOW):
         self.root = tk.Tk()
         self.root.title(client.name if client is not None else "Untitled Notebook")
         self.client = client
         self.cells = []
+        # Keystrokes within the edit window (in milliseconds) are coalesced into a
+        # single edit, which is applied to the client by the pipeline
+        self.edit_window = edit_window
+        self.edited = set()
+        self.edit_timer = None
+        self.pipeline = None
+        # Set while the UI itself modifies the text widgets, so that the changes are
+        # not recorded as user edits
+        self.patching = False
+        # Tk may only be used from the UI thread, so other threads queue the updates as
+        # (callback, args) tuples, which the UI thread runs in poll()
+        self.updates = queue.Queue()
         if self.client is not None:
+            self.pipeline = EditPipeline(self.client)
             for peer in self.client.get_peers():
                 tk.Button(self.root, text="sync with {}".format(peer), command=lambda p=peer: self.sync(p)).pack(side="top")
+            if len(self.client.get_peers()) > 1:
+                tk.Button(self.root, text="sync with all", command=self.sync).pack(side="top")
+            # Shows the result of the last sync with each peer
+            self.status = tk.Label(self.root, text="")
+            self.status.pack(side="top")
             self.client.attach_editor(self)
 
     def add_cell(self, after=None):
-        cell = self.create_cell_frame()
-
         # Figure out if where to insert or append the cell based on which cell the add
         # button was clicked
         if after in self.cells:
@@ -25,14 +53,19 @@ class NotebookEditor():
         else:
             index = len(self.cells)
 
-        if index >= len(self.cells):
-            self.cells.append(cell)
-            if self.client is not None:
-                self.client.create_cell()
+        if self.client is not None:
+            # The cell frame is created by render() from the client's state
+            self.flush_edits()
+            with self.client.transaction() as notebook:
+                # The editor may not show all the cells of the notebook yet
+                if index < len(self.cells):
+                    index = self.pipeline.client_index(index)
+                if index is None or index >= notebook.get_length():
+                    notebook.create_cell()
+                else:
+                    notebook.create_cell(index)
         else:
-            self.cells.insert(index, cell)
-            if self.client is not None:
-                self.client.create_cell(index)
+            self.cells.insert(index, self.create_cell_frame())
         self.render()
 
     def create_cell_frame(self, after=None, initial_text=''):
@@ -46,55 +79,234 @@ class NotebookEditor():
         # Text editor widget
         text = tk.Text(cell, wrap="char", highlightbackground="gray")
         text.insert("end", initial_text)
-        text.bind("<KeyRelease>", self.edit_cell_callback)
         text.pack()
+        cell.text = text
+        cell.edits = []
+        if self.client is not None:
+            self.intercept_edits(cell)
 
         # Button to insert a new cell
         add = tk.Button(cell, text="+", command=lambda: self.add_cell(cell))
         add.pack(side="bottom")
         return cell
 
-    def edit_cell_callback(self, event):
-        cell = event.widget.master
-        if self.client is not None:
-            # If a notebook client is attached, send the new text to the correct notebook cell
-            self.client.update_cell(self.cells.index(cell), event.widget.get("1.0", "end-1c"))
+    def intercept_edits(self, cell):
+        """
+        Replaces the Tcl command of the cell's text widget with a proxy which records
+        the position of every insert and delete. This allows the edits to be sent to
+        the client directly, without diffing the text of the cell.
+        """
+        widget = cell.text
+        original = widget._w + "_original"
+        widget.tk.call("rename", widget._w, original)
+
+        def proxy(command, *args):
+            if not self.patching:
+                self.record_edit(cell, original, command, args)
+            return widget.tk.call((original, command) + args)
+        widget.tk.createcommand(widget._w, proxy)
+
+    def record_edit(self, cell, original, command, args):
+        """
+        Records an edit to the text widget of a cell, given the widget command which is
+        about to be executed. The edit is sent to the notebook cell once the edit window
+        has passed.
+        """
+        if command not in ("insert", "delete", "replace", "edit"):
+            return
+        call = cell.text.tk.call
+
+        # Convert the tkinter indexes to character offsets, clamped to the end of the
+        # text since the widget always has a trailing newline
+        length = call(original, "count", "-chars", "1.0", "end-1c") or 0
+        def offset(index):
+            return min(max(call(original, "count", "-chars", "1.0", index) or 0, 0), length)
+
+        if command == "insert" and len(args) >= 2:
+            edit = (offset(args[0]), "".join(args[1::2]), 0)
+        elif command == "delete" and len(args) in (1, 2):
+            start = offset(args[0])
+            end = offset(args[1]) if len(args) == 2 else min(start + 1, length)
+            edit = (start, "", max(end - start, 0))
+        elif command == "replace" and len(args) >= 3:
+            start = offset(args[0])
+            end = offset(args[1])
+            edit = (start, "".join(args[2::2]), max(end - start, 0))
+        elif command == "edit" and args and args[0] not in ("undo", "redo"):
+            return
+        else:
+            # The positions of the edit are unknown, so the full text is sent instead
+            edit = None
+
+        if edit is None:
+            cell.edits = None
+        elif cell.edits is not None:
+            if not edit[1] and not edit[2]:
+                return
+            last = cell.edits[-1] if cell.edits else None
+            if last is not None and not edit[2] and edit[0] == last[0] + len(last[1]):
+                # Typing produces a run of inserts which are combined into one edit
+                cell.edits[-1] = (last[0], last[1] + edit[1], last[2])
+            else:
+                cell.edits.append(edit)
+
+        self.edited.add(cell)
+        if self.edit_timer is None:
+            self.edit_timer = self.root.after(self.edit_window, self.submit_edits)
+
+    def submit_edits(self):
+        """
+        Submits the edits made to cells during the edit window to the pipeline. This is
+        called when the edit window has passed, or earlier to cut the window short.
+        """
+        if self.edit_timer is not None:
+            self.root.after_cancel(self.edit_timer)
+            self.edit_timer = None
+        for cell in self.edited:
+            if cell not in self.cells:
+                continue
+            index = self.cells.index(cell)
+            if cell.edits is None:
+                self.pipeline.submit(index, cell.text.get("1.0", "end-1c"))
+            elif cell.edits:
+                self.pipeline.submit_edits(index, cell.edits)
+            cell.edits = []
+        self.edited.clear()
+
+    def flush_edits(self):
+        """
+        Applies all outstanding edits to the client before the cells are changed.
+        """
+        self.submit_edits()
+        self.pipeline.flush()
 
     def remove_cell(self, cell):
+        index = self.cells.index(cell)
         if self.client is not None:
-            self.client.remove_cell(self.cells.index(cell))
-        self.cells.remove(cell)
+            # The cell frame is removed by render() from the client's state
+            self.flush_edits()
+            with self.client.transaction() as notebook:
+                index = self.pipeline.client_index(index)
+                if index is not None:
+                    notebook.remove_cell(index)
+            self.render()
+            return
+        del self.cells[index]
         cell.destroy()
 
-    def sync(self, peer):
-        self.client.sync(peer)
-        self.render()
+    def sync(self, peer=None):
+        """
+        Syncs with a peer, or with all the peers if no peer is specified. The sync runs
+        on a background thread so that the UI stays responsive while waiting for the
+        peers, and the editor is rendered by changed() if the sync changed the notebook.
+        """
+        self.flush_edits()
+        peers = None if peer is None else [peer]
+        self.status.config(text="Syncing...")
+        threading.Thread(target=self.run_sync, args=(peers,), daemon=True).start()
+
+    def run_sync(self, peers):
+        results = self.client.sync_all(peers=peers)
+        # Widgets may only be updated from the UI thread
+        self.updates.put((self.sync_done, (results,)))
+
+    def sync_done(self, results):
+        self.status.config(text=", ".join(repr(result) for result in results.values()))
+
+    def changed(self):
+        """
+        Called by the client when a sync changed the notebook, possibly from another
+        thread, so the render is queued for the UI thread. No Tk method is called here,
+        since Tk may only be used from the UI thread.
+        """
+        self.updates.put((self.render, ()))
+
+    def poll(self):
+        """
+        Runs the updates queued by other threads on the UI thread, and schedules the
+        next poll.
+        """
+        while True:
+            try:
+                callback, args = self.updates.get_nowait()
+            except queue.Empty:
+                break
+            callback(*args)
+        self.root.after(POLL_INTERVAL, self.poll)
 
     def render(self):
         """
-        Refresh the UI to reflect the current state of the notebook.
+        Refresh the UI to reflect the current state of the notebook. The changes since
+        the last render are taken from the pipeline, which observes the notebook, so
+        only the changed cells are updated and the cost of a render depends on the size
+        of the changes. Text widgets are patched in place so that the cursor and scroll
+        positions are preserved. This must be called on the UI thread, and other
+        threads call changed() instead.
         """
         if self.client is not None:
-            # Delete the current cells
-            for cell in self.cells:
-                cell.destroy()
-            self.cells = []
-
-            # Recreate all the cells with the client's current state
-            cell_data = self.client.get_cell_data()
-            for text in cell_data:
-                cell = self.create_cell_frame(initial_text=text)
-                cell.pack(side="top", fill="both", expand=True)
-                self.cells.append(cell)
+            start = time.perf_counter()
+            # The changes are rebased through the edits which are submitted first
+            self.submit_edits()
+            cells, deltas = self.pipeline.take_changes()
+            index = 0
+            for action, value in cells:
+                if action == "retain":
+                    index += value
+                elif action == "insert":
+                    for text in value:
+                        self.insert_cell_frame(index, text)
+                        index += 1
+                else:
+                    for k in range(value):
+                        self.cells.pop(index).destroy()
+            for index, delta in deltas.items():
+                self.patch_cell(index, delta)
+            self.client.stats.record("render", time.perf_counter() - start)
         else:
             for cell in self.cells:
                 cell.pack_forget()
             for cell in self.cells:
                 cell.pack(side="top", fill="both", expand=True)
 
+    def insert_cell_frame(self, index, text):
+        """
+        Creates a cell frame with the given text and packs it at the given index.
+        """
+        cell = self.create_cell_frame(initial_text=text)
+        if index < len(self.cells):
+            cell.pack(side="top", fill="both", expand=True, before=self.cells[index])
+        else:
+            cell.pack(side="top", fill="both", expand=True)
+        self.cells.insert(index, cell)
+
+    def patch_cell(self, index, delta):
+        """
+        Applies a delta of characters (see SequenceEvent) to the text widget of a cell.
+        """
+        widget = self.cells[index].text
+        position = 0
+        self.patching = True
+        try:
+            for action, value in delta:
+                if action == "retain":
+                    position += value
+                elif action == "insert":
+                    widget.insert("1.0+{}c".format(position), "".join(value))
+                    position += len(value)
+                else:
+                    widget.delete("1.0+{}c".format(position), "1.0+{}c".format(position + value))
+        finally:
+            self.patching = False
+
     def start(self):
         """
         Start the UI. Note that this method blocks until the UI is closed.
         """
+        if self.pipeline is not None:
+            for text in self.pipeline.start():
+                self.insert_cell_frame(len(self.cells), text)
+            self.poll()
         self.add_cell()
-        self.root.mainloop()
\ No newline at end of file
+        self.root.mainloop()
+        if self.pipeline is not None:
+            self.pipeline.stop()
\ No newline at end of file